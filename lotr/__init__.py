@@ -1,17 +1,60 @@
 __version__ = "1.0.2"
 __author__ = "Luigi Petrucco @ portugueslab"
 
-from pathlib import Path
+# Importing lotr does not touch the filesystem or the network: the dataset location
+# (that might require downloading the sample dataset) and all derived paths are
+# resolved the first time they are accessed, and then cached in the module
+# namespace. Heavy submodules are imported on first access as well.
+_LAZY_ATTRIBUTES = ("DATASET_LOCATION", "FIGURES_LOCATION", "A_FISH", "dataset_folders")
+_LAZY_IMPORTS = dict(LotrExperiment="lotr.experiment_class")
 
-from lotr.experiment_class import LotrExperiment
-from lotr.file_utils import get_dataset_location, get_figures_location
 
-DATASET_LOCATION = get_dataset_location()
-FIGURES_LOCATION = get_figures_location()
+def _resolve(name):
+    from lotr.file_utils import get_dataset_location, get_figures_location
 
-# The example fish for demonstrative figures
-A_FISH = DATASET_LOCATION / "lightsheet" / "210314_f1" / "210314_f1_natmov"
+    if name == "DATASET_LOCATION":
+        return get_dataset_location()
+    elif name == "FIGURES_LOCATION":
+        return get_figures_location()
+    elif name == "A_FISH":
+        # The example fish for demonstrative figures
+        return (
+            __getattr__("DATASET_LOCATION")
+            / "lightsheet"
+            / "210314_f1"
+            / "210314_f1_natmov"
+        )
+    elif name == "dataset_folders":
+        return sorted(
+            [
+                f.parent
+                for f in __getattr__("DATASET_LOCATION").glob(
+                    "lightsheet/*[0-9]_f[0-9]*/*/selected.h5"
+                )
+            ]
+        )
 
-dataset_folders = sorted(
-    [f.parent for f in DATASET_LOCATION.glob("lightsheet/*[0-9]_f[0-9]*/*/selected.h5")]
-)
+
+def __getattr__(name):
+    # Also called explicitly from _resolve, where the value might be cached already:
+    if name in globals():
+        return globals()[name]
+
+    if name in _LAZY_ATTRIBUTES:
+        value = _resolve(name)
+    elif name in _LAZY_IMPORTS:
+        from importlib import import_module
+
+        value = getattr(import_module(_LAZY_IMPORTS[name]), name)
+    else:
+        raise AttributeError(f"module 'lotr' has no attribute '{name}'")
+
+    # Cache in the module namespace, so that __getattr__ is not called again:
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(
+        list(globals().keys()) + list(_LAZY_ATTRIBUTES + tuple(_LAZY_IMPORTS))
+    )
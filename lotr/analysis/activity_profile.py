@@ -1,34 +1,78 @@
 import numpy as np
 
-from lotr.utils import roll_columns_jit
+from lotr.utils import interp_weights
 
 
-def resample_and_shift(exp, n_bins_resampling=100):
-    """Function that returns the angle-shifted bump of activity over time
-    from one experiment. Tutorial in the '3. Activation profile.ipynb' notebook.
-    """
-    sort_idxs = np.argsort(exp.rpc_angles)
+def resample_and_shift_traces(
+    traces, angles, network_phase, n_bins_resampling=100, circular=False
+):
+    """Resample activity over the (-pi, pi) interval of ROI angles, and shift it
+    over time to have the bump centered.
+
+    As the ROI angles are fixed for the whole experiment, the resampling is a
+    single product with a sparse matrix of interpolation weights, and the shift a
+    single gather.
 
+    Parameters
+    ----------
+    traces : np.array
+        (n_pts, n_rois) array of traces.
+    angles : np.array
+        (n_rois,) array with the angle of every ROI (e.g., the rPC angles).
+    network_phase : np.array
+        (n_pts,) array with the network phase.
+    n_bins_resampling : int
+        Number of angular bins for the resampling.
+    circular : bool
+        If true, the interpolation wraps around at +/- pi; otherwise, bins beyond
+        the extreme ROI angles take the value of the extreme ROI.
+
+    Returns
+    -------
+    np.array
+        (n_pts, n_bins_resampling) array of activity resampled over angles.
+    np.array
+        (n_pts, n_bins_resampling) array of resampled activity with the bump
+        centered.
+
+    """
     # we will resample over the (-pi, pi) interval
     resampling_base = np.linspace(-np.pi, np.pi, n_bins_resampling)
 
-    angle_resampled_traces = np.zeros((exp.n_pts, n_bins_resampling))
-    for i in range(exp.n_pts):
-        angle_resampled_traces[i, :] = np.interp(
-            resampling_base,
-            exp.rpc_angles[sort_idxs],
-            exp.traces[i, exp.hdn_indexes[sort_idxs]],
-        )
+    sort_idxs = np.argsort(angles)
+    weights = interp_weights(
+        resampling_base, angles[sort_idxs], period=2 * np.pi if circular else None
+    )
+    # Interpolation weights in the order of the ROIs in the traces:
+    weights = weights[:, np.argsort(sort_idxs)]
+
+    angle_resampled_traces = np.asarray(weights @ np.asarray(traces).T).T
 
     # Find the right amount of shift over time to have the bump centered:
     # by first stretching phase to (-0.5, 0.5) interval and then
     # to (-n_rois//2, n_rois//2) interval. In this way, we will center phase 0 of
     # the network on position of angle 0
-    phase_shifts_res = (exp.network_phase / (2 * np.pi)) * (n_bins_resampling - 1)
+    phase_shifts_res = (network_phase / (2 * np.pi)) * (n_bins_resampling - 1)
 
-    # Then, apply shifts to traces:
-    reshaped_traces = roll_columns_jit(
-        angle_resampled_traces, -np.round(phase_shifts_res)
+    # Then, apply shifts to traces, as rolling every row by -shift:
+    shifts = np.round(phase_shifts_res).astype(int)
+    source_cols = np.mod(
+        np.arange(n_bins_resampling) + shifts[:, np.newaxis], n_bins_resampling
     )
+    reshaped_traces = np.take_along_axis(angle_resampled_traces, source_cols, axis=1)
 
     return angle_resampled_traces, reshaped_traces
+
+
+def resample_and_shift(exp, n_bins_resampling=100, circular=False):
+    """Function that returns the angle-shifted bump of activity over time
+    from one experiment. Tutorial in the '3. Activation profile.ipynb' notebook.
+    See resample_and_shift_traces for the parameters.
+    """
+    return resample_and_shift_traces(
+        exp.traces[:, exp.hdn_indexes],
+        exp.rpc_angles,
+        exp.network_phase,
+        n_bins_resampling=n_bins_resampling,
+        circular=circular,
+    )
@@ -1,12 +1,31 @@
 import numpy as np
-from numba import njit, prange
+
+from lotr.utils import rolling_corr
 
 
-@njit(parallel=True)
 def quantify_corr_with_heading(phase, fictive_heading, wnd_pts=500):
-    correlations = np.zeros(len(phase) - 2 * wnd_pts)
-    for i in prange(len(correlations)):
-        t_slice = slice(i, i + wnd_pts * 2)
-        correlations[i] = np.corrcoef(phase[t_slice], fictive_heading[t_slice])[0, 1]
+    """Correlation between network phase and fictive heading in sliding windows of
+    2 * wnd_pts points.
+
+    Parameters
+    ----------
+    phase : np.array
+        (n_pts,) unwrapped network phase, or (n_pts, n_traces) array for multiple
+        phase/heading pairs.
+    fictive_heading : np.array
+        Fictive heading, with the same shape of phase.
+    wnd_pts : int or list of int
+        Half width of the window, or list of half widths.
+
+    Returns
+    -------
+    np.array or list of np.array
+        (n_pts - 2 * wnd_pts,) array (or (n_pts - 2 * wnd_pts, n_traces)) of
+        correlations of the windows starting at every point; list of arrays for
+        multiple window sizes.
 
-    return correlations
+    """
+    correlations = rolling_corr(phase, fictive_heading, 2 * np.asarray(wnd_pts))
+    if np.ndim(wnd_pts) == 0:
+        return correlations[:-1]
+    return [c[:-1] for c in correlations]
@@ -1,24 +1,31 @@
 import numpy as np
 import pandas as pd
 
-from lotr import dataset_folders
+import lotr
 from lotr.experiment_class import LotrExperiment
 
 
-def get_pooled_cell_info():
+def _get_cell_info(exp):
+    coords = exp.coords_um
+    cent_coords = exp.ipnref_coords_um
+
+    data_dict = {f"c{i}": coords[:, i] for i in range(3)}
+    data_dict.update({f"centered{i}": cent_coords[:, i] for i in range(3)})
+    data_dict["fid"] = exp.root.name
+    data_dict["hdn"] = np.full(exp.n_rois, False)
+    data_dict["hdn"][exp.hdn_indexes] = True
+    # data_dict["new"] = path in new_dataset_folders
+
+    return pd.DataFrame(data_dict)
+
+
+def get_pooled_cell_info(cache=None):
+    """Dataframe with coordinates and HDN identity of all ROIs in the dataset.
+    If a cache is passed (see LotrExperiment), info from each fish are cached.
+    """
     data_df = []
-    for path in dataset_folders:
-        exp = LotrExperiment(path)
-        coords = exp.coords_um
-        cent_coords = exp.ipnref_coords_um
-
-        data_dict = {f"c{i}": coords[:, i] for i in range(3)}
-        data_dict.update({f"centered{i}": cent_coords[:, i] for i in range(3)})
-        data_dict["fid"] = path.name
-        data_dict["hdn"] = np.full(exp.n_rois, False)
-        data_dict["hdn"][exp.hdn_indexes] = True
-        # data_dict["new"] = path in new_dataset_folders
-
-        data_df.append(pd.DataFrame(data_dict))
+    for path in lotr.dataset_folders:
+        exp = LotrExperiment(path, cache=cache)
+        data_df.append(exp.cached("cell_info", lambda: _get_cell_info(exp)))
 
     return pd.concat(data_df, ignore_index=1)
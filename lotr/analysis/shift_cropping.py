@@ -1,88 +1,125 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from lotr import dataset_folders
+import lotr
 from lotr.default_vals import DEFAULT_FN, POST_BOUT_WND_S, PRE_BOUT_WND_S
 from lotr.experiment_class import LotrExperiment
 from lotr.utils import crop, interpolate, resample_matrix
 
 
-def crop_shifts_all_dataset(crop_stimulus=False):
+def _crop_shifts_fish(exp, time_arr, fn, crop_stimulus):
+    """Crop fictive heading, network phase (and stimulus) around the bouts of one
+    fish, resampled over time_arr.
+    """
+    # TODO recompute to avoid this bugfix
+    exp.bouts_df["fid"] = exp.root.name
+
+    stim_interp = np.full(exp.n_pts, np.nan)
+    try:
+        stim_df = exp.stimulus_log
+        if "cl2D_theta" in stim_df.columns and crop_stimulus:
+            stim_interp = interpolate(stim_df["t"], stim_df["cl2D_theta"], exp.time_arr)
+    except AttributeError:
+        pass
+
+    # Crop both the fictive heading (cumulative tail theta sum) and network phase
+    # in the same way:
+    fish_crops = dict()
+    for key, to_crop in zip(
+        ["phase", "heading", "stimulus"],
+        [np.unwrap(exp.network_phase), exp.fictive_heading, stim_interp],
+    ):
+        # Crop around events:
+        cropped = crop(
+            to_crop,
+            exp.bouts_df["idx_imaging"],
+            pre_int=PRE_BOUT_WND_S * exp.fs,
+            post_int=POST_BOUT_WND_S * exp.fs,
+        )
+
+        # Subtract baseline:
+        cropped = cropped - np.mean(cropped[: PRE_BOUT_WND_S * exp.fs, :], 0)
+
+        # Interpolate if necessary:
+        if exp.fs != fn:
+            fish_time_arr = np.arange(1, cropped.shape[0] + 1) / exp.fs - PRE_BOUT_WND_S
+            cropped = resample_matrix(time_arr, fish_time_arr, cropped)
+
+        fish_crops[key] = cropped
+    fish_crops["events_df"] = exp.bouts_df.reindex()
+
+    return fish_crops
+
+
+def _crop_shifts_fish_cached(path, time_arr, fn, crop_stimulus, cache):
+    """Crops of a fish, from the cache if we have one. Entries are keyed by the
+    fingerprint of the fish files and by the cropping parameters.
+    """
+    exp = LotrExperiment(path, cache=cache)
+    return exp.cached(
+        "bout_crops",
+        lambda: _crop_shifts_fish(exp, time_arr, fn, crop_stimulus),
+        pre_bout_wnd_s=PRE_BOUT_WND_S,
+        post_bout_wnd_s=POST_BOUT_WND_S,
+        fn=fn,
+        crop_stimulus=crop_stimulus,
+    )
+
+
+def crop_shifts_all_dataset(crop_stimulus=False, cache=None, n_workers=1, paths=None):
     """Crop fictive heading and network phase around bouts from all fish.
     in the dataset. For a demo of what is happening, "4. Phase dynamics.ipynb" notebook.
+    If a cache is passed (see LotrExperiment), the crops of every fish are cached,
+    so that they are recomputed only for fish whose data changed.
+
+    Parameters
+    ----------
+    crop_stimulus : bool
+        If true, crop also the closed-loop stimulus theta.
+    cache : DiskCache or bool (optional)
+        Cache for the crops of every fish (True for the default one).
+    n_workers : int
+        Number of processes over which fish are distributed.
+    paths : list of Path objects (optional)
+        Experiment folders, by default all the dataset folders.
 
     Returns
     -------
-    (all_phase_cropped, all_head_cropped, events_df)
+    (all_phase_cropped, all_head_cropped, events_df, time_arr)
         The first two returns are the cropped n_tpts x n_bouts matrices, the third is
         the dataframe that contains the info about all events.
 
     """
     fn = DEFAULT_FN
-
-    all_phase_cropped = []
-    all_head_cropped = []
-    all_stim_cropped = []
-    # We will create a dataframe to keep track of events from all fish.
-    # Mostly a way of keeping together the crop and the bouts:
-    events_df = []
+    paths = lotr.dataset_folders if paths is None else paths
 
     # Define temporal array for the resampling:
     time_arr = (
         np.arange(1, ((PRE_BOUT_WND_S + POST_BOUT_WND_S) * fn) + 1) / fn
         - PRE_BOUT_WND_S
     )
-    for path in tqdm(dataset_folders):
-        exp = LotrExperiment(path)
-        # TODO recompute to avoid this bugfix
-        exp.bouts_df["fid"] = path.name
-
-        stim_interp = np.full(exp.n_pts, np.nan)
-        try:
-            stim_df = exp.stimulus_log
-            if "cl2D_theta" in stim_df.columns and crop_stimulus:
-                stim_interp = interpolate(
-                    stim_df["t"], stim_df["cl2D_theta"], exp.time_arr
-                )
-        except AttributeError:
-            pass
-
-        # Crop both the fictive heading (cumulative tail theta sum) and network phase
-        # in the same way:
-        for dest_list, to_crop in zip(
-            [all_phase_cropped, all_head_cropped, all_stim_cropped],
-            [np.unwrap(exp.network_phase), exp.fictive_heading, stim_interp],
-        ):
-            # Crop around events:
-            cropped = crop(
-                to_crop,
-                exp.bouts_df["idx_imaging"],
-                pre_int=PRE_BOUT_WND_S * exp.fs,
-                post_int=POST_BOUT_WND_S * exp.fs,
-            )
-
-            # Subtract baseline:
-            cropped = cropped - np.mean(cropped[: PRE_BOUT_WND_S * exp.fs, :], 0)
+    fish_args = [(path, time_arr, fn, crop_stimulus, cache) for path in paths]
 
-            # Interpolate if necessary:
-            if exp.fs != fn:
-                fish_time_arr = (
-                    np.arange(1, cropped.shape[0] + 1) / exp.fs - PRE_BOUT_WND_S
+    if n_workers == 1:
+        all_crops = [_crop_shifts_fish_cached(*args) for args in tqdm(fish_args)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            all_crops = list(
+                tqdm(
+                    executor.map(_crop_shifts_fish_cached, *zip(*fish_args)),
+                    total=len(fish_args),
                 )
-                cropped = resample_matrix(time_arr, fish_time_arr, cropped)
-
-            dest_list.append(cropped)
-        events_df.append(exp.bouts_df.reindex())
+            )
 
     # Concatenate all the results:
-    all_phase_cropped = np.concatenate(all_phase_cropped, axis=1)
-    all_head_cropped = np.concatenate(all_head_cropped, axis=1)
-    try:
-        all_stim_cropped = np.concatenate(all_stim_cropped, axis=1)
-    except np.AxisError:
-        all_stim_cropped = None
-    events_df = pd.concat(events_df, ignore_index=True)
+    all_phase_cropped = np.concatenate([c["phase"] for c in all_crops], axis=1)
+    all_head_cropped = np.concatenate([c["heading"] for c in all_crops], axis=1)
+    all_stim_cropped = np.concatenate([c["stimulus"] for c in all_crops], axis=1)
+    # We keep a dataframe to track events from all fish, together with the crops:
+    events_df = pd.concat([c["events_df"] for c in all_crops], ignore_index=True)
 
     if crop_stimulus:
         return (
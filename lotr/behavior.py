@@ -2,6 +2,7 @@ from itertools import product
 
 import numpy as np
 import pandas as pd
+from scipy.signal import lfilter
 
 from lotr.default_vals import REGRESSOR_TAU_S, TURN_BIAS
 
@@ -84,36 +85,95 @@ def get_fictive_heading(n_pts, bouts_df, min_bias=0.05):
     return np.cumsum(theta_turned)
 
 
-def create_motor_regressors(n_pts, df, fn, min_bias=0.05):
-    """Use the get_bouts_props_array to create a dataframe of regressors for left, right, forward swims
-    considering just the direction, the amount of bias, or the vigor.
-    """
+def motor_regressors_matrix(
+    n_pts, df, fn, min_bias=0.05, n_kernel_pts=1000, dtype=np.float32
+):
+    """Design matrix of the motor regressors of create_motor_regressors, built in a
+    single pass: bout selections are computed once, all columns are filled with
+    a single assignment, and the exponential kernel is applied to all columns at
+    once as a recursive filter, y[t] = x[t] + exp(-1 / tau_fs) * y[t - 1].
+    The truncation of the kernel at n_kernel_pts is accounted for by subtracting
+    the decayed values from n_kernel_pts points before.
 
-    N_KERNEL_PTS = 1000  # This just has to be large enough for the kernel to go to 0
+    Parameters
+    ----------
+    n_pts : int
+        number of imaging timepoints (rows of output)
+    df : pd.DataFrame
+        bouts dataframe
+    fn : float
+        Sampling frequency.
+    min_bias : float
+        Minimum absolute bias for left and right bouts to be included.
+    n_kernel_pts : int
+        Number of points of the exponential kernel.
+    dtype : np.dtype
+        dtype of the output.
 
-    regressors_dict = dict()
+    Returns
+    -------
+    np.array
+        (n_pts, n_regressors) design matrix.
+    list of str
+        Names of the regressors, as the columns of create_motor_regressors.
 
+    """
+    bias = df["bias"].values
+    idxs = df["idx_imaging"].values
+    abs_bias = np.abs(bias)
+
+    # Bout selections by direction, with the minimum bias applied to turns only:
+    selections = dict(
+        left=(bias < -TURN_BIAS) & (abs_bias > min_bias),
+        right=(bias > TURN_BIAS) & (abs_bias > min_bias),
+        forward=(bias < TURN_BIAS) & (bias > -TURN_BIAS) & (abs_bias > 0),
+        all=~np.isnan(bias) & (abs_bias > 0),
+    )
+    values = {
+        "bias": bias,
+        "abs_bias": abs_bias,
+        "med_vig": df["med_vig"].values,
+        1: np.ones(len(df)),
+    }
+
+    # (name, direction, value) of the regressors, in the order of
+    # create_motor_regressors:
+    columns = []
     for d, v in product(["left", "right", "forward", "all"], ["bias", "med_vig", 1]):
         if d == "forward" and v == "bias":
             continue
+        if v == "bias" and d == "all":
+            columns.append((f"{d}_{v}_abs", d, "abs_bias"))
+        columns.append((f"{d}_{v}", d, "abs_bias" if v == "bias" and d != "all" else v))
 
-        if d == "forward" or d == "all":
-            min_bias = 0
-        else:
-            min_bias = min_bias
+    # Fill all the columns with one assignment. Bouts are in the same order as in
+    # get_bouts_props_array, so if more bouts share a timepoint the last one wins:
+    rows, cols, vals = [], [], []
+    for i, (_, d, v) in enumerate(columns):
+        rows.append(idxs[selections[d]])
+        cols.append(np.full(selections[d].sum(), i))
+        vals.append(values[v][selections[d]])
 
-        arr = get_bouts_props_array(n_pts, df, min_bias=min_bias, selection=d, value=v)
+    regressors = np.zeros((n_pts, len(columns)))
+    regressors[np.concatenate(rows), np.concatenate(cols)] = np.concatenate(vals)
 
-        if v == "bias" and d == "all":
-            regressors_dict.update({f"{d}_{v}_abs": np.abs(arr)})
-        elif d in ["left", "right"]:
-            arr = np.abs(arr)
+    # Convolve with the truncated exponential kernel:
+    decay = np.exp(-1 / (REGRESSOR_TAU_S * fn))
+    convolved = lfilter([1], [1, -decay], regressors, axis=0)
+    convolved[n_kernel_pts:] -= decay**n_kernel_pts * convolved[:-n_kernel_pts]
 
-        regressors_dict.update({f"{d}_{v}": arr})
+    return convolved.astype(dtype), [name for name, _, _ in columns]
 
-    tau_fs = REGRESSOR_TAU_S * fn
-    kernel = np.exp(-np.arange(N_KERNEL_PTS) / tau_fs)
 
-    for k, val in regressors_dict.items():
-        regressors_dict[k] = np.convolve(val, kernel)[:n_pts]
-    return pd.DataFrame(regressors_dict)
+def create_motor_regressors(n_pts, df, fn, min_bias=0.05):
+    """Create a dataframe of regressors for left, right, forward swims
+    considering just the direction, the amount of bias, or the vigor.
+    See motor_regressors_matrix, that directly returns a float32 design matrix.
+    """
+
+    N_KERNEL_PTS = 1000  # This just has to be large enough for the kernel to go to 0
+
+    regressors, columns = motor_regressors_matrix(
+        n_pts, df, fn, min_bias=min_bias, n_kernel_pts=N_KERNEL_PTS, dtype=np.float64
+    )
+    return pd.DataFrame(regressors, columns=columns)
@@ -0,0 +1,205 @@
+"""Persistent cache for quantities derived from the experiments (rPC scores,
+network phase, etc.), so that they are not recomputed in every new process.
+
+Entries are keyed by a fingerprint of the content of the experiment files and by
+the parameters of the computation, so that they never have to be invalidated
+manually when data are reprocessed. The cache folder is bounded in size, and the
+least recently used entries are deleted first.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import flammkuchen as fl
+import numpy as np
+
+from lotr.default_vals import CACHE_DIR_ENV_VAR, CACHE_MAX_SIZE_MB
+
+# Files of an experiment folder that define the quantities we cache:
+FINGERPRINT_PATTERNS = [
+    "*metadata.json",
+    "*stimulus_log*",
+    "selected.h5",
+    "bouts_df.h5",
+    "filtered_traces.h5",
+    "data_from_suite2p_unfiltered.h5",
+]
+
+_DIGEST_BLOCK_SIZE = 2**23
+
+
+def _hash_strings(*strings):
+    h = hashlib.blake2b(digest_size=16)
+    for s in strings:
+        h.update(s.encode())
+    return h.hexdigest()
+
+
+def params_digest(**params):
+    """Stable digest of a set of parameters. Arrays are hashed by content."""
+    stable_params = dict()
+    for k, v in params.items():
+        if isinstance(v, np.ndarray):
+            v = hashlib.blake2b(np.ascontiguousarray(v).tobytes()).hexdigest()
+        stable_params[k] = v
+    return _hash_strings(json.dumps(stable_params, sort_keys=True, default=str))
+
+
+def file_digest(path):
+    """Hash of the content of a file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_DIGEST_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_default_cache_dir():
+    if CACHE_DIR_ENV_VAR in os.environ:
+        return Path(os.environ[CACHE_DIR_ENV_VAR])
+
+    import pooch
+
+    return Path(pooch.os_cache("lotr")) / "derived"
+
+
+class DiskCache:
+    """Size-bounded on-disk cache for derived quantities.
+
+    Parameters
+    ----------
+    path : Path object or str (optional)
+        Cache folder. By default, the LOTR_CACHE_DIR environment variable or
+        a "derived" folder in the lotr os cache.
+    max_size_mb : float (optional)
+        Maximum size of the cache; when exceeded, least recently used entries
+        are deleted.
+
+    """
+
+    def __init__(self, path=None, max_size_mb=CACHE_MAX_SIZE_MB):
+        self.path = Path(path) if path is not None else get_default_cache_dir()
+        self.max_size_mb = max_size_mb
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._digests_file = self.path / "file_digests.json"
+        self._digests = None
+
+    def _read_digests(self):
+        try:
+            with open(self._digests_file, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def file_digest(self, path):
+        """Content hash of a file. As hashing large files is slow, digests are
+        memoized in the cache folder, keyed on file path, size and modification time.
+        There is at most one digest per path, and digests of files that changed or
+        no longer exist are dropped whenever a new one is stored.
+        """
+        path = Path(path).resolve()
+        stat = path.stat()
+        file_stat = [stat.st_size, stat.st_mtime_ns]
+
+        if self._digests is None:
+            self._digests = self._read_digests()
+        memo = self._digests.get(str(path))
+        if memo is not None and memo[:2] == file_stat:
+            return memo[2]
+
+        # Re-read, in case other processes stored digests in the meantime:
+        self._digests = self._pruned_digests(self._read_digests())
+        self._digests[str(path)] = file_stat + [file_digest(path)]
+        self._atomic_write_json(self._digests)
+        return self._digests[str(path)][2]
+
+    @staticmethod
+    def _pruned_digests(digests):
+        pruned = dict()
+        for path, memo in digests.items():
+            try:
+                stat = Path(path).stat()
+            except OSError:
+                continue
+            if memo[:2] == [stat.st_size, stat.st_mtime_ns]:
+                pruned[path] = memo
+        return pruned
+
+    def _atomic_write_json(self, digests):
+        tmp_file = self._digests_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(digests, f)
+        os.replace(tmp_file, self._digests_file)
+
+    def experiment_fingerprint(self, root):
+        """Fingerprint of the content of the files of an experiment folder."""
+        files = sorted(
+            [f for pattern in FINGERPRINT_PATTERNS for f in Path(root).glob(pattern)]
+        )
+        return _hash_strings(*[f.name + self.file_digest(f) for f in files])
+
+    def _entry_file(self, fingerprint, name, **params):
+        return self.path / fingerprint / f"{name}_{params_digest(**params)}.h5"
+
+    def get_or_compute(self, fingerprint, name, compute_fun, **params):
+        """Return a cached value, or compute it with compute_fun() and cache it.
+
+        Parameters
+        ----------
+        fingerprint : str
+            Fingerprint of the input data (e.g. from experiment_fingerprint).
+        name : str
+            Name of the cached quantity.
+        compute_fun : callable
+            Function with no arguments computing the quantity.
+        params : dict
+            Parameters of the computation. They become part of the key.
+
+        """
+        entry_file = self._entry_file(fingerprint, name, **params)
+        try:
+            value = fl.load(entry_file, "/value")
+            entry_file.touch()  # mark as recently used for the eviction
+            return value
+        except (OSError, ValueError, KeyError):
+            pass
+
+        value = compute_fun()
+
+        entry_file.parent.mkdir(exist_ok=True)
+        tmp_file = entry_file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            fl.save(tmp_file, dict(value=value))
+            os.replace(tmp_file, entry_file)
+        except (TypeError, ValueError):
+            # Some objects cannot be saved to hdf5, we just do not cache them:
+            tmp_file.unlink(missing_ok=True)
+
+        self.evict()
+        return value
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its size."""
+        entries = [(f, f.stat()) for f in self.path.glob("*/*.h5")]
+        entries = sorted(entries, key=lambda e: e[1].st_mtime)
+        total_size = sum([stat.st_size for _, stat in entries])
+
+        while entries and total_size > self.max_size_mb * 2**20:
+            f, stat = entries.pop(0)
+            f.unlink(missing_ok=True)
+            total_size -= stat.st_size
+
+    def invalidate(self, fingerprint=None):
+        """Delete all the entries for a fingerprint, or the whole cache if None."""
+        to_remove = [self.path / fingerprint] if fingerprint else self.path.glob("*")
+        if fingerprint is None:
+            self._digests = None
+        for f in to_remove:
+            if f.is_dir():
+                shutil.rmtree(f, ignore_errors=True)
+            elif f.exists():
+                f.unlink()
@@ -1,85 +1,225 @@
+import os
+
 import flammkuchen as fl
 import numpy as np
 import pandas as pd
+import tables
 from bouter.utilities import predictive_tail_fill
 
 from lotr.behavior import create_motor_regressors
-from lotr.data_preprocessing.traces import preprocess_traces
+from lotr.data_preprocessing.traces import (
+    detrend_norm_block,
+    filter_traces_block,
+    preprocess_traces_vectorized,
+)
 from lotr.default_vals import TRACES_SMOOTH_S, TURN_BIAS
 from lotr.experiment_class import LotrExperiment
-from lotr.utils import pearson_regressors
+from lotr.lazy_arrays import LazyH5Array
+from lotr.utils import pearson_regressors_blocked
 
 
-def preprocess_folder(
+def _zscore_columns(traces):
+    return (traces - np.nanmean(traces, 0)) / np.nanstd(traces, 0)
+
+
+def filter_traces_streaming(
     path,
-    recompute_bout_df=False,
-    recompute_filtering=False,
-    recompute_regressors=False,
+    fn,
+    block_size=2000,
+    smooth_wnd_s=TRACES_SMOOTH_S,
+    detrend_wnd_s=900,
+    dtype=None,
 ):
-    try:
-        # Make sure we don't use feature of LotrExperiment requiring preprocessing
-        exp = LotrExperiment(path)
-        fn = exp.fs
+    """Out-of-core version of the traces filtering of preprocess_folder, for
+    recordings that do not fit in memory. Blocks of ROIs are read from
+    data_from_suite2p_unfiltered.h5, filtered, and written incrementally in chunked
+    datasets in filtered_traces.h5, so that peak memory is bounded by
+    block_size * n_timepoints.
 
-        # Extract bout dataframe:
-        if not (path / "bouts_df.h5").exists() or recompute_bout_df:
-            beh_df = exp.behavior_log
-            theta_mat = beh_df.loc[:, [f"theta_0{i}" for i in range(9)]].values
-            beh_df.loc[:, [f"theta_0{i}" for i in range(9)]] = predictive_tail_fill(
-                theta_mat
-            )
+    As the linear detrending of the undetrended traces is computed over ROIs for
+    every timepoint, it is applied in a second pass over the blocks after
+    accumulating the sums over ROIs that define the fit.
+
+    Parameters
+    ----------
+    path : Path object
+        Experiment folder.
+    fn : int
+        Sampling frequency.
+    block_size : int
+        Number of ROIs processed at once.
+    smooth_wnd_s : float
+        Duration of window for the smoothing (sec).
+    detrend_wnd_s : float
+        Duration of window for the detrending (sec).
+    dtype : np.dtype (optional)
+        dtype of the output, by default the one of the raw traces.
 
-            beh_df["tail_sum"] = (beh_df["theta_07"] + beh_df["theta_08"]) - (
-                beh_df["theta_00"] + beh_df["theta_01"]
+    """
+    dest_file = path / "filtered_traces.h5"
+    tmp_file = path / "filtered_traces.h5.tmp"
+    filters = tables.Filters(complevel=9, complib="blosc", shuffle=True)
+
+    with tables.open_file(
+        path / "data_from_suite2p_unfiltered.h5", "r"
+    ) as source, tables.open_file(tmp_file, "w") as dest:
+        raw_traces = source.get_node("/traces")  # (n_rois, n_pts) array
+        n_rois, n_pts = raw_traces.shape
+        dtype = raw_traces.dtype if dtype is None else np.dtype(dtype)
+
+        datasets = {
+            k: dest.create_carray(
+                "/",
+                k,
+                tables.Atom.from_dtype(dtype),
+                shape=(n_pts, n_rois),
+                filters=filters,
+                chunkshape=(min(n_pts, 2**12), min(n_rois, 2**6)),
             )
-            bouts_df = exp.get_bout_properties()
-            # Compute bout index in behavior trace:
-            bouts_df["idx"] = [
-                np.argmin((beh_df["t"] - bouts_df.loc[i, "t_start"]).abs())
-                for i in bouts_df.index
-            ]
-            bouts_df["fid"] = path.name
+            for k in ["detr", "undetr"]
+        }
 
-            bouts_df["idx_imaging"] = np.round(bouts_df["t_start"] * fn).astype(np.int)
+        # Sums over ROIs of the undetrended traces, for the linear detrending:
+        roi_sum, roi_weighted_sum = np.zeros(n_pts), np.zeros(n_pts)
 
-            bouts_df["direction"] = "fw"
-            bouts_df.loc[(bouts_df["bias"] > TURN_BIAS), "direction"] = "rt"
-            bouts_df.loc[(bouts_df["bias"] < -TURN_BIAS), "direction"] = "lf"
+        for start in range(0, n_rois, block_size):
+            block = raw_traces[start : start + block_size, :].T.astype(dtype)
+            block_slice = slice(start, start + block.shape[1])
 
-            fl.save(path / "bouts_df.h5", bouts_df)
+            filtered = filter_traces_block(block, fn, smooth_wnd_s, None)
+            detrended = detrend_norm_block(filtered, wnd=int(fn * detrend_wnd_s))
+            datasets["detr"][:, block_slice] = _zscore_columns(detrended.astype(dtype))
+            datasets["undetr"][:, block_slice] = filtered
 
-        # Filter traces:
-        if not (path / "filtered_traces.h5").exists() or recompute_filtering:
-            traces_raw = fl.load(path / "data_from_suite2p_unfiltered.h5", "/traces").T
-            traces = preprocess_traces(
-                traces_raw, fn, smooth_wnd_s=TRACES_SMOOTH_S, detrend_wnd_s=900
-            )
-            traces_und = preprocess_traces(
-                traces_raw, fn, smooth_wnd_s=TRACES_SMOOTH_S, detrend_wnd_s=None
+            roi_sum += filtered.sum(1)
+            roi_weighted_sum += filtered @ np.arange(
+                block_slice.start, block_slice.stop
             )
-            fl.save(path / "filtered_traces.h5", dict(detr=traces, undetr=traces_und))
 
-        # Computer behavior regressors:
-        if not (path / "motor_regressors.h5").exists() or recompute_regressors:
-            traces = fl.load(path / "filtered_traces.h5", "/detr")
-            bouts_df = fl.load(path / path / "bouts_df.h5")
-            reg_dict = create_motor_regressors(
-                traces.shape[0], bouts_df, fn, min_bias=0.05
+        # Least square line over ROIs for every timepoint, as scipy.signal.detrend:
+        roi_mean_idx = (n_rois - 1) / 2
+        slope = (roi_weighted_sum - roi_mean_idx * roi_sum) / np.sum(
+            (np.arange(n_rois) - roi_mean_idx) ** 2
+        )
+        intercept = roi_sum / n_rois - slope * roi_mean_idx
+
+        for start in range(0, n_rois, block_size):
+            block_slice = slice(start, min(start + block_size, n_rois))
+            trend = intercept[:, np.newaxis] + np.outer(
+                slope, np.arange(block_slice.start, block_slice.stop)
+            )
+            datasets["undetr"][:, block_slice] = _zscore_columns(
+                datasets["undetr"][:, block_slice] - trend
             )
 
-            traces_derivative = np.zeros(traces.shape)
-            traces_derivative[:-1, :] = np.abs(np.diff(traces, axis=0))
+    os.replace(tmp_file, dest_file)
 
-            reg_mat = pearson_regressors(traces, reg_dict.values).T
-            reg_mat_diff = pearson_regressors(traces_derivative, reg_dict.values).T
 
-            reg_df = pd.DataFrame(
-                np.concatenate([reg_mat, reg_mat_diff], axis=1),
-                columns=list(reg_dict.columns)
-                + [c + "_dfdt" for c in reg_dict.columns],
-            )
+def compute_bouts_df(path, exp):
+    """Extract the dataframe of the bouts of an experiment and save it in
+    bouts_df.h5.
+    """
+    fn = exp.fs
+    beh_df = exp.behavior_log
+    theta_mat = beh_df.loc[:, [f"theta_0{i}" for i in range(9)]].values
+    beh_df.loc[:, [f"theta_0{i}" for i in range(9)]] = predictive_tail_fill(theta_mat)
+
+    beh_df["tail_sum"] = (beh_df["theta_07"] + beh_df["theta_08"]) - (
+        beh_df["theta_00"] + beh_df["theta_01"]
+    )
+    bouts_df = exp.get_bout_properties()
+    # Compute bout index in behavior trace:
+    bouts_df["idx"] = [
+        np.argmin((beh_df["t"] - bouts_df.loc[i, "t_start"]).abs())
+        for i in bouts_df.index
+    ]
+    bouts_df["fid"] = path.name
+
+    bouts_df["idx_imaging"] = np.round(bouts_df["t_start"] * fn).astype(np.int)
+
+    bouts_df["direction"] = "fw"
+    bouts_df.loc[(bouts_df["bias"] > TURN_BIAS), "direction"] = "rt"
+    bouts_df.loc[(bouts_df["bias"] < -TURN_BIAS), "direction"] = "lf"
+
+    fl.save(path / "bouts_df.h5", bouts_df)
+
 
-            fl.save(path / "motor_regressors.h5", reg_df)
+def compute_filtered_traces(path, exp, block_size=None):
+    """Filter the raw suite2p traces and save them in filtered_traces.h5.
+    If block_size is specified, traces are filtered out-of-core in blocks of
+    block_size ROIs (see filter_traces_streaming).
+    """
+    fn = exp.fs
+    if block_size is not None:
+        filter_traces_streaming(path, fn, block_size=block_size)
+        return
+
+    traces_raw = fl.load(path / "data_from_suite2p_unfiltered.h5", "/traces").T
+    traces = preprocess_traces_vectorized(
+        traces_raw, fn, smooth_wnd_s=TRACES_SMOOTH_S, detrend_wnd_s=900
+    )
+    traces_und = preprocess_traces_vectorized(
+        traces_raw, fn, smooth_wnd_s=TRACES_SMOOTH_S, detrend_wnd_s=None
+    )
+
+    tmp_file = path / "filtered_traces.h5.tmp"
+    fl.save(tmp_file, dict(detr=traces, undetr=traces_und))
+    os.replace(tmp_file, path / "filtered_traces.h5")
+
+
+def compute_motor_regressors(path, exp, block_size=1000):
+    """Correlate filtered traces (and their derivative) with the motor regressors,
+    and save the result in motor_regressors.h5. Traces are read from disk in
+    blocks of block_size ROIs, so that the full matrix is never loaded in memory.
+    """
+    fn = exp.fs
+    traces = LazyH5Array(path / "filtered_traces.h5", "/detr")
+    bouts_df = fl.load(path / "bouts_df.h5")
+    reg_dict = create_motor_regressors(traces.shape[0], bouts_df, fn, min_bias=0.05)
+
+    # The derivative of the traces is computed block by block:
+    reg_mat = pearson_regressors_blocked(
+        traces, reg_dict.values, block_size=block_size
+    ).T
+    reg_mat_diff = pearson_regressors_blocked(
+        traces, reg_dict.values, block_size=block_size, derivative=True
+    ).T
+
+    reg_df = pd.DataFrame(
+        np.concatenate([reg_mat, reg_mat_diff], axis=1),
+        columns=list(reg_dict.columns) + [c + "_dfdt" for c in reg_dict.columns],
+    )
+
+    fl.save(path / "motor_regressors.h5", reg_df)
+
+
+def preprocess_folder(
+    path,
+    recompute_bout_df=False,
+    recompute_filtering=False,
+    recompute_regressors=False,
+    block_size=None,
+):
+    """Preprocess the data of an experiment folder, creating the bouts_df.h5,
+    filtered_traces.h5 and motor_regressors.h5 files.
+    If block_size is specified, traces are filtered out-of-core in blocks of
+    block_size ROIs (see filter_traces_streaming).
+
+    For batches of experiments, lotr.data_preprocessing.runner.run_preprocessing
+    recomputes only the outdated steps and runs folders in parallel.
+    """
+    try:
+        # Make sure we don't use feature of LotrExperiment requiring preprocessing
+        exp = LotrExperiment(path)
+
+        if not (path / "bouts_df.h5").exists() or recompute_bout_df:
+            compute_bouts_df(path, exp)
+
+        if not (path / "filtered_traces.h5").exists() or recompute_filtering:
+            compute_filtered_traces(path, exp, block_size=block_size)
+
+        if not (path / "motor_regressors.h5").exists() or recompute_regressors:
+            compute_motor_regressors(path, exp)
 
     except OSError:
         print(f"File error in folder {path}")
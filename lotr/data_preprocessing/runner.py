@@ -0,0 +1,281 @@
+"""Incremental batch preprocessing of experiment folders.
+
+The preprocessing of a folder is modelled as a graph of steps
+(bouts_df.h5 -> filtered_traces.h5 -> motor_regressors.h5). For every step, a
+signature of its input files (size and modification time, or content hash) is
+stored in a state file in the folder after it completes, and a step is recomputed
+only if its output is missing, its inputs changed, or it is forced. As the outputs
+of a step are the inputs of the following ones, recomputing a step makes the
+downstream steps outdated.
+
+Folders are processed in parallel on a process pool, and the run writes a report
+with the status, timing and traceback of every step instead of stopping at the
+first error.
+"""
+
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from tqdm import tqdm
+
+from lotr.caching import file_digest
+from lotr.data_preprocessing.preprocessing import (
+    compute_bouts_df,
+    compute_filtered_traces,
+    compute_motor_regressors,
+)
+from lotr.experiment_class import LotrExperiment
+
+STATE_FILENAME = "preprocessing_state.json"
+
+# Steps in execution order, with their output file and their input files patterns:
+PREPROCESSING_STEPS = dict(
+    bouts_df=dict(
+        function=compute_bouts_df,
+        output="bouts_df.h5",
+        inputs=["*metadata.json", "*behavior_log*"],
+    ),
+    filtered_traces=dict(
+        function=compute_filtered_traces,
+        output="filtered_traces.h5",
+        inputs=["*metadata.json", "data_from_suite2p_unfiltered.h5"],
+    ),
+    motor_regressors=dict(
+        function=compute_motor_regressors,
+        output="motor_regressors.h5",
+        inputs=["*metadata.json", "filtered_traces.h5", "bouts_df.h5"],
+    ),
+)
+
+
+def inputs_signature(path, step, signature="mtime"):
+    """Signature of the input files of a preprocessing step.
+
+    Parameters
+    ----------
+    path : Path object
+        Experiment folder.
+    step : str
+        Name of the step, from PREPROCESSING_STEPS.
+    signature : str
+        "mtime" to use size and modification time of the files (fast), or "hash"
+        to use their content.
+
+    Returns
+    -------
+    dict
+        File name: signature of the file.
+
+    """
+    files = sorted(
+        {
+            f
+            for pattern in PREPROCESSING_STEPS[step]["inputs"]
+            for f in path.glob(pattern)
+        }
+    )
+    if signature == "hash":
+        return {f.name: file_digest(f) for f in files}
+    elif signature == "mtime":
+        return {f.name: [f.stat().st_size, f.stat().st_mtime_ns] for f in files}
+    raise ValueError(f"signature must be 'mtime' or 'hash', not {signature}")
+
+
+def load_state(path):
+    try:
+        with open(path / STATE_FILENAME, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return dict()
+
+
+def _save_state(path, state):
+    tmp_file = path / (STATE_FILENAME + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, path / STATE_FILENAME)
+
+
+def outdated_steps(path, force=(), signature="mtime"):
+    """Steps of the folder that have to be (re)computed, in execution order.
+
+    A step is outdated if its output is missing, if it is forced, if it was
+    interrupted, or if the signature of its inputs changed since its last run.
+    Outputs of folders preprocessed before the state file existed are considered
+    up to date. As the signatures of downstream steps are affected only after an
+    upstream step actually runs, they are checked again during the run.
+    """
+    state = load_state(path)
+    steps = []
+    for step, step_def in PREPROCESSING_STEPS.items():
+        step_state = state.get(step)
+        if (
+            step in force
+            or not (path / step_def["output"]).exists()
+            or (step_state is not None and step_state.get("status") != "done")
+            or (
+                step_state is not None
+                and step_state.get("inputs") != inputs_signature(path, step, signature)
+            )
+        ):
+            steps.append(step)
+    return steps
+
+
+def preprocess_folder_incremental(path, force=(), signature="mtime", block_size=None):
+    """Run the outdated preprocessing steps of a folder.
+
+    Parameters
+    ----------
+    path : Path object
+        Experiment folder.
+    force : list of str
+        Steps to recompute in any case (downstream steps will follow).
+    signature : str
+        How to detect changes in the inputs of the steps, "mtime" or "hash".
+    block_size : int (optional)
+        If specified, traces are filtered out-of-core in blocks of block_size ROIs.
+
+    Returns
+    -------
+    dict
+        Report of the folder, with status ("done", "skipped", "failed" or
+        "blocked" by the failure of a step it depends on), duration and error of
+        every step.
+
+    """
+    path = Path(path)
+    report = dict(path=str(path), steps=dict())
+    state = load_state(path)
+    step_kwargs = dict(filtered_traces=dict(block_size=block_size))
+
+    exp = None
+    updated_outputs, failed_outputs = [], []
+    for step, step_def in PREPROCESSING_STEPS.items():
+        if set(step_def["inputs"]) & set(failed_outputs):
+            report["steps"][step] = dict(status="blocked")
+            failed_outputs.append(step_def["output"])
+            continue
+
+        # Steps reading outputs that were just recomputed have to run as well:
+        if set(step_def["inputs"]) & set(updated_outputs):
+            force = list(force) + [step]
+
+        # Check again at every step, as the previous steps might have changed inputs:
+        if step not in outdated_steps(path, force=force, signature=signature):
+            if step not in state:
+                state[step] = dict(
+                    status="done", inputs=inputs_signature(path, step, signature)
+                )
+            report["steps"][step] = dict(status="skipped")
+            continue
+
+        # Mark the step as running, so that if the process crashes it will be rerun:
+        state[step] = dict(status="running")
+        _save_state(path, state)
+
+        t_start = time.time()
+        try:
+            if exp is None:
+                exp = LotrExperiment(path)
+            step_def["function"](path, exp, **step_kwargs.get(step, dict()))
+            state[step] = dict(
+                status="done", inputs=inputs_signature(path, step, signature)
+            )
+            report["steps"][step] = dict(status="done")
+            updated_outputs.append(step_def["output"])
+        except Exception as e:
+            state[step] = dict(status="failed")
+            report["steps"][step] = dict(
+                status="failed",
+                error=f"{type(e).__name__}: {e}",
+                traceback=traceback.format_exc(),
+            )
+            failed_outputs.append(step_def["output"])
+
+        report["steps"][step]["duration_s"] = time.time() - t_start
+        _save_state(path, state)
+
+    report["status"] = "failed" if failed_outputs else "done"
+    return report
+
+
+def run_preprocessing(
+    paths,
+    n_workers=1,
+    force=(),
+    signature="mtime",
+    block_size=None,
+    report_file=None,
+):
+    """Incrementally preprocess a list of experiment folders, in parallel.
+
+    Parameters
+    ----------
+    paths : list of Path objects
+        Experiment folders.
+    n_workers : int
+        Number of processes. If 1, folders are processed in the current process.
+    force : list of str
+        Steps to recompute in any case, from PREPROCESSING_STEPS.
+    signature : str
+        How to detect changes in the inputs of the steps, "mtime" or "hash".
+    block_size : int (optional)
+        If specified, traces are filtered out-of-core in blocks of block_size ROIs.
+    report_file : Path object or str (optional)
+        If specified, the report is saved there as json.
+
+    Returns
+    -------
+    dict
+        Report of the run, with the reports of all folders.
+
+    """
+    unknown_steps = set(force) - set(PREPROCESSING_STEPS.keys())
+    if unknown_steps:
+        raise ValueError(f"Unknown preprocessing steps: {unknown_steps}")
+
+    kwargs = dict(force=list(force), signature=signature, block_size=block_size)
+    t_start = time.time()
+    folder_reports = []
+
+    if n_workers == 1:
+        for path in tqdm(paths):
+            folder_reports.append(preprocess_folder_incremental(path, **kwargs))
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {
+                executor.submit(preprocess_folder_incremental, path, **kwargs): path
+                for path in paths
+            }
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                try:
+                    folder_reports.append(future.result())
+                except Exception as e:
+                    # A worker dying (e.g. out of memory) would not return a report:
+                    folder_reports.append(
+                        dict(
+                            path=str(futures[future]),
+                            status="failed",
+                            error=f"{type(e).__name__}: {e}",
+                            traceback=traceback.format_exc(),
+                        )
+                    )
+
+    folder_reports = sorted(folder_reports, key=lambda r: r["path"])
+    report = dict(
+        duration_s=time.time() - t_start,
+        n_folders=len(folder_reports),
+        n_failed=sum([r["status"] == "failed" for r in folder_reports]),
+        folders=folder_reports,
+    )
+
+    if report_file is not None:
+        with open(report_file, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return report
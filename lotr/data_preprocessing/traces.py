@@ -1,5 +1,7 @@
+import numba
 import numpy as np
 import pandas as pd
+from numba import njit, prange
 from scipy.signal import detrend, medfilt
 
 
@@ -15,6 +17,15 @@ def detrend_norm(trace, wnd=3000):
     return trace / st
 
 
+def _get_smooth_wnd_pts(fn, smooth_wnd_s):
+    # solve problem for even-valued windows:
+    return (
+        int(fn * smooth_wnd_s)
+        if (int(fn * smooth_wnd_s) % 2) == 1
+        else int(fn * smooth_wnd_s) + 1
+    )
+
+
 def preprocess_traces(traces, fn, smooth_wnd_s=5, detrend_wnd_s=800):
     """Preprocess traces by using the detrend normalization funciton
     above, smoothing them with a median filter, and zscoring them.
@@ -41,12 +52,7 @@ def preprocess_traces(traces, fn, smooth_wnd_s=5, detrend_wnd_s=800):
     """
     traces_sm = traces.copy()
 
-    # solve problem for even-valued windows:
-    wnd_pts = (
-        int(fn * smooth_wnd_s)
-        if (int(fn * smooth_wnd_s) % 2) == 1
-        else int(fn * smooth_wnd_s) + 1
-    )
+    wnd_pts = _get_smooth_wnd_pts(fn, smooth_wnd_s)
 
     for i in range(traces_sm.shape[1]):
         traces_sm[:, i] = medfilt(traces[:, i], wnd_pts)
@@ -56,3 +62,142 @@ def preprocess_traces(traces, fn, smooth_wnd_s=5, detrend_wnd_s=800):
         traces_sm = detrend(traces_sm, axis=1)
 
     return (traces_sm - np.nanmean(traces_sm, 0)) / np.nanstd(traces_sm, 0)
+
+
+@njit(parallel=True)
+def _running_median_rows(traces_t, wnd_pts):
+    """Median filter over the rows of a (n_rois, n_pts) matrix, with zero padding
+    at the borders as scipy.signal.medfilt. A sorted copy of the window is
+    updated at every step, removing the point leaving and inserting the one entering.
+    """
+    n_rois, n_pts = traces_t.shape
+    half = wnd_pts // 2
+    filtered = np.empty_like(traces_t)
+
+    for j in prange(n_rois):
+        trace = np.zeros(n_pts + 2 * half, dtype=traces_t.dtype)
+        trace[half : half + n_pts] = traces_t[j, :]
+        window = np.sort(trace[:wnd_pts])
+        filtered[j, 0] = window[half]
+
+        for i in range(1, n_pts):
+            out_val = trace[i - 1]
+            in_val = trace[i - 1 + wnd_pts]
+
+            # Overwrite the leaving point while shifting to the entering point place:
+            k = np.searchsorted(window, out_val)
+            if in_val >= out_val:
+                while k < wnd_pts - 1 and window[k + 1] < in_val:
+                    window[k] = window[k + 1]
+                    k += 1
+            else:
+                while k > 0 and window[k - 1] > in_val:
+                    window[k] = window[k - 1]
+                    k -= 1
+            window[k] = in_val
+
+            filtered[j, i] = window[half]
+
+    return filtered
+
+
+def running_median(traces, wnd_pts):
+    """Median filter all columns of a (n_pts, n_rois) matrix at once, in parallel
+    over ROIs. Equivalent to scipy.signal.medfilt on every column (for an odd
+    window). The running kernel works only with finite values, so ROIs with
+    NaN or infinite values are filtered with medfilt.
+    """
+    finite = np.isfinite(traces).all(0)
+    if finite.all():
+        return _running_median_rows(np.ascontiguousarray(traces.T), wnd_pts).T
+
+    filtered = np.empty_like(traces)
+    filtered[:, finite] = _running_median_rows(
+        np.ascontiguousarray(traces[:, finite].T), wnd_pts
+    ).T
+    for i in np.flatnonzero(~finite):
+        filtered[:, i] = medfilt(traces[:, i], wnd_pts)
+    return filtered
+
+
+def detrend_norm_block(traces, wnd=3000):
+    """Version of detrend_norm acting on all columns of a (n_pts, n_rois) matrix."""
+    st = pd.DataFrame(traces).rolling(wnd, center=True).mean().values
+
+    # Fill nan values:
+    st[: wnd // 2, :] = st[wnd // 2, :]
+    st[-wnd // 2 :, :] = st[-wnd // 2, :]
+    return traces / st
+
+
+def filter_traces_block(traces, fn, smooth_wnd_s=5, detrend_wnd_s=800):
+    """Median filter and, if required, detrend normalize a block of
+    (n_pts, n_rois) traces, as done for each ROI in preprocess_traces.
+    Linear detrending over ROIs and z-scoring are not applied here.
+    """
+    filtered = running_median(traces, _get_smooth_wnd_pts(fn, smooth_wnd_s))
+    if detrend_wnd_s is not None:
+        filtered = detrend_norm_block(filtered, wnd=int(fn * detrend_wnd_s))
+    return filtered
+
+
+def preprocess_traces_vectorized(
+    traces,
+    fn,
+    smooth_wnd_s=5,
+    detrend_wnd_s=800,
+    block_size=2000,
+    n_workers=None,
+    dtype=None,
+):
+    """Same as preprocess_traces, but filtering blocks of ROIs at once
+    instead of looping over ROIs, and running the median filter in parallel.
+    Results match the ones of preprocess_traces.
+
+    Parameters
+    ----------
+    traces : timepoints x nrois np.array
+        traces
+    fn : int
+        sampling frequency
+    smooth_wnd_s : float
+        duration of window for the smoothing (sec)
+    detrend_wnd_s : float
+        duration of window for the detrending (sec)
+    block_size : int
+        number of ROIs filtered together, to bound the memory of temporary copies
+    n_workers : int (optional)
+        number of threads for the filtering (by default, all cores)
+    dtype : np.dtype (optional)
+        dtype of the computation and of the output, e.g. np.float32 to halve the
+        memory usage. By default, the dtype of the input as in preprocess_traces.
+
+    Returns
+    -------
+    timepoints x nrois np.array
+        Filtered traces
+
+    """
+    dtype = traces.dtype if dtype is None else dtype
+    traces_sm = np.empty(traces.shape, dtype=dtype)
+
+    n_threads = numba.get_num_threads()
+    if n_workers is not None:
+        numba.set_num_threads(n_workers)
+
+    try:
+        for start in range(0, traces.shape[1], block_size):
+            block_slice = slice(start, start + block_size)
+            traces_sm[:, block_slice] = filter_traces_block(
+                traces[:, block_slice].astype(dtype), fn, smooth_wnd_s, detrend_wnd_s
+            )
+    finally:
+        numba.set_num_threads(n_threads)
+
+    if detrend_wnd_s is None:
+        traces_sm = detrend(traces_sm, axis=1)
+
+    mean, std = np.nanmean(traces_sm, 0), np.nanstd(traces_sm, 0)
+    traces_sm -= mean
+    traces_sm /= std
+    return traces_sm
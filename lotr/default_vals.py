@@ -8,6 +8,13 @@ import numpy as np
 # Specify remote location for the dataset:
 DATASET_URL = "https://zenodo.org/record/7715001/files/"
 DATASET_HASH = "md5:c9e48cfbd875dd88af702b639a9f5bb5"
+# Environment variable to disable the download of the sample dataset:
+OFFLINE_ENV_VAR = "LOTR_OFFLINE"
+
+# Environment variable to specify the location of the cache of derived quantities,
+# and maximum size of the cache:
+CACHE_DIR_ENV_VAR = "LOTR_CACHE_DIR"
+CACHE_MAX_SIZE_MB = 2000
 # Minimum bias value that defines a turn.
 # This was defined based on trimodal curve fit over all bouts in the dataset
 TURN_BIAS = 0.239
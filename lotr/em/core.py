@@ -2,14 +2,12 @@ import numpy as np
 import pandas as pd
 
 from lotr.em.tracing_tree import (
+    SkeletonGraph,
     _edges_selection,
-    _find_all_connected,
-    _find_axon_link,
     _plotlines_from_skeleton,
     find_bifurcations,
 )
 
-from .skeleton_mesh import make_cylinder_tree, make_full_neuron
 from .transformations import em2ipnref, em2mpinref
 
 
@@ -26,29 +24,110 @@ def _find_comment_idx(pts_df, key):
 MIDLINES = dict(ipn=109, mpin=284)
 
 
+def nodes_arrays(nodes_element):
+    """Parse the "nodes" element of a skeleton in preallocated arrays.
+
+    Returns
+    -------
+    dict
+        node_ids: (n_nodes,) ids of the nodes;
+        coords: (n_nodes, 3) integer coordinates of the nodes;
+        node_comments: (n_nodes,) comments of the nodes (None if missing).
+
+    """
+    n_nodes = len(nodes_element)
+    node_ids = np.empty(n_nodes, dtype=np.int64)
+    coords = np.empty((n_nodes, 3), dtype=np.int64)
+    node_comments = np.empty(n_nodes, dtype=object)
+
+    for i, node in enumerate(nodes_element):
+        attrib = node.attrib
+        node_ids[i] = int(attrib["id"])
+        coords[i] = int(attrib["x"]), int(attrib["y"]), int(attrib["z"])
+        node_comments[i] = attrib.get("comment")
+
+    return dict(node_ids=node_ids, coords=coords, node_comments=node_comments)
+
+
+def edges_array(edges_element):
+    """Parse the "edges" element of a skeleton in a (n_edges, 2) array of
+    (source, target) node ids.
+    """
+    edges = np.empty((len(edges_element), 2), dtype=np.int64)
+    for i, edge in enumerate(edges_element):
+        edges[i] = int(edge.attrib["source"]), int(edge.attrib["target"])
+    return edges
+
+
+def thing_arrays(xml_element):
+    """Parse a "thing" element of an annotation xml file in the arguments of
+    EmNeuron.from_arrays.
+    """
+    nodes_element, edges_element = list(xml_element)[:2]
+    return dict(
+        comment=xml_element.attrib.get("comment"),
+        edges=edges_array(edges_element),
+        **nodes_arrays(nodes_element),
+    )
+
+
 class EmNeuron:
-    """Class to manipulate tracing data from EM."""
+    """Class to manipulate tracing data from EM.
+
+    Can be created from a "thing" element of an annotation xml file, or with
+    EmNeuron.from_arrays from already parsed nodes and edges (see
+    lotr.em.loading.iter_skeleton_arrays).
+    """
 
     def __init__(self, xml_element):
+        self._setup(**thing_arrays(xml_element))
+
+    @classmethod
+    def from_arrays(cls, node_ids, coords, edges, comment=None, node_comments=None):
+        """Create a neuron from arrays of nodes and edges.
+
+        Parameters
+        ----------
+        node_ids : np.array
+            (n_nodes,) ids of the nodes.
+        coords : np.array
+            (n_nodes, 3) coordinates of the nodes.
+        edges : np.array
+            (n_edges, 2) array of (source, target) node ids.
+        comment : str (optional)
+            Comment of the skeleton, starting with the neuron id.
+        node_comments : np.array (optional)
+            (n_nodes,) comments of the nodes, used to find soma and axon start.
+
+        """
+        neuron = cls.__new__(cls)
+        neuron._setup(node_ids, coords, edges, comment, node_comments)
+        return neuron
+
+    def _setup(self, node_ids, coords, edges, comment=None, node_comments=None):
         # This heuristics might have to change if we load from other sources.
 
         # This might have to change if naming system in master file is changed:
-        try:
-            self.id = xml_element.attrib["comment"][:4]
-            self.comments = xml_element.attrib["comment"]
+        if comment is not None:
+            self.id = comment[:4]
+            self.comments = comment
             self.include = "[??]" not in self.comments
-        except KeyError:
+        else:
             self.id = ""
 
-        # Ugly but necessary with XML format:
-        pts_df = pd.DataFrame([e.attrib for e in list(list(xml_element)[0])])
-        edges_df = pd.DataFrame([e.attrib for e in list(list(xml_element)[1])])
-
-        # Fix data type from string:
-        pts_df.loc[:, ["id", "x", "y", "z"]] = pts_df.loc[
-            :, ["id", "x", "y", "z"]
-        ].astype(np.int)
-
+        node_ids = np.asarray(node_ids)
+        if node_comments is None:
+            node_comments = np.full(len(node_ids), None)
+
+        pts_df = pd.DataFrame(
+            dict(
+                id=node_ids,
+                x=coords[:, 0],
+                y=coords[:, 1],
+                z=coords[:, 2],
+                comment=node_comments,
+            )
+        )
         self.points_df = pts_df
 
         # Find soma and axons ids, if available:
@@ -57,22 +136,27 @@ class EmNeuron:
         # Read soma:
         self.soma_idx = _find_comment_idx(pts_df, "soma")
 
-        # Replace node ids with indexes in the edges dataframe:
-        edges_df = edges_df.astype(np.int)
-        id_table = pd.Series(self.points_df.index, index=self.points_df.id)
-        for k in edges_df.columns:
-            edges_df[k] = edges_df[k].map(id_table)
-        self.edges = edges_df.values
+        # Replace node ids with indexes in the edges array:
+        sorter = np.argsort(node_ids)
+        positions = np.searchsorted(node_ids, edges, sorter=sorter)
+        self.edges = sorter[np.minimum(positions, len(node_ids) - 1)]
+        missing = node_ids[self.edges] != edges
+        if missing.any():
+            raise ValueError(
+                f"Edges of neuron {self.id} refer to missing node ids: "
+                f"{np.unique(np.asarray(edges)[missing])}"
+            )
 
         # TODO remove this hardcoding as cringe as fuck for fixing neuron:
         if self.id == "p085":
             self.edges = np.concatenate([self.edges, [[1157, 561]]])
 
+        self._graph = None
         self._axon_idxs = []
         self._dendr_idxs = []
         self._coords_mpin = None
         self._coords_ipn = None
-        self.coords_em = self.points_df[["x", "y", "z"]].values.astype(np.float)
+        self.coords_em = np.asarray(coords, dtype=np.float64)
 
         self.edges_dict = dict(
             all=self.edges, dendrites=self.dendrites_edges, axon=self.axon_edges
@@ -187,24 +271,30 @@ class EmNeuron:
     def get_coords(self, space):
         return getattr(self, f"coords_{space}")
 
-    def find_ax_idxs(self):
-        # Make moving possible in both directions:
-        extend_edg = np.concatenate([self.edges, np.flip(self.edges, 1)]).copy()
+    @property
+    def graph(self):
+        if self._graph is None:
+            self._graph = SkeletonGraph(self.edges, n_nodes=len(self.points_df))
+        return self._graph
 
+    def find_ax_idxs(self):
+        link = None
         if self.soma_idx is not None:
             # Find node connecting soma and axon:
-            link = _find_axon_link(extend_edg, self.soma_idx, self.ax_start_idx)
-            # Disconnect all edges from last point visited before finding axon start:
-            extend_edg[(extend_edg[:, 0] == link) | (extend_edg[:, 1] == link)] = 0
+            link = self.graph.find_link(self.soma_idx, self.ax_start_idx)
 
-        # Then, start from axon and find all connected points:
-        idxs = np.array(_find_all_connected(extend_edg, self.ax_start_idx))
+        # Then, start from axon and find all points connected without going
+        # through the last point visited before finding axon start:
+        idxs = self.graph.connected(self.ax_start_idx, blocked=link)
 
         self._axon_idxs = np.unique(idxs)
 
     def generate_mesh(
         self, dendrite_radius=4, axon_radius=4, soma_radius=100, space="em"
     ):
+        # Imported here to keep trimesh out of skeleton loading and analysis:
+        from lotr.em.skeleton_mesh import make_cylinder_tree, make_full_neuron
+
         N_SECTIONS = 7
         SOMA_SUBDIVS = 4
 
@@ -1,62 +1,153 @@
 import xml.etree.ElementTree as et
-from os import remove
+from concurrent.futures import ProcessPoolExecutor
 from zipfile import ZipFile
 
-from lotr.em.core import EmNeuron
+from lotr.em.core import EmNeuron, edges_array, nodes_arrays
+
+
+def iter_skeleton_arrays(source):
+    """Stream the skeletons ("thing" elements) of an annotation xml file, without
+    parsing the whole tree first. Nodes and edges of every skeleton are parsed in
+    arrays, and the elements are freed as soon as they are processed, so that
+    memory does not scale with the size of the file.
+
+    Parameters
+    ----------
+    source : Path object, str or file object
+        Annotation xml file.
+
+    Yields
+    ------
+    dict
+        Arguments of EmNeuron.from_arrays for every skeleton.
+
+    """
+    context = et.iterparse(source, events=("start", "end"))
+    _, root = next(context)
+
+    thing = None
+    for event, element in context:
+        if event == "start":
+            if element.tag == "thing":
+                thing = dict(comment=element.attrib.get("comment"))
+        elif thing is not None:
+            if element.tag == "nodes":
+                thing.update(nodes_arrays(element))
+                element.clear()
+            elif element.tag == "edges":
+                thing["edges"] = edges_array(element)
+                element.clear()
+            elif element.tag == "thing":
+                yield thing
+                thing = None
+                root.clear()
+
+
+def _neuron_from_arrays(thing):
+    return EmNeuron.from_arrays(**thing)
+
+
+def skeletons_from_arrays(things, with_axon_only=False, n_workers=1):
+    """Create the EmNeurons from the arrays of iter_skeleton_arrays, optionally on
+    a pool of n_workers processes, and return them sorted by id.
+    """
+    if n_workers == 1:
+        skel_list = [_neuron_from_arrays(thing) for thing in things]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            skel_list = list(executor.map(_neuron_from_arrays, things))
+
+    if with_axon_only:
+        skel_list = [skeleton for skeleton in skel_list if skeleton.has_axon]
+
+    return sorted(skel_list, key=lambda n: n.id)
 
 
 def neuron_from_xml(path):
-    xtree = et.parse(path)
-    node = xtree.getroot()
     neuron = None
-    for n in list(node):  # ugly loop
-        if n.tag == "thing":
-            neuron = EmNeuron(n)
+    for thing in iter_skeleton_arrays(path):
+        neuron = thing
 
-    return neuron
+    return None if neuron is None else _neuron_from_arrays(neuron)
 
 
-def load_skeletons_dict_from_zip(path):
-    segments = load_skeletons_from_zip(path)
+def load_skeletons_dict_from_zip(path, with_axon_only=False, n_workers=1):
+    segments = load_skeletons_from_zip(
+        path, with_axon_only=with_axon_only, n_workers=n_workers
+    )
     return {s.id: s for s in segments}
 
 
-def load_skeletons_from_zip(path, with_axon_only=False):
-    content_name = "annotation.xml"
-    with ZipFile(path, "r") as zip_obj:
-        # Extract all the contents of zip file (the "annotation.xml" file)
-        # in current directory:
-        zip_obj.extractall()
+def load_skeletons_from_zip(path, with_axon_only=False, n_workers=1):
+    """Load the skeletons of the annotation.xml file of a zip archive, streaming
+    it from the archive without extracting it (see iter_skeleton_arrays).
+    See load_skeletons_from_xml for the parameters.
+    """
+    with ZipFile(path, "r") as zip_obj, zip_obj.open("annotation.xml") as f:
+        return skeletons_from_arrays(
+            iter_skeleton_arrays(f), with_axon_only=with_axon_only, n_workers=n_workers
+        )
 
-    xtree = et.parse(content_name)
-    node = xtree.getroot()
 
-    skel_list = []
-    for n in list(node):  # ugly loop
-        if n.tag == "thing":
-            skeleton = EmNeuron(n)
-            if with_axon_only:
-                if skeleton.has_axon:
-                    skel_list.append(EmNeuron(n))
-            else:
-                skel_list.append(EmNeuron(n))
+def load_skeletons_dict_from_zips(paths, with_axon_only=False, n_workers=1):
+    """Load the skeletons of multiple zip archives, processing the archives in
+    parallel, and merge them in a single dictionary. If the same id is in more
+    archives, the neuron from the last archive in paths is kept.
 
-    remove(content_name)
-    return sorted(skel_list, key=lambda n: n.id)
+    Parameters
+    ----------
+    paths : list of Path objects
+        Zip archives.
+    with_axon_only : bool
+        If True, only skeletons with an annotated axon are returned.
+    n_workers : int
+        Number of processes, each loading one archive at a time. If 1, archives
+        are loaded in the current process.
 
+    Returns
+    -------
+    dict
+        Neuron id: EmNeuron.
 
-def load_skeletons_from_xml(path, with_axon_only=False):
-    xtree = et.parse(path)
-    node = xtree.getroot()
+    """
+    if n_workers == 1:
+        dicts = [load_skeletons_dict_from_zip(p, with_axon_only) for p in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            dicts = list(
+                executor.map(
+                    load_skeletons_dict_from_zip,
+                    paths,
+                    [with_axon_only] * len(paths),
+                )
+            )
 
-    skel_list = []
-    for n in list(node):  # ugly loop
-        if n.tag == "thing":
-            skeleton = EmNeuron(n)
-            if with_axon_only:
-                if skeleton.has_axon:
-                    skel_list.append(EmNeuron(n))
-            else:
-                skel_list.append(EmNeuron(n))
+    neurons_dict = dict()
+    for skeletons_dict in dicts:
+        neurons_dict.update(skeletons_dict)
+    return neurons_dict
 
-    return sorted(skel_list, key=lambda n: n.id)
+
+def load_skeletons_from_xml(path, with_axon_only=False, n_workers=1):
+    """Load the skeletons of an annotation xml file, streaming the file (see
+    iter_skeleton_arrays).
+
+    Parameters
+    ----------
+    path : Path object or str
+        Annotation xml file.
+    with_axon_only : bool
+        If True, only skeletons with an annotated axon are returned.
+    n_workers : int
+        Number of processes for creating the neurons. If 1, they are created in
+        the current process.
+
+    Returns
+    -------
+    list of EmNeuron
+        Skeletons sorted by id.
+
+    """
+    return skeletons_from_arrays(
+        iter_skeleton_arrays(path), with_axon_only=with_axon_only, n_workers=n_workers
+    )
@@ -2,60 +2,172 @@ import numpy as np
 from numba import jit
 
 
-def find_bifurcations(edges):
-    duplicated = np.concatenate([edges, edges[:, ::-1]])
-    unique, counts = np.unique(duplicated, return_counts=True)
-    return unique[counts > 4]
-
-
 @jit(nopython=True)
-def _find_axon_link(extend_edg, soma_id, ax_id):
-    """Function to find last link between soma and axon node."""
-    tovisit = [soma_id]
-    visited = []
-
-    keepsearch = True
-    while len(tovisit) > 0 and keepsearch:
-        visiting = tovisit.pop()
-        if visiting not in visited:
-            new_nodes = extend_edg[extend_edg[:, 0] == visiting][:, 1]
-            for n in new_nodes:
-                if ax_id == n:
-                    keepsearch = False
-            tovisit.extend(new_nodes)
-        visited.append(visiting)
+def _csr_find_link(indptr, neighbors, source, target):
+    """Depth-first search from source, returning the first visited node that is
+    connected to target. Nodes are visited in the same order as the former search
+    on the edge list (neighbors pushed on a stack in the order of the edges).
+    """
+    visited = np.zeros(len(indptr) - 1, dtype=np.bool_)
+    tovisit = np.empty(len(neighbors) + 1, dtype=np.int64)
+    tovisit[0] = source
+    n_tovisit = 1
+
+    visiting = source
+    while n_tovisit > 0:
+        n_tovisit -= 1
+        visiting = tovisit[n_tovisit]
+        if not visited[visiting]:
+            visited[visiting] = True
+            found = False
+            for i in range(indptr[visiting], indptr[visiting + 1]):
+                if neighbors[i] == target:
+                    found = True
+                tovisit[n_tovisit] = neighbors[i]
+                n_tovisit += 1
+            if found:
+                break
 
     return visiting
 
 
 @jit(nopython=True)
-def _find_all_connected(extend_edg, ax_id):
-    """Function to find all points connected to seed.
-    To be used after disconnecting soma from axon.
+def _csr_connected(indptr, neighbors, start, blocked):
+    """Nodes connected to start without passing through the blocked node (-1 for
+    none), in depth-first order.
+    """
+    visited = np.zeros(len(indptr) - 1, dtype=np.bool_)
+    if blocked >= 0:
+        visited[blocked] = True
+    tovisit = np.empty(len(neighbors) + 1, dtype=np.int64)
+    connected = np.empty(len(indptr) - 1, dtype=np.int64)
+    tovisit[0] = start
+    visited[start] = True
+    n_tovisit, n_connected = 1, 0
+
+    while n_tovisit > 0:
+        n_tovisit -= 1
+        visiting = tovisit[n_tovisit]
+        connected[n_connected] = visiting
+        n_connected += 1
+        for i in range(indptr[visiting], indptr[visiting + 1]):
+            if not visited[neighbors[i]]:
+                visited[neighbors[i]] = True
+                tovisit[n_tovisit] = neighbors[i]
+                n_tovisit += 1
+
+    return connected[:n_connected]
+
+
+@jit(nopython=True)
+def _csr_parents(indptr, neighbors, root):
+    """Parent of every node in the breadth-first tree from root (-1 for the root
+    and for unconnected nodes).
     """
-    tovisit = [ax_id]
-    visited = []
-    while len(tovisit) > 0:
-        visiting = tovisit.pop()
+    parents = np.full(len(indptr) - 1, -1, dtype=np.int64)
+    visited = np.zeros(len(indptr) - 1, dtype=np.bool_)
+    queue = np.empty(len(indptr) - 1, dtype=np.int64)
+    queue[0] = root
+    visited[root] = True
+    start, end = 0, 1
+
+    while start < end:
+        visiting = queue[start]
+        start += 1
+        for i in range(indptr[visiting], indptr[visiting + 1]):
+            if not visited[neighbors[i]]:
+                visited[neighbors[i]] = True
+                parents[neighbors[i]] = visiting
+                queue[end] = neighbors[i]
+                end += 1
+
+    return parents
+
+
+class SkeletonGraph:
+    """Undirected graph of a skeleton, with the adjacency in compressed sparse row
+    format, so that traversals are linear in the number of nodes and edges.
+
+    Parameters
+    ----------
+    edges : np.array
+        (n_edges, 2) array of node indexes.
+    n_nodes : int (optional)
+        Number of nodes, by default the largest index in the edges + 1.
 
-        if visiting not in visited:
-            new_nodes = extend_edg[extend_edg[:, 0] == visiting][:, 1]
-            tovisit.extend(new_nodes)
-        visited.append(visiting)
+    """
 
-    return visited
+    def __init__(self, edges, n_nodes=None):
+        edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+        if n_nodes is None:
+            n_nodes = edges.max() + 1 if len(edges) > 0 else 0
+        self.n_nodes = n_nodes
+
+        # Both directions, with the neighbors of every node in the order of the
+        # edges (first as source, then as target):
+        extend_edg = np.concatenate([edges, edges[:, ::-1]])
+        order = np.argsort(extend_edg[:, 0], kind="stable")
+        self.neighbors = extend_edg[order, 1]
+
+        self.degree = np.bincount(extend_edg[:, 0], minlength=n_nodes)
+        self.indptr = np.concatenate([[0], np.cumsum(self.degree)])
+
+    def neighbors_of(self, node):
+        return self.neighbors[self.indptr[node] : self.indptr[node + 1]]
+
+    def connected(self, start, blocked=None):
+        """Nodes connected to start (included), optionally without passing through
+        a blocked node, in depth-first order.
+        """
+        return _csr_connected(
+            self.indptr, self.neighbors, start, -1 if blocked is None else blocked
+        )
+
+    def find_link(self, source, target):
+        """Node through which a depth-first search from source reaches target."""
+        return _csr_find_link(self.indptr, self.neighbors, source, target)
+
+    def parents(self, root):
+        """Parent of every node in the tree rooted at root (-1 for the root and for
+        nodes not connected to it).
+        """
+        return _csr_parents(self.indptr, self.neighbors, root)
+
+    def path(self, source, target):
+        """Nodes on the shortest path from source to target (empty if they are not
+        connected).
+        """
+        parents = self.parents(source)
+        if target != source and parents[target] < 0:
+            return np.array([], dtype=np.int64)
+
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        return np.array(path[::-1])
+
+    def subtree(self, node, root):
+        """Nodes of the subtree starting at node, in the tree rooted at root."""
+        parent = self.parents(root)[node]
+        return self.connected(node, blocked=None if parent < 0 else parent)
+
+    def branch_points(self):
+        """Nodes with more than two neighbors."""
+        return np.flatnonzero(self.degree > 2)
+
+
+def find_bifurcations(edges):
+    return SkeletonGraph(edges).branch_points()
 
 
-@jit(nopython=True)
 def _edges_selection(edges, idxs):
     """Find all edges that contain an index from a index array."""
-    good_edges = np.full(edges.shape, -1)
-
-    for i, edge in enumerate(edges):
-        if (edge[0] == idxs).any() or (edge[1] == idxs).any():
-            good_edges[i, :] = edge
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    selected = np.zeros(edges.max(initial=-1) + 1, dtype=bool)
+    idxs = np.asarray(idxs, dtype=np.int64)
+    selected[idxs[idxs < len(selected)]] = True
 
-    return good_edges[good_edges[:, 0] >= 0, :]
+    return edges[selected[edges[:, 0]] | selected[edges[:, 1]], :]
 
 
 @jit(nopython=True)
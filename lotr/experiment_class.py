@@ -1,10 +1,14 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from threading import Lock
 
 import flammkuchen as fl
 import numpy as np
 from bouter import EmbeddedExperiment
 
 from lotr.behavior import get_fictive_heading
+from lotr.caching import DiskCache
 from lotr.data_preprocessing.anatomy import reshape_stack, transform_points
 from lotr.data_preprocessing.stimulus import get_all_trials_df
 from lotr.default_vals import (
@@ -12,9 +16,14 @@ from lotr.default_vals import (
     PCA_TIME_PAD_S,
     TO_IPNREF_MTX,
 )
+from lotr.lazy_arrays import LazyH5Array
 from lotr.pca import pca_and_phase
-from lotr.plotting import color_stack
-from lotr.rpca_calculation import get_zero_mean_weights, reorient_pcs
+from lotr.rpca_calculation import (
+    compute_network_phase,
+    get_zero_mean_weights,
+    reorient_pcs,
+    rpc_scores_and_phase_stacked,
+)
 
 
 class LotrExperiment(EmbeddedExperiment):
@@ -23,6 +32,18 @@ class LotrExperiment(EmbeddedExperiment):
     how semi-processed files are generated,
     look into lotr/scripts/00_folder_preprocessing.py.
 
+    If a cache is passed (a lotr.caching.DiskCache object, or True for the default
+    one), expensive derived quantities (rPC scores, network phase, etc.) are
+    cached on disk, keyed on the content of the experiment files.
+
+    pca_kwargs are passed to lotr.pca.pca_and_phase to choose the PCA solver for
+    the rPC scores (e.g. dict(solver="randomized", dtype=np.float32) for large
+    recordings). They are part of the keys of cached quantities.
+
+    If lazy_traces=True is passed, traces and raw_traces are returned as
+    LazyH5Array objects that read from disk only the slices that are requested
+    (e.g. exp.traces[:, exp.hdn_indexes]), instead of loading the full matrices.
+
     NOTES: Anatomical space
         Anatomical stacks are returned to follow the following convention:
             (inferior-superior, posterior-anterior, left-right)
@@ -51,9 +72,27 @@ class LotrExperiment(EmbeddedExperiment):
         plt.scatter(exp.coords_um[:, 1], exp.coords_um[:, 2])
     """
 
-    def __init__(self, *args, selected=None, **kwargs):
+    def __init__(
+        self,
+        *args,
+        selected=None,
+        lazy_traces=False,
+        cache=None,
+        pca_kwargs=None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
 
+        # Options of the PCA for the rPC scores, see lotr.pca.pca_and_phase:
+        self.pca_kwargs = dict() if pca_kwargs is None else pca_kwargs
+
+        # If True, traces and raw_traces are read from disk only when sliced:
+        self.lazy_traces = lazy_traces
+
+        # Cache for derived quantities. Can be a DiskCache, or True for the default:
+        self.cache = DiskCache() if cache is True else cache
+        self._fingerprint = None
+
         self.microscope_config = self["imaging"]["microscope_config"]
 
         self._dt_imaging = None
@@ -156,15 +195,23 @@ class LotrExperiment(EmbeddedExperiment):
     @property
     def traces(self):
         if self._traces is None:
-            self._traces = fl.load(self.root / "filtered_traces.h5", "/detr")
+            if self.lazy_traces:
+                self._traces = LazyH5Array(self.root / "filtered_traces.h5", "/detr")
+            else:
+                self._traces = fl.load(self.root / "filtered_traces.h5", "/detr")
         return self._traces
 
     @property
     def raw_traces(self):
         if self._raw_traces is None:
-            self._raw_traces = fl.load(
-                self.root / "data_from_suite2p_unfiltered.h5", "/traces"
-            ).T
+            if self.lazy_traces:
+                self._raw_traces = LazyH5Array(
+                    self.root / "data_from_suite2p_unfiltered.h5", "/traces"
+                ).T
+            else:
+                self._raw_traces = fl.load(
+                    self.root / "data_from_suite2p_unfiltered.h5", "/traces"
+                ).T
         return self._raw_traces
 
     @property
@@ -232,9 +279,26 @@ class LotrExperiment(EmbeddedExperiment):
 
     @property
     def rndcnt_indexes(self):
+        # Drawn once, so that rpc_scores_shuf and network_phase_shuf use the same
+        # random control ROIs:
+        if self._rndcnt_indexes is None:
+            all_possible = np.argwhere(self.nonhdn_indexes).flatten()
+            np.random.shuffle(all_possible)
+            self._rndcnt_indexes = all_possible[: len(self.hdn_indexes)]
+        return self._rndcnt_indexes
+
+    def draw_rndcnt_indexes(self, n_sets, seed=None):
+        """Draw n_sets random sets of non-HDN ROIs, as many as the HDNs, as a
+        (n_sets, n_hdns) array. Reproducible if a seed is specified.
+        """
+        rng = np.random.default_rng(seed)
         all_possible = np.argwhere(self.nonhdn_indexes).flatten()
-        np.random.shuffle(all_possible)
-        return all_possible[: len(self.hdn_indexes)]
+        return np.stack(
+            [
+                rng.choice(all_possible, len(self.hdn_indexes), replace=False)
+                for _ in range(n_sets)
+            ]
+        )
 
     @property
     def n_pts(self):
@@ -289,22 +353,58 @@ class LotrExperiment(EmbeddedExperiment):
         """
         # 1. compute PCs:
         pca_scores, angles, _, circle_params = pca_and_phase(
-            self.traces[self.pca_t_slice, idxs].T
+            self.traces[self.pca_t_slice, idxs].T, **self.pca_kwargs
         )
         # 2. center on 0:
         centered_pca_scores = pca_scores[:, :2] - circle_params[:2]
 
         # 3. Find transformation to match anatomy
         # Normalize coords (we don't care about z here)
-        w_coords = get_zero_mean_weights(self.coords[self.hdn_indexes, 1:])
+        w_coords = get_zero_mean_weights(self.coords[idxs, 1:])
 
         # Find transformation to have at 0 angle rostral ROIs:
         return reorient_pcs(centered_pca_scores, w_coords)
 
+    @property
+    def fingerprint(self):
+        """Stable fingerprint of the content of the experiment files."""
+        if self._fingerprint is None:
+            cache = self.cache if self.cache is not None else DiskCache()
+            self._fingerprint = cache.experiment_fingerprint(self.root)
+        return self._fingerprint
+
+    def cached(self, name, compute_fun, **params):
+        """Compute a quantity, or get it from the cache if we have one.
+
+        Parameters
+        ----------
+        name : str
+            Name of the cached quantity.
+        compute_fun : callable
+            Function with no arguments computing the quantity.
+        params : dict
+            Parameters of the computation. They become part of the cache key.
+
+        """
+        if self.cache is None:
+            return compute_fun()
+        return self.cache.get_or_compute(self.fingerprint, name, compute_fun, **params)
+
+    def invalidate_cache(self):
+        """Delete all cached quantities for this experiment."""
+        if self.cache is not None:
+            self.cache.invalidate(self.fingerprint)
+
     @property
     def rpc_scores(self):
         if self._rpc_scores is None:
-            self._rpc_scores = self._compute_rpc_scores(self.hdn_indexes)
+            self._rpc_scores = self.cached(
+                "rpc_scores",
+                lambda: self._compute_rpc_scores(self.hdn_indexes),
+                hdn_indexes=self.hdn_indexes,
+                pca_t_slice=self.pca_t_slice,
+                pca_kwargs=self.pca_kwargs,
+            )
         return self._rpc_scores
 
     @property
@@ -316,13 +416,17 @@ class LotrExperiment(EmbeddedExperiment):
     @property
     def stim_trials_df(self):
         if self._stim_trials_df is None:
-            self._stim_trials_df = get_all_trials_df(self)
+            self._stim_trials_df = self.cached(
+                "stim_trials_df", lambda: get_all_trials_df(self)
+            )
 
         return self._stim_trials_df
 
     @property
     def fictive_heading(self):
-        return get_fictive_heading(self.n_pts, self.bouts_df)
+        return self.cached(
+            "fictive_heading", lambda: get_fictive_heading(self.n_pts, self.bouts_df)
+        )
 
     @staticmethod
     def _get_pc_scores_angles(pc_scores):
@@ -349,19 +453,17 @@ class LotrExperiment(EmbeddedExperiment):
         """For a tutorial on this calculation, have a look at
         'Anatomical organization of the network.ipynb'
         """
-        # TODO write as matrix multiplication
-        norm_activity = get_zero_mean_weights(self.traces[:, indexes].T).T
-        avg_vects = np.einsum("ij,ik->jk", norm_activity.T, rpc_scores)
-
-        # This choice of signs ensures that network phase correspond to angle of
-        # max activation or ROIs over rPC space:
-        return np.arctan2(avg_vects[:, 1], -avg_vects[:, 0])
+        return compute_network_phase(self.traces[:, indexes], rpc_scores)
 
     @property
     def network_phase(self):
         if self._network_phase is None:
-            self._network_phase = self.get_network_phase(
-                self.hdn_indexes, self.rpc_scores
+            self._network_phase = self.cached(
+                "network_phase",
+                lambda: self.get_network_phase(self.hdn_indexes, self.rpc_scores),
+                hdn_indexes=self.hdn_indexes,
+                pca_t_slice=self.pca_t_slice,
+                pca_kwargs=self.pca_kwargs,
             )
 
         return self._network_phase
@@ -375,6 +477,83 @@ class LotrExperiment(EmbeddedExperiment):
 
         return self._network_phase_shuf
 
+    def _compute_shuffle_ensemble(self, n_shuffles, seed, chunk_size, n_workers):
+        indexes = self.draw_rndcnt_indexes(n_shuffles, seed=seed)
+        chunks = [indexes[i : i + chunk_size] for i in range(0, n_shuffles, chunk_size)]
+
+        # Load traces and coords before starting the threads:
+        traces, coords, t_slice = self.traces, self.coords, self.pca_t_slice
+        # Reading from files (e.g., hdf5 for lazy traces) might not be thread-safe:
+        read_lock = None if isinstance(traces, np.ndarray) else Lock()
+
+        def _compute_chunk(chunk_indexes):
+            if read_lock is None:
+                chunk_traces = np.stack([traces[:, idxs] for idxs in chunk_indexes])
+            else:
+                with read_lock:
+                    chunk_traces = np.stack([traces[:, idxs] for idxs in chunk_indexes])
+            w_coords = np.stack(
+                [get_zero_mean_weights(coords[idxs, 1:]) for idxs in chunk_indexes]
+            )
+            return rpc_scores_and_phase_stacked(chunk_traces, w_coords, t_slice)
+
+        # Numpy releases the GIL in the matrix products and decompositions:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            results = list(executor.map(_compute_chunk, chunks))
+
+        return dict(
+            indexes=indexes,
+            rpc_scores=np.concatenate([r[0] for r in results]),
+            network_phase=np.concatenate([r[1] for r in results]),
+        )
+
+    def shuffle_ensemble(
+        self, n_shuffles=100, seed=None, chunk_size=16, n_workers=None
+    ):
+        """Ensemble of shuffle controls for the rPC scores and the network phase,
+        computed as rpc_scores_shuf and network_phase_shuf on n_shuffles random
+        sets of non-HDN ROIs. Sets are processed in stacked chunks (see
+        lotr.rpca_calculation.rpc_scores_and_phase_stacked) on a thread pool.
+        The PCs are always computed exactly, whatever the pca_kwargs.
+
+        Parameters
+        ----------
+        n_shuffles : int
+            Number of random sets of ROIs.
+        seed : int (optional)
+            Seed for drawing the sets. If specified, the ensemble is reproducible
+            and it is stored in the cache, if the experiment has one.
+        chunk_size : int
+            Number of sets stacked together; memory scales with
+            chunk_size * n_pts * n_hdns.
+        n_workers : int (optional)
+            Number of threads, by default the ThreadPoolExecutor default.
+
+        Returns
+        -------
+        dict
+            indexes: (n_shuffles, n_hdns) indexes of the ROIs of every set;
+            rpc_scores: (n_shuffles, n_hdns, 2) rPC scores;
+            network_phase: (n_shuffles, n_pts) network phases.
+
+        """
+
+        def _compute():
+            return self._compute_shuffle_ensemble(
+                n_shuffles, seed, chunk_size, n_workers
+            )
+
+        if seed is None:
+            return _compute()
+        return self.cached(
+            "shuffle_ensemble",
+            _compute,
+            n_shuffles=n_shuffles,
+            seed=seed,
+            hdn_indexes=self.hdn_indexes,
+            pca_t_slice=self.pca_t_slice,
+        )
+
     def find_mirror_dir(self, parent_folder):
         """Find homonym directory in a new parent folder, for file mirroring."""
         parent_folder = Path(parent_folder)
@@ -410,13 +589,18 @@ class LotrExperiment(EmbeddedExperiment):
             else:
                 raise ValueError(f"Can't infer index for variable of len {len(values)}")
 
+        # Imported here to keep the plotting stack out of headless data analysis:
+        from lotr.plotting import color_stack
+
         full_val_arr = np.full(self.n_rois, np.nan)
         full_val_arr[indexes] = values
         return color_stack(self.rois_stack, variable=full_val_arr, **kwargs)
 
     @property
     def exp_code(self):
-        return "f" + str(hash(self.root.name))[-5:]
+        # Stable across processes, unlike the salted builtin hash():
+        name_hash = hashlib.blake2b(self.root.name.encode(), digest_size=8)
+        return "f" + str(int(name_hash.hexdigest(), 16))[-5:]
 
 
 def compute_resolution_for_2p(zoom, size_px):
@@ -1,3 +1,4 @@
+import os
 import re
 import tempfile
 from pathlib import Path
@@ -7,19 +8,36 @@ import ipynbname
 import pooch
 from tqdm import tqdm
 
-from lotr.default_vals import DATASET_HASH, DATASET_URL
+from lotr.default_vals import DATASET_HASH, DATASET_URL, OFFLINE_ENV_VAR
 
 
-def get_dataset_location():
+def is_offline():
+    """Check if we are running in offline mode, activated by setting the
+    LOTR_OFFLINE environment variable (to anything but "", "0" or "false").
+    """
+    return os.environ.get(OFFLINE_ENV_VAR, "").lower() not in ["", "0", "false"]
+
+
+def get_dataset_location(offline=None):
     """Handles finding the source data of the analysis.
     By default, tries to find the repo dataset_location.txt file.
     If not available, download test dataset from web (for CI).
 
+    Parameters
+    ----------
+    offline : bool (optional)
+        If True, never download the sample dataset: it will be used only if it is
+        already in the local cache. By default, read from the LOTR_OFFLINE
+        environment variable.
+
     Returns
     -------
     dataset location
 
     """
+    if offline is None:
+        offline = is_offline()
+
     specification_txt = Path(__file__).parent.parent / "dataset_location.txt"
     if specification_txt.exists():
         with open(specification_txt, "r") as f:
@@ -32,6 +50,12 @@ def get_dataset_location():
         registry={"sample_dataset.zip": DATASET_HASH},
     )
 
+    if offline and not (data_pooch.abspath / "sample_dataset.zip").exists():
+        raise FileNotFoundError(
+            "No dataset_location.txt file and no cached sample dataset found, "
+            f"and download is disabled by {OFFLINE_ENV_VAR}."
+        )
+
     unpack = pooch.Unzip(members=None)
     fnames = data_pooch.fetch("sample_dataset.zip", processor=unpack)
     print(fnames[0])
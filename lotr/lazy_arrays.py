@@ -0,0 +1,120 @@
+import operator
+
+import numpy as np
+import tables
+
+
+def _axis_index(key, size):
+    """Convert the index of one axis into a selection that can be read with pytables
+    (slices or a sorted list without repetitions), and an index to be applied after
+    reading to restore numpy indexing semantics.
+    """
+    if isinstance(key, slice):
+        return key, slice(None)
+
+    if np.ndim(key) == 0 and not isinstance(key, np.ndarray):
+        i = operator.index(key)
+        i = i + size if i < 0 else i
+        if not 0 <= i < size:
+            raise IndexError(f"index {key} is out of bounds for axis with size {size}")
+        return slice(i, i + 1), 0
+
+    arr = np.asarray(key)
+    if arr.dtype == bool:
+        arr = np.flatnonzero(arr)
+    arr = np.where(arr < 0, arr + size, arr).astype(int)
+
+    if arr.size == 0:
+        return slice(0, 0), arr
+
+    unique, inverse = np.unique(arr, return_inverse=True)
+    return unique, inverse.reshape(arr.shape)
+
+
+class LazyH5Array:
+    """Read-only, array-like view over an array saved in an hdf5 file
+    (e.g. with flammkuchen). Indexing it reads from disk only the requested
+    selection, so the memory used scales with the selection and not with the full
+    array. Supports integers, slices, integer and boolean arrays (in any order and
+    with repetitions) as numpy does. np.asarray(lazy_array) loads the full array.
+
+    Parameters
+    ----------
+    filename : Path object or str
+        Path of the hdf5 file.
+    node : str
+        Path of the array node in the file (e.g. "/detr").
+    transpose : bool (optional)
+        If true, the view is transposed (only 2D arrays). Same as using .T.
+
+    """
+
+    def __init__(self, filename, node, transpose=False):
+        self.filename = filename
+        self.node = node
+        self.transpose = transpose
+
+        with tables.open_file(str(self.filename), "r") as f:
+            array = f.get_node(self.node)
+            self._shape = tuple(array.shape)
+            self.dtype = array.dtype
+
+        if self.transpose and len(self._shape) != 2:
+            raise ValueError("Only 2D arrays can be transposed.")
+
+    @property
+    def shape(self):
+        return self._shape[::-1] if self.transpose else self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def T(self):
+        return LazyH5Array(self.filename, self.node, transpose=not self.transpose)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return (
+            f"LazyH5Array({self.filename}:{self.node}, shape={self.shape}, "
+            f"dtype={self.dtype})"
+        )
+
+    def _read(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for array")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        read_key, post_key = zip(*[_axis_index(k, s) for k, s in zip(key, self._shape)])
+        read_key, post_key = list(read_key), list(post_key)
+
+        # pytables can read only one list at a time. For additional lists, read the
+        # span between their extremes and select afterwards:
+        lists = [i for i, k in enumerate(read_key) if isinstance(k, np.ndarray)]
+        for i in lists[1:]:
+            unique = read_key[i]
+            post_key[i] = unique[post_key[i]] - unique[0]
+            read_key[i] = slice(unique[0], unique[-1] + 1)
+
+        with tables.open_file(str(self.filename), "r") as f:
+            block = f.get_node(self.node)[tuple(read_key)]
+
+        return block[tuple(post_key)]
+
+    def __getitem__(self, key):
+        if not self.transpose:
+            return self._read(key)
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (2 - len(key))
+        return self._read(key[::-1]).T
+
+    def __array__(self, dtype=None):
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
@@ -0,0 +1,107 @@
+"""Online estimation of the network phase, for closed-loop experiments.
+
+The rPC scores of the HDNs are fitted offline once (e.g. from a LotrExperiment);
+then, the phase is updated frame by frame from the fluorescence of the HDNs with
+the same normalization of compute_network_phase, with O(n_hdn) operations per
+frame and no allocation of arrays depending on the recording length.
+"""
+
+import numpy as np
+
+
+class OnlinePhaseEstimator:
+    """Estimate the network phase from streaming activity of the HDNs.
+
+    Parameters
+    ----------
+    rpc_scores : np.array
+        (n_hdn, 2) matrix with the rPC scores of the HDNs.
+    roi_indexes : np.array (optional)
+        Indexes of the HDNs in the frames passed to update. If None, frames must
+        contain only the HDNs, in the order of rpc_scores.
+    smoothing_tau : float (optional)
+        Time constant, in frames, of the causal exponential smoothing of the
+        population vector from which the phase is computed. No smoothing if None.
+
+    Examples
+    --------
+    >>> estimator = OnlinePhaseEstimator.from_experiment(exp, smoothing_tau=2)
+    >>> for frame in stream:  # (n_rois,) activity of all ROIs in the frame
+    ...     phase = estimator.update(frame)
+
+    """
+
+    def __init__(self, rpc_scores, roi_indexes=None, smoothing_tau=None):
+        self.rpc_scores = np.ascontiguousarray(rpc_scores[:, :2], dtype=np.float64)
+        self.roi_indexes = roi_indexes
+        self.smoothing_tau = smoothing_tau
+
+        n_hdn = self.rpc_scores.shape[0]
+        self._decay = 0.0 if smoothing_tau is None else np.exp(-1 / smoothing_tau)
+
+        # As normalized weights sum to 1, subtracting their mean is the same as
+        # subtracting the mean of the scores from the projection:
+        self._mean_scores = self.rpc_scores.mean(0)
+
+        # Position of the 2nd percentile in the sorted frame (linear interpolation,
+        # as np.percentile):
+        position = 0.02 * (n_hdn - 1)
+        self._low_idx = int(np.floor(position))
+        self._high_idx = min(self._low_idx + 1, n_hdn - 1)
+        self._frac = position - self._low_idx
+
+        self._buffer = np.empty(n_hdn)
+        self.reset()
+
+    @classmethod
+    def from_experiment(cls, exp, **kwargs):
+        """Estimator with the rPC scores of the HDNs of a LotrExperiment, taking
+        frames with the activity of all the ROIs of the experiment.
+        """
+        return cls(exp.rpc_scores, roi_indexes=exp.hdn_indexes, **kwargs)
+
+    def reset(self):
+        """Forget the history of the smoothing filter."""
+        self._vector = None
+        self.phase = np.nan
+
+    def _baseline(self, activity):
+        self._buffer[:] = activity
+        self._buffer.partition([self._low_idx, self._high_idx])
+        low, high = self._buffer[self._low_idx], self._buffer[self._high_idx]
+        return low + (high - low) * self._frac
+
+    def update(self, frame):
+        """Update the phase with a new frame.
+
+        Parameters
+        ----------
+        frame : np.array
+            Activity of the ROIs at the new timepoint.
+
+        Returns
+        -------
+        float
+            Network phase.
+
+        """
+        activity = frame if self.roi_indexes is None else frame[self.roi_indexes]
+
+        weights = activity - self._baseline(activity)
+        np.maximum(weights, 0, out=weights)
+        vector = (weights @ self.rpc_scores) / weights.sum() - self._mean_scores
+
+        if self._vector is None or self._decay == 0:
+            self._vector = vector
+        else:
+            self._vector = self._decay * self._vector + (1 - self._decay) * vector
+
+        # Same signs of compute_network_phase:
+        self.phase = np.arctan2(self._vector[1], -self._vector[0])
+        return self.phase
+
+    def update_many(self, frames):
+        """Update the phase with a (n_frames, n_rois) block of frames, and return
+        the (n_frames,) phases.
+        """
+        return np.array([self.update(frame) for frame in frames])
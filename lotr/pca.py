@@ -1,7 +1,7 @@
 import numpy as np
 from circle_fit import hyper_fit
 from scipy.optimize import curve_fit, quadratic_assignment
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from tqdm import tqdm
 
 from lotr.behavior import get_fictive_heading
@@ -22,7 +22,31 @@ def fictive_heading_and_fit(phase_unwrapped, bouts_df, fn=5, min_bias=0.05):
     return fictive_trajectory, params
 
 
-def pca_and_phase(traces_fit, traces_transform=None, comp0=0, comp1=1):
+PCA_SOLVERS = ["auto", "full", "randomized", "incremental"]
+
+
+def _fit_pca(traces_fit, n_components, solver, batch_size=None, random_state=None):
+    if solver == "incremental":
+        return IncrementalPCA(n_components=n_components, batch_size=batch_size).fit(
+            traces_fit
+        )
+    elif solver in PCA_SOLVERS:
+        return PCA(
+            n_components=n_components, svd_solver=solver, random_state=random_state
+        ).fit(traces_fit)
+    raise ValueError(f"solver must be one of {PCA_SOLVERS}, not {solver}")
+
+
+def pca_and_phase(
+    traces_fit,
+    traces_transform=None,
+    comp0=0,
+    comp1=1,
+    solver="auto",
+    dtype=None,
+    batch_size=None,
+    random_state=None,
+):
     """Compute PCA and fit circle and phase to first
     two components (or two otherwise specified components).
 
@@ -39,6 +63,17 @@ def pca_and_phase(traces_fit, traces_transform=None, comp0=0, comp1=1):
         First component over which to fit the circle (default=0).
     comp1 : int (optional)
         Second component over which to fit the circle (default=1).
+    solver : str (optional)
+        "auto", "full" or "randomized" for the corresponding svd_solver of
+        sklearn PCA, or "incremental" for an IncrementalPCA fit over chunks of
+        rows of traces_fit. For large recordings, "randomized" is much faster.
+    dtype : np.dtype (optional)
+        If specified, data are cast to this dtype (e.g. np.float32 to halve
+        memory and computation time).
+    batch_size : int (optional)
+        Number of rows per chunk for the "incremental" solver.
+    random_state : int (optional)
+        Seed for the "randomized" solver.
 
     Returns
     -------
@@ -46,11 +81,26 @@ def pca_and_phase(traces_fit, traces_transform=None, comp0=0, comp1=1):
     """
     if traces_transform is None:
         traces_transform = traces_fit
+    if dtype is not None:
+        traces_fit = np.asarray(traces_fit, dtype=dtype)
+        traces_transform = np.asarray(traces_transform, dtype=dtype)
 
     # Compute PCA and transform traces:
-    pca = PCA(n_components=5).fit(traces_fit)
+    pca = _fit_pca(traces_fit, 5, solver, batch_size, random_state)
     pcaed = pca.transform(traces_transform)
 
+    # Solvers can return components with different signs. Use the convention of
+    # the full svd solver of sklearn (largest absolute score on the fit data is
+    # positive), so that results do not depend on the solver:
+    fit_scores = (
+        pca.transform(traces_fit) if traces_transform is not traces_fit else pcaed
+    )
+    max_abs_rows = np.argmax(np.abs(fit_scores), axis=0)
+    signs = np.sign(fit_scores[max_abs_rows, np.arange(fit_scores.shape[1])])
+    signs[signs == 0] = 1
+    pca.components_ *= signs[:, np.newaxis]
+    pcaed = pcaed * signs
+
     # Fit circle:
     circle_params = hyper_fit(pcaed[:, [comp0, comp1]])
 
@@ -101,6 +151,91 @@ def fit_phase_neurons(traces, phase, disable_bar=False):
     return cell_phases, covs
 
 
+def fit_phase_neurons_batched(traces, phase, max_iter=50, tol=1e-10):
+    """Fit a phase to neurons' activity, for all neurons at once. Same fit as
+    fit_phase_neurons, without a curve_fit call per cell.
+
+    After the percentile normalization of phase_from_fit, the squared error of
+    cos(x + ph) depends on the traces only through their projections on cos(x)
+    and sin(x), that are computed with a single matrix product. The phase is then
+    initialized with the least squares solution of the fit on the (cos x, sin x)
+    basis, which is exact for uniformly sampled phases, and refined with a few
+    vectorized Gauss-Newton iterations on the closed form of the error.
+
+    Parameters
+    ----------
+    traces : np.array
+        (n_pts, n_rois) array with the activity of the neurons.
+    phase : np.array
+        (n_pts,) array with the network phase.
+    max_iter : int
+        Maximum number of Gauss-Newton iterations.
+    tol : float
+        Tolerance on the phase update for stopping the iterations.
+
+    Returns
+    -------
+    np.array
+        (n_rois,) array of phases, in the [-pi, pi) interval. Nan for empty cells.
+    np.array
+        (n_rois,) array with the variance of the estimated phases, computed as in
+        curve_fit.
+
+    """
+    traces = np.asarray(traces)
+    phase = np.asarray(phase, dtype=np.float64)
+    n_pts = traces.shape[0]
+
+    # Normalize traces to loosely fit the range (-1, 1), as in phase_from_fit:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = traces - np.percentile(traces, 5, axis=0)
+        y /= np.percentile(y, 99, axis=0)
+    y = y * 2 - 1
+
+    # Projections of the traces on the basis, and sums depending only on phase:
+    basis = np.stack([np.cos(phase), np.sin(phase)], axis=1)
+    y_cos, y_sin = (basis.T.astype(y.dtype) @ y).astype(np.float64)
+    y_sq = np.einsum("ij,ij->j", y, y, dtype=np.float64)
+    sum_cos2, sum_sin2 = np.cos(2 * phase).sum(), np.sin(2 * phase).sum()
+
+    # Least squares initialization: a cos(x) + b sin(x) = A cos(x + ph):
+    a, b = np.linalg.solve(basis.T @ basis, np.stack([y_cos, y_sin]))
+    cell_phases = np.arctan2(-b, a)
+
+    def _jacobian_sq(ph):
+        # Sum of sin(x + ph) ** 2 over timepoints:
+        return n_pts / 2 - (np.cos(2 * ph) * sum_cos2 - np.sin(2 * ph) * sum_sin2) / 2
+
+    for _ in range(max_iter):
+        # Sum of the residuals times their derivative over timepoints:
+        jac_residuals = (
+            np.sin(cell_phases) * y_cos
+            + np.cos(cell_phases) * y_sin
+            - (np.sin(2 * cell_phases) * sum_cos2 + np.cos(2 * cell_phases) * sum_sin2)
+            / 2
+        )
+        step = jac_residuals / _jacobian_sq(cell_phases)
+        cell_phases -= step
+        if not np.nanmax(np.abs(step), initial=0) > tol:
+            break
+
+    # Squared residuals and variance estimate, as in curve_fit:
+    sq_residuals = (
+        y_sq
+        - 2 * (np.cos(cell_phases) * y_cos - np.sin(cell_phases) * y_sin)
+        + n_pts / 2
+        + (np.cos(2 * cell_phases) * sum_cos2 - np.sin(2 * cell_phases) * sum_sin2) / 2
+    )
+    covs = sq_residuals / (n_pts - 1) / _jacobian_sq(cell_phases)
+
+    cell_phases = (cell_phases + np.pi) % (2 * np.pi) - np.pi
+
+    empty = (traces == 0).all(0) | ~np.isfinite(cell_phases)
+    cell_phases[empty], covs[empty] = np.nan, np.nan
+
+    return cell_phases, covs
+
+
 def qap_sorting_and_phase(traces, t_lims=None):
     """Use quadratic assignment problem to find an optimal sorting of ROIs.
     Now outdated method.
@@ -4,7 +4,7 @@ from datetime import datetime
 import numpy as np
 from scipy.stats import ranksums, ttest_ind, ttest_rel, wilcoxon
 
-from lotr import dataset_folders
+import lotr
 from lotr.default_vals import RESULTS_LOG_FILE, RESULTS_NDIGITS
 from lotr.file_utils import get_figures_location
 
@@ -45,7 +45,7 @@ class ResultsLogger:
             dataset_raw_read = configprs["log_info"]["dataset"]
             self.dataset = set(dataset_raw_read.split("'")[1::2])
         else:
-            self.dataset = set([d.name for d in dataset_folders])
+            self.dataset = set([d.name for d in lotr.dataset_folders])
 
         self.create_reslog_file()
 
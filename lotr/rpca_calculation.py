@@ -1,6 +1,7 @@
 from itertools import product
 
 import numpy as np
+from circle_fit import hyper_fit
 
 from lotr.utils import get_rot_matrix, get_vect_angle, reduce_to_pi
 
@@ -37,6 +38,78 @@ def get_zero_mean_weights(coords):
     return w_coords
 
 
+def compute_network_phase(traces, rpc_scores):
+    """Network phase from the activity of the ROIs, as the angle of the average of
+    the ROI positions in the rPC space weighted by their activity, normalized at
+    every timepoint as in get_zero_mean_weights.
+    For a tutorial on this calculation, have a look at
+    'Anatomical organization of the network.ipynb'
+
+    Parameters
+    ----------
+    traces : np.array
+        (n_pts, n_rois) matrix with the activity of the ROIs (or (n_rois,) array for
+        a single timepoint). Can be stacked, (n_sets, n_pts, n_rois), for multiple
+        sets of ROIs.
+    rpc_scores : np.array
+        (n_rois, 2) matrix with the rPC scores of the ROIs, or (n_sets, n_rois, 2)
+        for stacked traces.
+
+    Returns
+    -------
+    np.array
+        (n_pts,) array with the network phase, or (n_sets, n_pts).
+
+    """
+    # Normalize the activity of every timepoint to have mean 0, using the 2nd
+    # percentile as baseline:
+    norm_activity = traces - np.percentile(traces, 2, axis=-1, keepdims=True)
+    norm_activity[norm_activity < 0] = 0
+    norm_activity = norm_activity / np.sum(norm_activity, -1, keepdims=True)
+    norm_activity = norm_activity - np.mean(norm_activity, -1, keepdims=True)
+
+    avg_vects = norm_activity @ rpc_scores[..., :2]
+
+    # This choice of signs ensures that network phase correspond to angle of
+    # max activation or ROIs over rPC space:
+    return np.arctan2(avg_vects[..., 1], -avg_vects[..., 0])
+
+
+def pca_scores_stacked(data, n_components=5):
+    """PCA scores for a stack of data matrices at once, from the eigendecomposition
+    of their (n_samples, n_samples) Gram matrices, which is cheap when there are
+    fewer samples than features (e.g. ROIs vs. timepoints for PCA over time).
+    Signs follow the convention of the full svd solver of sklearn, as in
+    lotr.pca.pca_and_phase.
+
+    Parameters
+    ----------
+    data : np.array
+        (n_sets, n_samples, n_features) stack of data matrices.
+    n_components : int
+        Number of components.
+
+    Returns
+    -------
+    np.array
+        (n_sets, n_samples, n_components) scores of the samples.
+
+    """
+    centered = data - data.mean(1, keepdims=True)
+    gram = centered @ np.swapaxes(centered, 1, 2)
+
+    # eigh returns eigenvalues in ascending order:
+    eigvals, eigvects = np.linalg.eigh(gram)
+    eigvals = np.maximum(eigvals[:, ::-1][:, :n_components], 0)
+    scores = eigvects[:, :, ::-1][:, :, :n_components] * np.sqrt(eigvals)[:, None, :]
+
+    # Largest absolute score of every component is positive:
+    max_abs_rows = np.argmax(np.abs(scores), axis=1)
+    signs = np.sign(np.take_along_axis(scores, max_abs_rows[:, None, :], 1))
+    signs[signs == 0] = 1
+    return scores * signs
+
+
 def reorient_pcs(cpc_scores, w_coords):
     """Reorient centered PC scores (over time) so that the position of
     cells in the PC space matches their anatomical location.
@@ -92,6 +165,40 @@ def reorient_pcs(cpc_scores, w_coords):
     return rpc_scores
 
 
+def rpc_scores_and_phase_stacked(traces, w_coords, fit_slice=slice(None)):
+    """rPC scores and network phase for a stack of sets of ROIs, as computed for
+    a single set by LotrExperiment (PCA over time, circle fit, reorientation
+    on the anatomy and network phase), with a single Gram matrix product and
+    eigendecomposition and a single phase projection for all the sets.
+
+    Parameters
+    ----------
+    traces : np.array
+        (n_sets, n_pts, n_rois) stack with the activity of every set of ROIs.
+    w_coords : np.array
+        (n_sets, n_rois, n_dims) stack of the ROI coordinates normalized with
+        get_zero_mean_weights.
+    fit_slice : slice
+        Time slice of the traces used to compute the PCs.
+
+    Returns
+    -------
+    np.array
+        (n_sets, n_rois, 2) rPC scores of every set.
+    np.array
+        (n_sets, n_pts) network phase of every set.
+
+    """
+    pca_scores = pca_scores_stacked(np.swapaxes(traces[:, fit_slice, :], 1, 2))
+
+    rpc_scores = np.empty(pca_scores.shape[:2] + (2,))
+    for i, scores in enumerate(pca_scores):
+        circle_params = hyper_fit(scores[:, :2])
+        rpc_scores[i] = reorient_pcs(scores[:, :2] - circle_params[:2], w_coords[i])
+
+    return rpc_scores, compute_network_phase(traces, rpc_scores)
+
+
 def match_rpc_and_neuron_phases(rpc_phases, neuron_phases):
     """Function to match phase fit from neuron's best activation
     over network trajectory to neuron phase in rPC.
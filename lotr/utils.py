@@ -1,6 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numba
 import numpy as np
 import pandas as pd
-from numba import njit
+import scipy.fft as sfft
+from numba import njit, prange
+from scipy import sparse
 from scipy.interpolate import interp1d
 
 
@@ -46,6 +52,194 @@ def pearson_regressors(traces, regressors):
     return result
 
 
+def pearson_regressors_blocked(
+    traces,
+    regressors,
+    block_size=1000,
+    derivative=False,
+    n_workers=None,
+    dtype=np.float64,
+):
+    """Same as pearson_regressors, computed over blocks of ROIs in a thread pool,
+    so that memory is bounded by the block size. traces can be any array
+    supporting traces[:, start:stop] indexing (e.g., np.memmap or LazyH5Array);
+    blocks are read one at a time.
+
+    Traces and regressors are centered before the dot product, which avoids the
+    loss of precision of subtracting the product of the means afterwards. With
+    dtype=np.float32, for n timepoints the absolute error on each coefficient is
+    bounded by about (n + 3) * 2**-24 (~6e-4 for 10000 timepoints, from the
+    rounding errors of the accumulated dot products and norms); in practice,
+    pairwise summation in BLAS makes it closer to sqrt(n) * 2**-24.
+
+    Parameters
+    ----------
+    traces : np.array or array-like
+        (t, n_rois) array with the traces.
+    regressors : np.array
+        (t,) or (t, n_regressors) array with the regressors.
+    block_size : int
+        Number of ROIs processed at once.
+    derivative : bool
+        If true, correlate the absolute derivative of the traces, computed on the
+        fly for each block (0 at the last timepoint).
+    n_workers : int (optional)
+        Number of threads.
+    dtype : np.dtype
+        dtype of the computation and of the output.
+
+    Returns
+    -------
+    np.array
+        (n_regressors, n_rois) matrix of coefficients, or (n_rois,) array if
+        regressors is 1D.
+
+    """
+    regressors = np.asarray(regressors, dtype=dtype)
+    single_regressor = regressors.ndim == 1
+    if single_regressor:
+        regressors = regressors[:, np.newaxis]
+
+    n_pts, n_rois = traces.shape
+    regressors_centered = regressors - np.nanmean(regressors, 0)
+    regressors_std = np.nanstd(regressors, 0)
+
+    result = np.empty((regressors.shape[1], n_rois), dtype=dtype)
+    # Reading from files (e.g., hdf5) might not be thread-safe:
+    read_lock = None if isinstance(traces, np.ndarray) else Lock()
+
+    def _correlate_block(start):
+        block_slice = slice(start, min(start + block_size, n_rois))
+        if read_lock is None:
+            block = np.asarray(traces[:, block_slice], dtype=dtype)
+        else:
+            with read_lock:
+                block = np.asarray(traces[:, block_slice], dtype=dtype)
+
+        if derivative:
+            block_derivative = np.zeros_like(block)
+            block_derivative[:-1, :] = np.abs(np.diff(block, axis=0))
+            block = block_derivative
+
+        block_std = np.nanstd(block, 0)
+        block = block - np.nanmean(block, 0)
+        result[:, block_slice] = (regressors_centered.T @ block) / (
+            (n_pts - 1) * np.outer(regressors_std, block_std)
+        )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        list(executor.map(_correlate_block, range(0, n_rois, block_size)))
+
+    return result[0] if single_regressor else result
+
+
+def circular_shift_null(
+    traces,
+    regressors,
+    n_shifts=1000,
+    min_shift=None,
+    block_size=1000,
+    n_workers=None,
+    seed=None,
+    return_null=False,
+):
+    """Correlation of traces with regressors (as pearson_regressors) and p-values
+    from a null distribution of correlations with circularly shifted regressors,
+    which preserve the autocorrelation of the regressors.
+
+    The correlations with all the circular shifts of a regressor are the circular
+    cross-correlation of traces and regressor, which is computed with FFTs over
+    blocks of ROIs, so that the cost does not depend on the number of shifts.
+
+    Parameters
+    ----------
+    traces : np.array or array-like
+        (t, n_rois) array with the traces, readable in blocks as traces[:, slice].
+    regressors : np.array
+        (t,) or (t, n_regressors) array with the regressors.
+    n_shifts : int (optional)
+        Number of random shifts in the null distribution. If None, all the shifts
+        between min_shift and t - min_shift are used.
+    min_shift : int (optional)
+        Minimum shift, in points, to break the correlation between traces and
+        regressors (by default, t // 10).
+    block_size : int
+        Number of ROIs processed at once.
+    n_workers : int (optional)
+        Number of threads for the FFTs.
+    seed : int (optional)
+        Seed for the random choice of the shifts.
+    return_null : bool
+        If true, return also the null distributions.
+
+    Returns
+    -------
+    np.array
+        (n_regressors, n_rois) matrix of correlations ((n_rois,) for 1D
+        regressors).
+    np.array
+        Two-sided p-values, with the same shape, as the fraction of shifts giving
+        correlations at least as large in absolute value (counting the observed one).
+    np.array
+        Only if return_null, (n_regressors, n_shifts, n_rois) null correlations.
+
+    """
+    regressors = np.asarray(regressors, dtype=np.float64)
+    single_regressor = regressors.ndim == 1
+    if single_regressor:
+        regressors = regressors[:, np.newaxis]
+
+    n_pts, n_rois = traces.shape
+    min_shift = n_pts // 10 if min_shift is None else min_shift
+    shifts = np.arange(min_shift, n_pts - min_shift + 1)
+    if n_shifts is not None:
+        rng = np.random.default_rng(seed)
+        shifts = np.sort(rng.choice(shifts, min(n_shifts, len(shifts)), replace=False))
+
+    regressors_fft = sfft.rfft(
+        regressors - np.nanmean(regressors, 0), axis=0, workers=n_workers
+    )
+    regressors_std = np.nanstd(regressors, 0)
+
+    n_regressors = regressors.shape[1]
+    correlations = np.empty((n_regressors, n_rois))
+    n_extreme = np.zeros((n_regressors, n_rois), dtype=int)
+    null = np.empty((n_regressors, len(shifts), n_rois)) if return_null else None
+
+    for start in range(0, n_rois, block_size):
+        block_slice = slice(start, min(start + block_size, n_rois))
+        block = np.asarray(traces[:, block_slice], dtype=np.float64)
+        block_std = np.nanstd(block, 0)
+        block_fft = sfft.rfft(block - np.nanmean(block, 0), axis=0, workers=n_workers)
+
+        for i in range(n_regressors):
+            # Element s is the dot product of traces and regressor rolled by s:
+            cross_corr = sfft.irfft(
+                block_fft * np.conj(regressors_fft[:, i : i + 1]),
+                n=n_pts,
+                axis=0,
+                workers=n_workers,
+            )
+            cross_corr /= (n_pts - 1) * regressors_std[i] * block_std
+
+            correlations[i, block_slice] = cross_corr[0]
+            block_null = cross_corr[shifts]
+            n_extreme[i, block_slice] = np.sum(
+                np.abs(block_null) >= np.abs(cross_corr[0]), axis=0
+            )
+            if return_null:
+                null[i, :, block_slice] = block_null
+
+    p_values = (n_extreme + 1) / (len(shifts) + 1)
+    p_values[np.isnan(correlations)] = np.nan
+
+    if single_regressor:
+        correlations, p_values = correlations[0], p_values[0]
+        null = null[0] if return_null else None
+
+    return (correlations, p_values, null) if return_null else (correlations, p_values)
+
+
 def linear_regression(x, y):
     """Get slope and intercept of linear regression between two vectors.
 
@@ -100,7 +294,375 @@ def roll_columns_jit(matrix, shifts):
     return rolled
 
 
-def crop(traces, events, pre_int=20, post_int=30, dwn=1):
+class EventWindows:
+    """Windows of traces around events, as views over the traces (no copy).
+    Returned by crop with copy=False.
+
+    The windows of all the valid events (not too close to the borders of the
+    traces) are views on a sliding window view of the traces, so that
+    event-triggered analyses over many cells can iterate over events, or use the
+    views directly, without allocating the (n_window, n_events, n_cells) array.
+
+    Parameters
+    ----------
+    traces : np.array
+        1D (n_timepoints,) or 2D (n_timepoints, n_cells) array.
+    events : np.array
+        Indexes of the events around which to crop.
+    pre_int : int
+        Interval to crop before the event, in points.
+    post_int : int
+        Interval to crop after the event, in points.
+    dwn : int
+        Downsampling factor, if required.
+
+    """
+
+    def __init__(self, traces, events, pre_int=20, post_int=30, dwn=1):
+        self.traces = traces
+        self.events = np.asarray(events).astype(int)
+        self.pre_int, self.post_int, self.dwn = int(pre_int), int(post_int), dwn
+
+        # Avoid problems with spikes at the borders:
+        self.valid = (self.events > self.pre_int) & (
+            self.events < traces.shape[0] - self.post_int
+        )
+
+    @property
+    def n_window(self):
+        return len(range(0, self.pre_int + self.post_int, self.dwn))
+
+    @property
+    def starts(self):
+        """Starting indexes of the windows of the valid events."""
+        return self.events[self.valid] - self.pre_int
+
+    @property
+    def view(self):
+        """(n_timepoints - window + 1, [n_cells,] n_window) view with the windows
+        starting at every timepoint. Windows of valid events are view[starts].
+        """
+        return np.lib.stride_tricks.sliding_window_view(
+            self.traces, self.pre_int + self.post_int, axis=0
+        )[..., :: self.dwn]
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    def __getitem__(self, i):
+        """([n_cells,] n_window) view with the window of the i-th valid event."""
+        return self.view[self.starts[i]]
+
+    def __iter__(self):
+        view = self.view
+        for start in self.starts:
+            yield view[start]
+
+    def chunks(self, chunk_size=256):
+        """Iterate over the windows of valid events in arrays with the layout of
+        crop, (n_window, chunk_size[, n_cells]), copying one chunk at a time.
+        """
+        view, starts = self.view, self.starts
+        for i in range(0, len(starts), chunk_size):
+            yield np.moveaxis(view[starts[i : i + chunk_size]], -1, 0)
+
+    def mean(self):
+        """(n_window, [n_cells]) average over the valid events, computed without
+        copying all the windows. Nan if there are no valid events.
+        """
+        total = np.zeros(self.view.shape[1:], dtype=np.float64)
+        for window in self:
+            total += window
+        return np.moveaxis(total / len(self) if len(self) else total * np.nan, -1, 0)
+
+    def to_array(self, dtype=None, fill_value=np.nan):
+        """Copy the windows in an array with the layout of crop.
+
+        Parameters
+        ----------
+        dtype : np.dtype (optional)
+            dtype of the output, by default the one of the traces.
+        fill_value : float
+            Value for the events that are too close to the borders.
+
+        Returns
+        -------
+        np.array
+            (n_window, n_events) array if traces is 1D or
+            (n_window, n_events, n_cells) if traces is 2D.
+
+        """
+        dtype = self.traces.dtype if dtype is None else np.dtype(dtype)
+        mat = np.full(
+            (self.n_window, len(self.events)) + self.traces.shape[1:],
+            fill_value,
+            dtype=dtype,
+        )
+        if len(self):
+            # (n_valid, [n_cells,] n_window) windows, moved to (n_window, n_valid, ...)
+            mat[:, self.valid] = np.moveaxis(self.view[self.starts], -1, 0)
+        return mat
+
+
+class _Moments:
+    """Count, mean and sum of squared deviations over events, per window point
+    and cell. Chunks are merged with the formula of Chan et al. (1979).
+    """
+
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, chunk):
+        # chunk is (n_window, n_events, n_cells), nan for missing values:
+        count = np.sum(~np.isnan(chunk), axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(count > 0, np.nansum(chunk, axis=1) / count, 0)
+        m2 = np.nansum((chunk - mean[:, np.newaxis]) ** 2, axis=1)
+        self._merge(count, mean, m2)
+
+    def _merge(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = np.where(total > 0, mean - self.mean, 0)
+            weight = np.where(total > 0, count / total, 0)
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta**2 * self.count * weight
+        self.count = total
+
+    def merge(self, other):
+        self._merge(other.count, other.mean, other.m2)
+
+    def get_mean(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def get_var(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.m2 / self.count, np.nan)
+
+
+class EventStats:
+    """Event-triggered statistics computed in a single pass over events, without
+    materializing the cropped (n_window, n_events, n_cells) tensor: memory is
+    O(n_window * n_cells) regardless of the number of events. Accumulators from
+    different experiments (e.g., fish) with the same window and number of cells
+    can be merged.
+
+    Parameters
+    ----------
+    baseline_pts : int (optional)
+        Number of points at the beginning of the window (before the event) used to
+        compute the baseline of every event, for baseline-subtracted statistics.
+    quantile_bins : np.array (optional)
+        Bin edges of the histograms used to estimate quantiles. Values outside the
+        edges are counted in the extreme bins.
+
+    Examples
+    --------
+    >>> stats = EventStats(baseline_pts=10)
+    >>> for fish_traces, fish_events in data:
+    ...     stats.update(crop(fish_traces, fish_events, copy=False))
+    >>> stats.mean, stats.baseline_subtracted_mean
+
+    """
+
+    def __init__(self, baseline_pts=None, quantile_bins=None):
+        self.baseline_pts = baseline_pts
+        self.quantile_bins = (
+            None if quantile_bins is None else np.asarray(quantile_bins, dtype=float)
+        )
+
+        self._moments = None
+        self._baseline_moments = None
+        self._hist = None
+        self._squeeze = False
+
+    def _init_accumulators(self, shape):
+        self._moments = _Moments(shape)
+        if self.baseline_pts is not None:
+            self._baseline_moments = _Moments(shape)
+        if self.quantile_bins is not None:
+            self._hist = np.zeros(shape + (len(self.quantile_bins) - 1,), dtype=int)
+
+    def update(self, cropped, chunk_size=256, valid=None):
+        """Add events to the statistics.
+
+        Parameters
+        ----------
+        cropped : np.array or EventWindows
+            (n_window, n_events[, n_cells]) array of cropped traces, as returned by
+            crop (nans for missing events), or windows from crop(..., copy=False)
+            that are processed in chunks of chunk_size events. Note that crop
+            fills missing events of 1D traces with 0 unless fill_value=np.nan:
+            pass valid in that case.
+        chunk_size : int
+            Number of events processed at once.
+        valid : np.array (optional)
+            (n_events,) boolean mask of the events to include, for arrays.
+
+        """
+        if isinstance(cropped, EventWindows):
+            chunks = cropped.chunks(chunk_size)
+        else:
+            if valid is not None:
+                cropped = np.array(cropped, dtype=np.float64)
+                cropped[:, ~np.asarray(valid, dtype=bool)] = np.nan
+            chunks = (
+                cropped[:, i : i + chunk_size]
+                for i in range(0, cropped.shape[1], chunk_size)
+            )
+        for chunk in chunks:
+            self._update_chunk(chunk)
+        return self
+
+    def _update_chunk(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim == 2:
+            self._squeeze = True
+            chunk = chunk[:, :, np.newaxis]
+
+        shape = (chunk.shape[0], chunk.shape[2])
+        if self._moments is None:
+            self._init_accumulators(shape)
+        elif self._moments.count.shape != shape:
+            raise ValueError(
+                f"Windows of shape {shape} do not match accumulated {self._moments.count.shape}"
+            )
+
+        self._moments.update(chunk)
+        if self._baseline_moments is not None:
+            baseline_pts = chunk[: self.baseline_pts]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                baseline = np.nansum(baseline_pts, 0) / np.sum(
+                    ~np.isnan(baseline_pts), 0
+                )
+            self._baseline_moments.update(chunk - baseline)
+        if self._hist is not None:
+            self._update_hist(chunk)
+
+    def _update_hist(self, chunk):
+        n_window, _, n_cells = chunk.shape
+        n_bins = self._hist.shape[-1]
+        valid = ~np.isnan(chunk)
+
+        bin_idxs = np.clip(
+            np.searchsorted(self.quantile_bins, chunk, side="right") - 1, 0, n_bins - 1
+        )
+        window_idxs, _, cell_idxs = np.nonzero(valid)
+        flat_idxs = (window_idxs * n_cells + cell_idxs) * n_bins + bin_idxs[valid]
+        self._hist += np.bincount(flat_idxs, minlength=self._hist.size).reshape(
+            self._hist.shape
+        )
+
+    def merge(self, other):
+        """Merge the statistics of another EventStats object into this one."""
+        if other._moments is None:
+            return self
+        if self._moments is None:
+            self._init_accumulators(other._moments.count.shape)
+            self._squeeze = other._squeeze
+        elif self._moments.count.shape != other._moments.count.shape:
+            raise ValueError("Cannot merge statistics of windows with different shapes")
+
+        self._moments.merge(other._moments)
+        if self._baseline_moments is not None:
+            self._baseline_moments.merge(other._baseline_moments)
+        if self._hist is not None:
+            self._hist += other._hist
+        return self
+
+    def _output(self, array):
+        return array[..., 0] if self._squeeze else array
+
+    @property
+    def count(self):
+        """(n_window[, n_cells]) number of events contributing to each point."""
+        return self._output(self._moments.count)
+
+    @property
+    def mean(self):
+        """(n_window[, n_cells]) event-triggered average."""
+        return self._output(self._moments.get_mean())
+
+    @property
+    def var(self):
+        """(n_window[, n_cells]) variance over events (ddof=0, as np.nanvar)."""
+        return self._output(self._moments.get_var())
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def baseline_subtracted_mean(self):
+        """(n_window[, n_cells]) average of events after subtracting their
+        baseline.
+        """
+        if self._baseline_moments is None:
+            raise ValueError("baseline_pts must be specified to subtract the baseline")
+        return self._output(self._baseline_moments.get_mean())
+
+    @property
+    def baseline_subtracted_var(self):
+        if self._baseline_moments is None:
+            raise ValueError("baseline_pts must be specified to subtract the baseline")
+        return self._output(self._baseline_moments.get_var())
+
+    def quantile(self, q):
+        """Quantile over events, estimated from the histograms by linear
+        interpolation within bins. The resolution is the one of the bins.
+
+        Parameters
+        ----------
+        q : float
+            Quantile, between 0 and 1.
+
+        Returns
+        -------
+        np.array
+            (n_window[, n_cells]) array of quantiles.
+
+        """
+        if self._hist is None:
+            raise ValueError("quantile_bins must be specified to compute quantiles")
+
+        cdf = np.cumsum(self._hist, axis=-1)
+        total = cdf[..., -1]
+        target = q * total
+
+        # First bin where the cumulative count reaches the target, and position in it:
+        bin_idxs = np.minimum(
+            np.sum(cdf < target[..., np.newaxis], axis=-1), self._hist.shape[-1] - 1
+        )
+        prev_cdf = np.where(
+            bin_idxs > 0,
+            np.take_along_axis(cdf, np.maximum(bin_idxs - 1, 0)[..., np.newaxis], -1)[
+                ..., 0
+            ],
+            0,
+        )
+        in_bin = np.take_along_axis(self._hist, bin_idxs[..., np.newaxis], -1)[..., 0]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.clip(
+                np.where(in_bin > 0, (target - prev_cdf) / in_bin, 0), 0, 1
+            )
+
+        edges = self.quantile_bins
+        quantiles = edges[bin_idxs] + fraction * (edges[bin_idxs + 1] - edges[bin_idxs])
+        return self._output(np.where(total > 0, quantiles, np.nan))
+
+
+def crop(
+    traces,
+    events,
+    pre_int=20,
+    post_int=30,
+    dwn=1,
+    copy=True,
+    preserve_dtype=False,
+    fill_value=None,
+):
     """Apply cropping functions defined below depending on the dimensionality
     of the input (one cell or multiple cells). If input is pandas Series
     or DataFrame, it strips out the values first.
@@ -118,11 +680,22 @@ def crop(traces, events, pre_int=20, post_int=30, dwn=1):
         Interval to crop after the event, in points.
     dwn : int
         Downsampling factor, if required.
+    copy : bool
+        If false, return an EventWindows object with views over the traces for
+        the valid events instead of copying them.
+    preserve_dtype : bool
+        If true, the output has the dtype of the traces instead of float64
+        (events at the borders are filled with nans for float traces, or 0).
+    fill_value : float (optional)
+        Value for the events too close to the borders of the traces. By default,
+        0 for 1D traces and nan for 2D traces. Use nan for 1D traces that are
+        passed to EventStats, so that missing events are not counted as zeros.
 
     Returns
     -------
-    np.array
-        (n_events, n_pts) np.array if traces is 1D or (x,y,z check) if traces is 2D.
+    np.array or EventWindows
+        (n_pts, n_events) np.array if traces is 1D or (n_pts, n_events, n_cells)
+        if traces is 2D.
 
     """
     pre_int, post_int = int(pre_int), int(post_int)
@@ -131,12 +704,25 @@ def crop(traces, events, pre_int=20, post_int=30, dwn=1):
         traces = traces.values
     if isinstance(events, pd.DataFrame) or isinstance(events, pd.Series):
         events = events.values.flatten().astype(np.int)
+    if len(traces.shape) > 2:
+        raise TypeError("traces matrix must be at most 2D!")
+
+    if not copy:
+        return EventWindows(traces, events, **kwargs)
+    if preserve_dtype:
+        if fill_value is None:
+            fill_value = np.nan if len(traces.shape) == 2 else 0
+        if not np.issubdtype(traces.dtype, np.floating):
+            fill_value = 0
+        return EventWindows(traces, events, **kwargs).to_array(fill_value=fill_value)
+    if fill_value is not None:
+        return EventWindows(traces, events, **kwargs).to_array(
+            dtype=np.float64, fill_value=fill_value
+        )
+
     if len(traces.shape) == 1:
         return _crop_trace(traces, events, **kwargs)
-    elif len(traces.shape) == 2:
-        return _crop_block(traces, events, **kwargs)
-    else:
-        raise TypeError("traces matrix must be at most 2D!")
+    return _crop_block(traces, events, **kwargs)
 
 
 @njit
@@ -163,7 +749,7 @@ def _crop_block(traces_block, events, pre_int=20, post_int=30, dwn=1):
     n_timepts = traces_block.shape[0]
     n_cells = traces_block.shape[1]
     # Avoid problems with spikes at the borders:
-    valid_events = events[(events > pre_int) & (events < n_timepts - post_int)]
+    valid_events = (events > pre_int) & (events < n_timepts - post_int)
 
     mat = np.full((int((pre_int + post_int) / dwn), events.shape[0], n_cells), np.nan)
 
@@ -175,18 +761,53 @@ def _crop_block(traces_block, events, pre_int=20, post_int=30, dwn=1):
     return mat
 
 
-@njit
-def resample_matrix(x, fx, matrix):
-    """Resample all row of a matrix using the np.interp function.
+def _interp_indexes(x, fx):
+    """Left and right points of the interval of fx containing every x, and position
+    in the interval, with the semantics of np.interp: points out of the fx range
+    take the value of the closest extreme.
+    """
+    left = np.clip(np.searchsorted(fx, x, side="right") - 1, 0, max(len(fx) - 2, 0))
+    right = np.minimum(left + 1, len(fx) - 1)
+    dx = fx[right] - fx[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.clip(np.where(dx > 0, (x - fx[left]) / dx, 0), 0, 1)
+    return left, right, t
+
+
+@njit(parallel=True)
+def _interp_rows(matrix, left, right, t):
+    resampled = np.empty((len(t), matrix.shape[1]))
+    for i in prange(len(t)):
+        # Points with zero weight are not used, so that nans do not spread, as in
+        # np.interp:
+        if t[i] == 0:
+            resampled[i, :] = matrix[left[i], :]
+        elif t[i] == 1:
+            resampled[i, :] = matrix[right[i], :]
+        else:
+            for j in range(matrix.shape[1]):
+                resampled[i, j] = matrix[left[i], j] + t[i] * (
+                    matrix[right[i], j] - matrix[left[i], j]
+                )
+    return resampled
+
+
+def resample_matrix(x, fx, matrix, n_workers=None):
+    """Resample all columns of a matrix as the np.interp function would do.
+    As all columns share the same coordinates, interpolation indexes and weights
+    are computed once, and applied to all columns with a parallel loop over the
+    resampled rows. Nans spread only to the resampled points they contribute to.
 
     Parameters
     ----------
     x : np.array
         (n_newpts) coords array over which to resample.
     fx : np.array
-        (n_pts) coords array of source data
+        (n_pts) increasing coords array of source data
     matrix : np.array
         (n_pts, n) matrix of data to resample along first dimension.
+    n_workers : int (optional)
+        Number of threads (by default, all cores).
 
     Returns
     -------
@@ -194,12 +815,62 @@ def resample_matrix(x, fx, matrix):
         (n_newpts, n) resampled matrix.
 
     """
-    resampled = np.full((len(x), matrix.shape[1]), np.nan)
+    left, right, t = _interp_indexes(
+        np.asarray(x, dtype=np.float64), np.asarray(fx, dtype=np.float64)
+    )
 
-    for i in range(matrix.shape[1]):
-        resampled[:, i] = np.interp(x, fx, matrix[:, i])
+    n_threads = numba.get_num_threads()
+    if n_workers is not None:
+        numba.set_num_threads(n_workers)
+    try:
+        return _interp_rows(np.ascontiguousarray(matrix), left, right, t)
+    finally:
+        numba.set_num_threads(n_threads)
 
-    return resampled
+
+def interp_weights(x, fx, period=None):
+    """Sparse matrix of linear interpolation weights, such that
+    interp_weights(x, fx) @ f is equal to np.interp(x, fx, f) for any f (also 2D,
+    with values over the first dimension). Computing it once allows resampling
+    many arrays over the same coordinates with a single sparse matrix product.
+
+    Parameters
+    ----------
+    x : np.array
+        (n_newpts,) coords array over which to resample.
+    fx : np.array
+        (n_pts,) increasing coords array of source data (can be unsorted if period
+        is specified).
+    period : float (optional)
+        Period of the coordinates (e.g., 2 * np.pi for angles), for interpolating
+        with wraparound as np.interp(x, fx, f, period=period).
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (n_newpts, n_pts) matrix of interpolation weights.
+
+    """
+    x, fx = np.asarray(x, dtype=np.float64), np.asarray(fx, dtype=np.float64)
+    n_src = len(fx)
+    src_idxs = np.arange(n_src)
+
+    if period is not None:
+        # Sort coordinates in one period, and pad them at both ends with the
+        # points from the other end, as np.interp:
+        x = np.mod(x, period)
+        src_idxs = np.argsort(np.mod(fx, period))
+        fx = np.mod(fx, period)[src_idxs]
+        fx = np.concatenate([[fx[-1] - period], fx, [fx[0] + period]])
+        src_idxs = np.concatenate([[src_idxs[-1]], src_idxs, [src_idxs[0]]])
+
+    left, right, t = _interp_indexes(x, fx)
+
+    rows = np.tile(np.arange(len(x)), 2)
+    cols = src_idxs[np.concatenate([left, right])]
+    return sparse.csr_matrix(
+        (np.concatenate([1 - t, t]), (rows, cols)), shape=(len(x), n_src)
+    )
 
 
 def convolve_with_tau(array, tau_fs, n_kernel_pts=1000):
@@ -226,35 +897,142 @@ def nan_phase_jumps(phase_arr):
     return nanned_phase
 
 
-@njit
-def circular_corr(th, ph):
+def _resultant_sq(angles, axis=0):
+    """Squared length of the sum of unit vectors with the given angles."""
+    return np.abs(np.sum(np.exp(1j * angles), axis=axis)) ** 2
+
+
+def _circular_corr_from_sums(n, diff_sq, sum_sq, th2_sq, ph2_sq):
+    return (diff_sq - sum_sq) / np.sqrt((n**2 - th2_sq) * (n**2 - ph2_sq))
+
+
+def circular_corr(th, ph, axis=0):
     """Circular correlation coefficient between arrays.
     Definition after Fisher&Lee, Biometrika 1983.
 
+    The sums over all pairs of points of the definition are expanded in products
+    of sums of complex exponentials, so that it is computed in O(n):
+    sum_{i<j} sin(th_i - th_j) sin(ph_i - ph_j) =
+    (|sum e^{i(th - ph)}|^2 - |sum e^{i(th + ph)}|^2) / 4, and
+    sum_{i<j} sin(th_i - th_j)^2 = (n^2 - |sum e^{2i th}|^2) / 4.
+
     Parameters
     ----------
     th : np.array
-        1D array.
+        Array of angles. If multi-dimensional, the coefficient is computed along
+        axis for every pair of traces in th and ph.
     ph : np.array
-        Second array, mush have same length of th.
+        Second array, mush have same shape of th.
+    axis : int
+        Axis along which to compute the coefficient.
 
     Returns
     -------
-    float
-        Fisher-Lee circular correlation coefficient.
+    float or np.array
+        Fisher-Lee circular correlation coefficient, with the shape of th without
+        axis.
 
     """
-    n = len(th)
-    num = sum(
-        [
-            sum([np.sin(th[i] - th[j]) * np.sin(ph[i] - ph[j]) for i in range(j)])
-            for j in range(n)
-        ]
+    th, ph = np.asarray(th), np.asarray(ph)
+    return _circular_corr_from_sums(
+        th.shape[axis],
+        _resultant_sq(th - ph, axis=axis),
+        _resultant_sq(th + ph, axis=axis),
+        _resultant_sq(2 * th, axis=axis),
+        _resultant_sq(2 * ph, axis=axis),
+    )
+
+
+def _padded_cumsum(array):
+    """Cumulative sum over axis 0, starting from 0, so that the sum over the window
+    [i, i + wnd_pts) is cumsum[i + wnd_pts] - cumsum[i].
+    """
+    cumsum = np.cumsum(array, axis=0)
+    return np.concatenate([np.zeros((1,) + cumsum.shape[1:], cumsum.dtype), cumsum])
+
+
+def _window_sums(cumsum, wnd_pts):
+    return cumsum[wnd_pts:] - cumsum[:-wnd_pts]
+
+
+def _rolling_resultant_sq(angles, wnd_pts):
+    """Squared length of the sum of unit vectors in sliding windows over axis 0."""
+    return np.abs(_window_sums(_padded_cumsum(np.exp(1j * angles)), wnd_pts)) ** 2
+
+
+def rolling_circular_corr(th, ph, wnd_pts):
+    """Fisher-Lee circular correlation coefficient in sliding windows, in O(n)
+    independently of the window size (see circular_corr).
+
+    Parameters
+    ----------
+    th : np.array
+        (n_pts,) array of angles, or (n_pts, n_traces) array for multiple traces.
+    ph : np.array
+        Second array, mush have same shape of th.
+    wnd_pts : int
+        Number of points in the window.
+
+    Returns
+    -------
+    np.array
+        (n_pts - wnd_pts + 1,) or (n_pts - wnd_pts + 1, n_traces) array with the
+        coefficient for the windows starting at every point.
+
+    """
+    th, ph = np.asarray(th), np.asarray(ph)
+    return _circular_corr_from_sums(
+        wnd_pts,
+        _rolling_resultant_sq(th - ph, wnd_pts),
+        _rolling_resultant_sq(th + ph, wnd_pts),
+        _rolling_resultant_sq(2 * th, wnd_pts),
+        _rolling_resultant_sq(2 * ph, wnd_pts),
     )
-    den1 = sum(
-        [sum([np.sin(th[i] - th[j]) ** 2 for i in range(j)]) for j in range(n)]
-    ) ** (1 / 2)
-    den2 = sum(
-        [sum([np.sin(ph[i] - ph[j]) ** 2 for i in range(j)]) for j in range(n)]
-    ) ** (1 / 2)
-    return num / (den1 * den2)
+
+
+def rolling_corr(x, y, wnd_pts):
+    """Pearson correlation coefficient in sliding windows. Running sums of x, y,
+    x^2, y^2 and xy are computed once, so that the cost is O(n) independently of
+    the window size, and multiple window sizes can be computed in one pass.
+    Windows containing nans give nan, as np.corrcoef.
+
+    Parameters
+    ----------
+    x : np.array
+        (n_pts,) array, or (n_pts, n_traces) array for multiple traces.
+    y : np.array
+        Second array, must have same shape of x.
+    wnd_pts : int or list of int
+        Number of points in the window, or list of window sizes.
+
+    Returns
+    -------
+    np.array or list of np.array
+        (n_pts - wnd_pts + 1,) or (n_pts - wnd_pts + 1, n_traces) array with the
+        coefficients of the windows starting at every point; list of arrays for
+        multiple window sizes.
+
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    nan_pts = np.isnan(x) | np.isnan(y)
+
+    # Center the traces to limit the loss of precision in the running sums:
+    x = np.where(nan_pts, 0, x - np.nanmean(x, 0))
+    y = np.where(nan_pts, 0, y - np.nanmean(y, 0))
+    cumsums = [_padded_cumsum(a) for a in [x, y, x * x, y * y, x * y, nan_pts]]
+
+    correlations = []
+    for wnd in np.atleast_1d(wnd_pts):
+        sum_x, sum_y, sum_xx, sum_yy, sum_xy, n_nans = [
+            _window_sums(c, wnd) for c in cumsums
+        ]
+        cov = sum_xy - sum_x * sum_y / wnd
+        var_x = np.maximum(sum_xx - sum_x**2 / wnd, 0)
+        var_y = np.maximum(sum_yy - sum_y**2 / wnd, 0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+        corr[n_nans > 0] = np.nan
+        correlations.append(corr)
+
+    return correlations if np.ndim(wnd_pts) > 0 else correlations[0]
@@ -1,6 +1,4 @@
-from tqdm import tqdm
-
-from lotr.data_preprocessing.preprocessing import preprocess_folder
+from lotr.data_preprocessing.runner import run_preprocessing
 
 if __name__ == "__main__":
     from pathlib import Path
@@ -8,19 +6,13 @@ if __name__ == "__main__":
     data_path = Path(r"/Volumes/Shared/experiments/E0040_motions_cardinal/v26")
     paths = [f.parent for f in data_path.glob("*/*meta*")]
 
-    all_errors = []
-    for path in tqdm(paths):
-        try:
-            preprocess_folder(
-                path,
-                recompute_bout_df=False,
-                recompute_regressors=False,
-                recompute_filtering=True,
-            )
-        except IndexError:
-            print("indexerror", path)
-        # print("Problems with path ", path)
-        # all_errors.append(str(path))
-
-    with open("all_wrong.txt", "w") as f:
-        f.writelines(all_errors)
+    # Only steps with missing or outdated outputs are recomputed (use e.g.
+    # force=["filtered_traces"] to recompute a step and the ones depending on it),
+    # and the status of every folder is saved in the report:
+    report = run_preprocessing(
+        paths,
+        n_workers=4,
+        force=[],
+        report_file="preprocessing_report.json",
+    )
+    print(f"{report['n_failed']} of {report['n_folders']} folders failed")
@@ -1,6 +1,4 @@
-from tqdm import tqdm
-
-from lotr.data_preprocessing.preprocessing import preprocess_folder
+from lotr.data_preprocessing.runner import run_preprocessing
 
 if __name__ == "__main__":
     from pathlib import Path
@@ -8,17 +6,19 @@ if __name__ == "__main__":
     master_path = Path(r"/Volumes/Shared/experiments/E0040_motions_cardinal/v26")
     fish_list = list(master_path.glob("*_f*"))
 
-    for data_path in fish_list:
-        paths = [f.parent for f in data_path.glob("*suite2p/*00*/*meta*")]
+    paths = [
+        f.parent
+        for data_path in fish_list
+        for f in data_path.glob("*suite2p/*00*/*meta*")
+    ]
 
-        for path in tqdm(paths):
-            try:
-                preprocess_folder(
-                    path,
-                    recompute_bout_df=False,
-                    recompute_regressors=False,
-                    recompute_filtering=True,
-                )
-            except IndexError:
-                print("indexerror", path)
-            # print("Problems with path ", path)
+    # Only steps with missing or outdated outputs are recomputed (use e.g.
+    # force=["filtered_traces"] to recompute a step and the ones depending on it),
+    # and the status of every folder is saved in the report:
+    report = run_preprocessing(
+        paths,
+        n_workers=4,
+        force=[],
+        report_file="preprocessing_report_2p.json",
+    )
+    print(f"{report['n_failed']} of {report['n_folders']} folders failed")
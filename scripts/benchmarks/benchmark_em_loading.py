@@ -0,0 +1,85 @@
+"""Time and peak memory of parsing a synthetic annotation xml file with many
+skeletons: parsing the whole tree first and building dataframes of the node and
+edge attributes (as EmNeuron used to), or streaming it with iter_skeleton_arrays.
+"""
+
+import tempfile
+import tracemalloc
+import xml.etree.ElementTree as et
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from lotr.em.loading import iter_skeleton_arrays
+
+N_SKELETONS, N_NODES = 100, 5000
+
+
+def _write_annotation(path):
+    rng = np.random.default_rng(0)
+    with open(path, "w") as f:
+        f.write("<things>\n")
+        for i in range(N_SKELETONS):
+            f.write(f'<thing id="{i + 1}" comment="p{i:03d}">\n<nodes>\n')
+            ids = i * N_NODES + np.arange(N_NODES) + 1
+            for node_id, (x, y, z) in zip(ids, rng.integers(0, 10**5, (N_NODES, 3))):
+                f.write(
+                    f'<node id="{node_id}" radius="1.5" x="{x}" y="{y}" z="{z}"/>\n'
+                )
+            f.write("</nodes>\n<edges>\n")
+            for source, target in zip(ids[:-1], ids[1:]):
+                f.write(f'<edge source="{source}" target="{target}"/>\n')
+            f.write("</edges>\n</thing>\n")
+        f.write("</things>\n")
+
+
+def _parse_tree(path):
+    root = et.parse(path).getroot()
+    things = []
+    for n in root:
+        if n.tag == "thing":
+            pts_df = pd.DataFrame([e.attrib for e in list(list(n)[0])])
+            edges_df = pd.DataFrame([e.attrib for e in list(list(n)[1])])
+            things.append(
+                dict(
+                    coords=pts_df[["x", "y", "z"]].values.astype(int),
+                    edges=edges_df.values.astype(int),
+                )
+            )
+    return things
+
+
+def _parse_streaming(path):
+    return list(iter_skeleton_arrays(path))
+
+
+def _time_and_peak(fun, *args):
+    t = perf_counter()
+    out = fun(*args)
+    t = perf_counter() - t
+
+    tracemalloc.start()
+    fun(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return t, peak / 2**20, out
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "annotation.xml"
+        _write_annotation(path)
+        print(f"File size: {path.stat().st_size / 2**20:.0f} MB")
+
+        t_tree, peak_tree, things_tree = _time_and_peak(_parse_tree, path)
+        t_stream, peak_stream, things_stream = _time_and_peak(_parse_streaming, path)
+
+    assert all(
+        np.array_equal(a["edges"], b["edges"])
+        and np.array_equal(a["coords"], b["coords"])
+        for a, b in zip(things_tree, things_stream)
+    )
+    print(f"Whole tree: {t_tree:.2f} s, peak memory {peak_tree:.0f} MB")
+    print(f"Streaming: {t_stream:.2f} s, peak memory {peak_stream:.0f} MB")
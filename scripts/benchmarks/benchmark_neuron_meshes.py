@@ -0,0 +1,60 @@
+"""Compare the generation of the meshes of all the traced neurons with one
+trimesh cylinder per edge, as make_cylinder_tree used to do, and with the
+vectorized make_cylinder_tree.
+"""
+
+from time import perf_counter
+
+import trimesh
+
+import lotr
+from lotr.em.loading import load_skeletons_dict_from_zips
+from lotr.em.skeleton_mesh import _concatenate_meshes, make_cylinder_tree
+
+
+def _make_cylinder_tree_loop(coords, edges, n_sections=7, radius=4):
+    cyl_list = []
+    for seg in edges:
+        cyl_list.append(
+            trimesh.creation.cylinder(
+                radius=radius,
+                height=0,
+                segment=(coords[seg[0], :], coords[seg[1], :]),
+                sections=n_sections,
+            )
+        )
+    return _concatenate_meshes(cyl_list)
+
+
+def _all_meshes(neurons, fun):
+    meshes = []
+    for neuron in neurons:
+        coords = neuron.coords_em.copy()
+        for edges in [neuron.dendrites_edges, neuron.axon_edges]:
+            if len(edges) > 0:
+                meshes.append(fun(coords, edges))
+    return meshes
+
+
+def _time(fun, *args):
+    t = perf_counter()
+    out = fun(*args)
+    return perf_counter() - t, out
+
+
+if __name__ == "__main__":
+    data_folder = lotr.DATASET_LOCATION / "anatomy" / "annotated_traced_neurons"
+    files = sorted([f for f in data_folder.glob("*.zip") if "synapses" not in f.name])
+    neurons = list(load_skeletons_dict_from_zips(files).values())
+    n_edges = sum([len(n.edges) for n in neurons])
+    print(f"{len(neurons)} neurons, {n_edges} edges")
+
+    t_loop, meshes_loop = _time(_all_meshes, neurons, _make_cylinder_tree_loop)
+    t_vect, meshes_vect = _time(_all_meshes, neurons, make_cylinder_tree)
+
+    volume_diff = max(
+        [abs(a.volume - b.volume) / a.volume for a, b in zip(meshes_loop, meshes_vect)]
+    )
+    print(f"One cylinder per edge: {t_loop:.2f} s")
+    print(f"Vectorized: {t_vect:.2f} s ({t_loop / t_vect:.0f}x)")
+    print(f"Max relative volume difference: {volume_diff:.1e}")
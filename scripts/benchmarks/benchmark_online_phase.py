@@ -0,0 +1,40 @@
+"""Latency of the frame-by-frame update of the online network phase estimator,
+compared with recomputing the phase from a window of recent frames with
+compute_network_phase.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from lotr.online_phase import OnlinePhaseEstimator
+from lotr.rpca_calculation import compute_network_phase
+
+N_FRAMES, N_ROIS, N_HDN = 5000, 20000, 300
+
+
+if __name__ == "__main__":
+    traces = np.random.normal(0, 1, (N_FRAMES, N_ROIS))
+    hdn_indexes = np.random.choice(N_ROIS, N_HDN, replace=False)
+    rpc_scores = np.random.normal(0, 1, (N_HDN, 2))
+
+    estimator = OnlinePhaseEstimator(
+        rpc_scores, roi_indexes=hdn_indexes, smoothing_tau=2
+    )
+    latencies = np.zeros(N_FRAMES)
+    for i, frame in enumerate(traces):
+        t = perf_counter()
+        estimator.update(frame)
+        latencies[i] = perf_counter() - t
+
+    t = perf_counter()
+    for i in range(100):
+        compute_network_phase(traces[: i + 100, hdn_indexes], rpc_scores)[-1]
+    offline_latency = (perf_counter() - t) / 100
+
+    print(
+        f"online update: median {np.median(latencies) * 1e6:.1f} us, 99th percentile "
+        f"{np.percentile(latencies, 99) * 1e6:.1f} us, max "
+        f"{latencies.max() * 1e6:.1f} us; offline on 100+ frames: "
+        f"{offline_latency * 1e6:.1f} us"
+    )
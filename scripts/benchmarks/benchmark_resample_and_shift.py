@@ -0,0 +1,56 @@
+"""Compare the per-frame interpolation loop of the former resample_and_shift with
+the sparse weights implementation, on random traces of a realistic size.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from lotr.analysis.activity_profile import resample_and_shift_traces
+from lotr.utils import roll_columns_jit
+
+N_PTS, N_ROIS, N_BINS = 20000, 400, 100
+
+
+def _resample_and_shift_loop(traces, angles, network_phase, n_bins_resampling):
+    sort_idxs = np.argsort(angles)
+    resampling_base = np.linspace(-np.pi, np.pi, n_bins_resampling)
+
+    angle_resampled_traces = np.zeros((traces.shape[0], n_bins_resampling))
+    for i in range(traces.shape[0]):
+        angle_resampled_traces[i, :] = np.interp(
+            resampling_base, angles[sort_idxs], traces[i, sort_idxs]
+        )
+
+    phase_shifts_res = (network_phase / (2 * np.pi)) * (n_bins_resampling - 1)
+    reshaped_traces = roll_columns_jit(
+        angle_resampled_traces, -np.round(phase_shifts_res)
+    )
+    return angle_resampled_traces, reshaped_traces
+
+
+def _time(fun, *args, **kwargs):
+    t = perf_counter()
+    out = fun(*args, **kwargs)
+    return perf_counter() - t, out
+
+
+if __name__ == "__main__":
+    traces = np.random.normal(0, 1, (N_PTS, N_ROIS)).astype(np.float32)
+    angles = np.random.uniform(-np.pi, np.pi, N_ROIS)
+    phase = np.random.uniform(-np.pi, np.pi, N_PTS)
+
+    # Compile numba functions first:
+    _resample_and_shift_loop(traces[:10], angles, phase[:10], N_BINS)
+
+    t_loop, (_, shifted) = _time(
+        _resample_and_shift_loop, traces, angles, phase, N_BINS
+    )
+    t_sparse, (_, shifted_sparse) = _time(
+        resample_and_shift_traces, traces, angles, phase, N_BINS
+    )
+    print(
+        f"loop {t_loop:.2f} s, sparse weights {t_sparse:.2f} s "
+        f"({t_loop / t_sparse:.1f}x), max abs. diff. "
+        f"{np.abs(shifted - shifted_sparse).max():.1e}"
+    )
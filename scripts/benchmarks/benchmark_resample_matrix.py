@@ -0,0 +1,44 @@
+"""Compare the column-by-column np.interp loop of the former resample_matrix with
+the shared-weights implementation, for the resampling of bout crops to DEFAULT_FN.
+"""
+
+from time import perf_counter
+
+import numpy as np
+from numba import njit
+
+from lotr.utils import resample_matrix
+
+N_PTS, N_COLS, FISH_FN, FN = 300, 20000, 3, 5
+
+
+@njit
+def _resample_matrix_loop(x, fx, matrix):
+    resampled = np.full((len(x), matrix.shape[1]), np.nan)
+    for i in range(matrix.shape[1]):
+        resampled[:, i] = np.interp(x, fx, matrix[:, i])
+    return resampled
+
+
+def _time(fun, *args, **kwargs):
+    t = perf_counter()
+    out = fun(*args, **kwargs)
+    return perf_counter() - t, out
+
+
+if __name__ == "__main__":
+    fx = np.arange(1, N_PTS + 1) / FISH_FN
+    x = np.arange(1, int(N_PTS * FN / FISH_FN) + 1) / FN
+    matrix = np.random.normal(0, 1, (N_PTS, N_COLS))
+
+    # Compile numba functions first:
+    _resample_matrix_loop(x, fx, matrix[:, :2])
+    resample_matrix(x, fx, matrix[:, :2])
+
+    t_loop, resampled = _time(_resample_matrix_loop, x, fx, matrix)
+    t_shared, resampled_shared = _time(resample_matrix, x, fx, matrix)
+    print(
+        f"loop {t_loop:.3f} s, shared weights {t_shared:.3f} s "
+        f"({t_loop / t_shared:.1f}x), max abs. diff. "
+        f"{np.abs(resampled - resampled_shared).max():.1e}"
+    )
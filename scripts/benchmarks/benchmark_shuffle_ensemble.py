@@ -0,0 +1,68 @@
+"""Compare the computation of shuffle controls one set of ROIs at a time (as
+LotrExperiment.rpc_scores_shuf and network_phase_shuf) with the stacked
+computation of rpc_scores_and_phase_stacked, on a synthetic ring network.
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from lotr.pca import pca_and_phase
+from lotr.rpca_calculation import (
+    compute_network_phase,
+    get_zero_mean_weights,
+    reorient_pcs,
+    rpc_scores_and_phase_stacked,
+)
+
+N_PTS, N_ROIS, N_HDN, N_SHUFFLES, CHUNK_SIZE = 10000, 3000, 200, 32, 16
+FIT_SLICE = slice(1000, 9000)
+
+
+def _time(fun, *args, **kwargs):
+    t = perf_counter()
+    out = fun(*args, **kwargs)
+    return perf_counter() - t, out
+
+
+def _one_at_a_time(traces, coords, indexes):
+    phases = []
+    for idxs in indexes:
+        pcaed, _, _, circle_params = pca_and_phase(traces[FIT_SLICE, idxs].T)
+        rpc_scores = reorient_pcs(
+            pcaed[:, :2] - circle_params[:2], get_zero_mean_weights(coords[idxs])
+        )
+        phases.append(compute_network_phase(traces[:, idxs], rpc_scores))
+    return np.stack(phases)
+
+
+def _stacked(traces, coords, indexes):
+    phases = []
+    for i in range(0, len(indexes), CHUNK_SIZE):
+        chunk = indexes[i : i + CHUNK_SIZE]
+        _, chunk_phases = rpc_scores_and_phase_stacked(
+            np.stack([traces[:, idxs] for idxs in chunk]),
+            np.stack([get_zero_mean_weights(coords[idxs]) for idxs in chunk]),
+            FIT_SLICE,
+        )
+        phases.append(chunk_phases)
+    return np.concatenate(phases)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    phase = np.cumsum(rng.normal(0, 0.1, N_PTS))
+    traces = np.maximum(np.cos(phase[:, np.newaxis] + rng.uniform(-3, 3, N_ROIS)), 0)
+    traces += rng.normal(0, 0.3, (N_PTS, N_ROIS))
+    coords = rng.uniform(0, 100, (N_ROIS, 2))
+    indexes = np.stack(
+        [rng.choice(N_ROIS, N_HDN, replace=False) for _ in range(N_SHUFFLES)]
+    )
+
+    t_loop, phases_loop = _time(_one_at_a_time, traces, coords, indexes)
+    t_stacked, phases_stacked = _time(_stacked, traces, coords, indexes)
+
+    phase_diff = np.abs(np.angle(np.exp(1j * (phases_loop - phases_stacked))))
+    print(f"One at a time: {t_loop:.2f} s")
+    print(f"Stacked: {t_stacked:.2f} s ({t_loop / t_stacked:.1f}x)")
+    print(f"Max abs. phase difference: {phase_diff.max():.1e}")
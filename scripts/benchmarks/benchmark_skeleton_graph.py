@@ -0,0 +1,88 @@
+"""Compare the axon detection of EmNeuron (search of the node linking soma and
+axon, and of the nodes connected to the axon start) on the edge list, as it used
+to be, and on the CSR adjacency of SkeletonGraph, for synthetic skeletons of
+increasing size.
+"""
+
+from time import perf_counter
+
+import numpy as np
+from numba import jit
+
+from lotr.em.tracing_tree import SkeletonGraph
+
+N_NODES = [1000, 5000, 20000]
+
+
+@jit(nopython=True)
+def _find_axon_link(extend_edg, soma_id, ax_id):
+    tovisit = [soma_id]
+    visited = []
+
+    keepsearch = True
+    while len(tovisit) > 0 and keepsearch:
+        visiting = tovisit.pop()
+        if visiting not in visited:
+            new_nodes = extend_edg[extend_edg[:, 0] == visiting][:, 1]
+            for n in new_nodes:
+                if ax_id == n:
+                    keepsearch = False
+            tovisit.extend(new_nodes)
+        visited.append(visiting)
+
+    return visiting
+
+
+@jit(nopython=True)
+def _find_all_connected(extend_edg, ax_id):
+    tovisit = [ax_id]
+    visited = []
+    while len(tovisit) > 0:
+        visiting = tovisit.pop()
+
+        if visiting not in visited:
+            new_nodes = extend_edg[extend_edg[:, 0] == visiting][:, 1]
+            tovisit.extend(new_nodes)
+        visited.append(visiting)
+
+    return visited
+
+
+def _axon_edge_list(edges, soma_idx, ax_start_idx):
+    extend_edg = np.concatenate([edges, np.flip(edges, 1)]).copy()
+    link = _find_axon_link(extend_edg, soma_idx, ax_start_idx)
+    extend_edg[(extend_edg[:, 0] == link) | (extend_edg[:, 1] == link)] = 0
+    return np.unique(np.array(_find_all_connected(extend_edg, ax_start_idx)))
+
+
+def _axon_graph(edges, soma_idx, ax_start_idx):
+    graph = SkeletonGraph(edges)
+    link = graph.find_link(soma_idx, ax_start_idx)
+    return np.unique(graph.connected(ax_start_idx, blocked=link))
+
+
+def _time(fun, *args):
+    t = perf_counter()
+    out = fun(*args)
+    return perf_counter() - t, out
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+
+    # Compile numba functions:
+    small_edges = np.array([[0, 1], [1, 2]])
+    _axon_edge_list(small_edges, 0, 2), _axon_graph(small_edges, 0, 2)
+
+    for n_nodes in N_NODES:
+        edges = np.array(
+            [[rng.integers(max(0, i - 3), i), i] for i in range(1, n_nodes)]
+        )
+        t_list, axon_list = _time(_axon_edge_list, edges, 0, n_nodes // 2)
+        t_graph, axon_graph = _time(_axon_graph, edges, 0, n_nodes // 2)
+
+        assert np.array_equal(axon_list, axon_graph)
+        print(
+            f"{n_nodes} nodes: edge list {t_list:.3f} s, "
+            + f"graph {t_graph:.4f} s ({t_list / t_graph:.0f}x)"
+        )
@@ -1,6 +1,10 @@
+import json
+
+import flammkuchen as fl
+import numpy as np
+import pandas as pd
 import pytest
 
-from lotr import DATASET_LOCATION
 from lotr.data_preprocessing.preprocessing import preprocess_folder
 
 
@@ -14,10 +18,13 @@ def pytest_addoption(parser):
     )
 
 
-@pytest.fixture(scope="session", autouse=True)
+@pytest.fixture(scope="session")
 def sample_path(pytestconfig):
-    # Will be executed before the first test
-    path = DATASET_LOCATION / "lightsheet" / "210314_f1" / "210314_f1_natmov"
+    # Will be executed before the first test using the sample data. The dataset
+    # location is resolved only here, so tests on synthetic data can run offline:
+    from lotr import A_FISH
+
+    path = A_FISH
 
     if (
         pytestconfig.getoption("preprocess")
@@ -31,3 +38,55 @@ def sample_path(pytestconfig):
         )
 
     yield path
+
+
+def _write_synthetic_fish(path, seed=0, n_pts=3000, n_rois=150, n_hdns=40, fs=5):
+    """Write a minimal experiment folder with a ring network of HDNs, some bouts
+    and a closed-loop stimulus log.
+    """
+    rng = np.random.default_rng(seed)
+    path.mkdir(parents=True)
+
+    metadata = dict(
+        imaging=dict(microscope_config=dict(scanning=dict(framerate=fs))),
+        stimulus=dict(log=[dict(name="pause", t_start=0, t_stop=n_pts / fs)]),
+    )
+    with open(path / "000_metadata.json", "w") as f:
+        json.dump(metadata, f)
+
+    phase = np.cumsum(rng.normal(0, 0.1, n_pts))
+    traces = rng.normal(0, 0.3, (n_pts, n_rois))
+    hdn_indexes = np.sort(rng.choice(n_rois, n_hdns, replace=False))
+    traces[:, hdn_indexes] += np.maximum(
+        np.cos(phase[:, np.newaxis] + rng.uniform(-np.pi, np.pi, n_hdns)), 0
+    )
+    fl.save(path / "filtered_traces.h5", dict(detr=traces, undetr=traces))
+    fl.save(
+        path / "data_from_suite2p_unfiltered.h5",
+        dict(traces=traces.T, coords=rng.uniform(0, 100, (n_rois, 3))),
+    )
+    fl.save(path / "selected.h5", hdn_indexes)
+
+    idx_imaging = np.sort(rng.choice(np.arange(100, n_pts - 200), 20, replace=False))
+    bouts_df = pd.DataFrame(
+        dict(
+            t_start=idx_imaging / fs,
+            idx_imaging=idx_imaging,
+            bias=rng.uniform(-1, 1, len(idx_imaging)),
+        )
+    )
+    fl.save(path / "bouts_df.h5", bouts_df)
+
+    t = np.arange(n_pts * 4) / (fs * 4)
+    stimulus_log = pd.DataFrame(dict(t=t, cl2D_theta=np.sin(t / 10 + seed)))
+    stimulus_log.to_csv(path / "000_stimulus_log.csv", sep=";")
+
+    return path
+
+
+@pytest.fixture
+def synthetic_fish():
+    """Factory of synthetic experiment folders, called with the folder path (its
+    name should follow the dataset convention, e.g. "210101_f1_natmov").
+    """
+    return _write_synthetic_fish
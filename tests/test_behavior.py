@@ -0,0 +1,59 @@
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from lotr.behavior import (
+    create_motor_regressors,
+    get_bouts_props_array,
+    motor_regressors_matrix,
+)
+from lotr.default_vals import REGRESSOR_TAU_S
+
+np.random.seed(34224)
+
+
+def _motor_regressors_loop(n_pts, df, fn, min_bias=0.05):
+    # Former implementation, one bouts selection and convolution per regressor:
+    regressors_dict = dict()
+    for d, v in product(["left", "right", "forward", "all"], ["bias", "med_vig", 1]):
+        if d == "forward" and v == "bias":
+            continue
+        d_min_bias = 0 if d in ["forward", "all"] else min_bias
+
+        arr = get_bouts_props_array(
+            n_pts, df, min_bias=d_min_bias, selection=d, value=v
+        )
+        if v == "bias" and d == "all":
+            regressors_dict[f"{d}_{v}_abs"] = np.abs(arr)
+        elif d in ["left", "right"]:
+            arr = np.abs(arr)
+        regressors_dict[f"{d}_{v}"] = arr
+
+    kernel = np.exp(-np.arange(1000) / (REGRESSOR_TAU_S * fn))
+    return pd.DataFrame(
+        {k: np.convolve(val, kernel)[:n_pts] for k, val in regressors_dict.items()}
+    )
+
+
+def test_motor_regressors():
+    n_pts, n_bouts = 3000, 300
+    bouts_df = pd.DataFrame(
+        dict(
+            bias=np.random.normal(0, 0.5, n_bouts),
+            med_vig=np.random.uniform(0, 2, n_bouts),
+            idx_imaging=np.random.randint(0, n_pts, n_bouts),
+        )
+    )
+    bouts_df.loc[3, "bias"] = np.nan
+    bouts_df.loc[4, "bias"] = 0
+
+    for fn in [5, 30]:  # also with a kernel truncated before decaying to 0
+        expected = _motor_regressors_loop(n_pts, bouts_df, fn)
+        regressors = create_motor_regressors(n_pts, bouts_df, fn)
+        assert list(regressors.columns) == list(expected.columns)
+        assert np.allclose(regressors.values, expected.values)
+
+    matrix, columns = motor_regressors_matrix(n_pts, bouts_df, fn)
+    assert matrix.dtype == np.float32 and columns == list(regressors.columns)
+    assert np.allclose(matrix, expected.values, rtol=1e-5, atol=1e-5)
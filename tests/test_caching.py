@@ -0,0 +1,104 @@
+import json
+
+import flammkuchen as fl
+import numpy as np
+import pandas as pd
+
+from lotr import experiment_class
+from lotr.caching import DiskCache
+from lotr.data_preprocessing.stimulus import get_all_trials_df
+from lotr.experiment_class import LotrExperiment
+
+
+def test_disk_cache(tmp_path):
+    exp_path = tmp_path / "exp"
+    exp_path.mkdir()
+    fl.save(exp_path / "selected.h5", np.arange(10))
+    cache = DiskCache(tmp_path / "cache", max_size_mb=1)
+
+    fingerprint = cache.experiment_fingerprint(exp_path)
+    assert fingerprint == cache.experiment_fingerprint(exp_path)
+
+    calls = []
+
+    def _compute():
+        calls.append(1)
+        return np.arange(100)
+
+    for _ in range(2):
+        value = cache.get_or_compute(fingerprint, "arange", _compute, n=100)
+        assert np.array_equal(value, np.arange(100))
+    assert len(calls) == 1
+
+    # Different parameters, different entries:
+    cache.get_or_compute(fingerprint, "arange", _compute, n=101)
+    assert len(calls) == 2
+
+    # Explicit invalidation:
+    cache.invalidate(fingerprint)
+    cache.get_or_compute(fingerprint, "arange", _compute, n=100)
+    assert len(calls) == 3
+
+    # Changes in the files content change the fingerprint:
+    fl.save(exp_path / "selected.h5", np.arange(11))
+    assert cache.experiment_fingerprint(exp_path) != fingerprint
+
+    # Size bounded eviction:
+    for i in range(3):
+        cache.get_or_compute(fingerprint, "big", lambda: np.random.rand(2**16), i=i)
+    assert len(list(cache.path.glob("*/big_*.h5"))) < 3
+
+
+def test_file_digests_pruning(tmp_path):
+    cache = DiskCache(tmp_path / "cache")
+    paths = [tmp_path / f"file_{i}.h5" for i in range(2)]
+    for i, path in enumerate(paths):
+        fl.save(path, np.arange(10 + i))
+        cache.file_digest(path)
+
+    # Lookups of unchanged files do not rewrite the memo:
+    memo_mtime = cache._digests_file.stat().st_mtime_ns
+    digest = cache.file_digest(paths[0])
+    assert cache._digests_file.stat().st_mtime_ns == memo_mtime
+
+    # Changed files replace their digest, removed files are dropped:
+    for i in range(3):
+        fl.save(paths[0], np.arange(20 + i))
+        assert cache.file_digest(paths[0]) != digest
+    paths[1].unlink()
+    fl.save(paths[0], np.arange(30))
+    cache.file_digest(paths[0])
+
+    digests = json.loads(cache._digests_file.read_text())
+    assert list(digests.keys()) == [str(paths[0].resolve())]
+
+    # New instances read the memo:
+    assert DiskCache(tmp_path / "cache").file_digest(paths[0]) == cache.file_digest(
+        paths[0]
+    )
+
+
+def test_stim_trials_df_cache(tmp_path, synthetic_fish, monkeypatch):
+    path = synthetic_fish(tmp_path / "210101_f1_natmov")
+    cache = DiskCache(tmp_path / "cache")
+
+    calls = []
+
+    def _get_all_trials_df(exp):
+        calls.append(1)
+        return get_all_trials_df(exp)
+
+    monkeypatch.setattr(experiment_class, "get_all_trials_df", _get_all_trials_df)
+
+    for _ in range(2):
+        trials_df = LotrExperiment(path, cache=cache).stim_trials_df
+    assert len(calls) == 1
+    assert list(trials_df["condition"]) == ["darkness"]
+
+    # A new stimulus log makes the cached trials outdated:
+    stimulus_log = pd.read_csv(path / "000_stimulus_log.csv", sep=";", index_col=0)
+    stimulus_log["cl2D_theta"] += 1
+    stimulus_log.to_csv(path / "000_stimulus_log.csv", sep=";")
+
+    LotrExperiment(path, cache=cache).stim_trials_df
+    assert len(calls) == 2
@@ -46,3 +46,43 @@ def test_dataclass_array_anatomy_orientation(sample_path):
         exp.rois_stack[::4, ::200, ::100],
         [[[-1, -1, -1], [-1, 57, 53]], [[-1, -1, -1], [-1, 393, 338]]],
     )
+
+
+def test_dataclass_lazy_traces(sample_path):
+    exp = LotrExperiment(sample_path)
+    lazy_exp = LotrExperiment(sample_path, lazy_traces=True)
+    assert lazy_exp.n_pts == exp.n_pts and lazy_exp.n_rois == exp.n_rois
+
+    for attrib in ["traces", "raw_traces"]:
+        key = (exp.pca_t_slice, exp.hdn_indexes)
+        assert np.allclose(getattr(lazy_exp, attrib)[key], getattr(exp, attrib)[key])
+
+
+def test_dataclass_shuffle_ensemble(sample_path):
+    exp = LotrExperiment(sample_path, pca_kwargs=dict(solver="full"))
+    ensemble = exp.shuffle_ensemble(n_shuffles=3, seed=0, chunk_size=2)
+    assert ensemble["network_phase"].shape == (3, exp.n_pts)
+    assert np.allclose(exp.draw_rndcnt_indexes(3, seed=0), ensemble["indexes"])
+    assert not np.isin(ensemble["indexes"], exp.hdn_indexes).any()
+
+    for idxs, rpc_scores, phase in zip(
+        ensemble["indexes"], ensemble["rpc_scores"], ensemble["network_phase"]
+    ):
+        expected_scores = exp._compute_rpc_scores(idxs)
+        assert np.allclose(rpc_scores, expected_scores, atol=1e-6)
+        assert np.allclose(
+            phase, exp.get_network_phase(idxs, expected_scores), atol=1e-6
+        )
+
+
+def test_dataclass_shuffle_ensemble_lazy_traces(tmp_path, synthetic_fish):
+    path = synthetic_fish(tmp_path / "210101_f1_natmov", n_rois=400)
+    kwargs = dict(n_shuffles=8, seed=0, chunk_size=2)
+    ensemble = LotrExperiment(path).shuffle_ensemble(n_workers=1, **kwargs)
+    lazy_ensemble = LotrExperiment(path, lazy_traces=True).shuffle_ensemble(
+        n_workers=4, **kwargs
+    )
+
+    assert np.array_equal(lazy_ensemble["indexes"], ensemble["indexes"])
+    for key in ["rpc_scores", "network_phase"]:
+        assert np.allclose(lazy_ensemble[key], ensemble[key], atol=1e-6)
@@ -0,0 +1,234 @@
+import xml.etree.ElementTree as et
+from zipfile import ZipFile
+
+import numpy as np
+import pandas as pd
+import pytest
+import trimesh
+
+from lotr.em.core import EmNeuron
+from lotr.em.loading import (
+    iter_skeleton_arrays,
+    load_skeletons_dict_from_zips,
+    load_skeletons_from_xml,
+    load_skeletons_from_zip,
+)
+from lotr.em.skeleton_mesh import make_cylinder_tree
+from lotr.em.tracing_tree import (
+    SkeletonGraph,
+    _edges_selection,
+    find_bifurcations,
+)
+
+np.random.seed(34224)
+
+
+def _annotation_xml(n_skeletons=3, n_nodes=60):
+    # Chain-like random trees, with shuffled node ids, soma at the first node and
+    # axon start in the middle; the last skeleton is an axon without soma:
+    lines = ["<things>", '<parameters><experiment name="test"/></parameters>']
+    for i in range(n_skeletons):
+        lines.append(f'<thing id="{i + 1}" comment="p{i:03d} test"><nodes>')
+        ids = i * n_nodes + 1 + np.random.permutation(n_nodes)
+        for j, node_id in enumerate(ids):
+            comment = ""
+            if j == 0 and i < n_skeletons - 1:
+                comment = ' comment="soma"'
+            elif j == n_nodes // 2:
+                comment = ' comment="axon start"'
+            x, y, z = np.random.randint(0, 10000, 3)
+            lines.append(
+                f'<node id="{node_id}" radius="1" x="{x}" y="{y}" z="{z}"{comment}/>'
+            )
+        lines.append("</nodes><edges>")
+        for j in range(1, n_nodes):
+            source = ids[np.random.randint(max(0, j - 3), j)]
+            lines.append(f'<edge source="{source}" target="{ids[j]}"/>')
+        lines.append("</edges></thing>")
+    lines.append("</things>")
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def annotation_path(tmp_path):
+    path = tmp_path / "annotation.xml"
+    path.write_text(_annotation_xml())
+    return path
+
+
+def test_iter_skeleton_arrays(annotation_path):
+    things = list(iter_skeleton_arrays(annotation_path))
+    elements = [n for n in et.parse(annotation_path).getroot() if n.tag == "thing"]
+    assert len(things) == len(elements) == 3
+
+    for thing, element in zip(things, elements):
+        assert thing["comment"] == element.attrib["comment"]
+        nodes = [e.attrib for e in element[0]]
+        assert np.array_equal(thing["node_ids"], [int(n["id"]) for n in nodes])
+        assert np.array_equal(thing["coords"][:, 2], [int(n["z"]) for n in nodes])
+        assert thing["edges"].shape == (len(element[1]), 2)
+
+
+def _find_link_loop(edges, source, target):
+    # Former search on the edge list, visiting the nodes in the order of a stack:
+    extend_edg = np.concatenate([edges, edges[:, ::-1]])
+    tovisit, visited = [source], []
+    while len(tovisit) > 0:
+        visiting = tovisit.pop()
+        if visiting not in visited:
+            new_nodes = list(extend_edg[extend_edg[:, 0] == visiting, 1])
+            tovisit.extend(new_nodes)
+            if target in new_nodes:
+                break
+        visited.append(visiting)
+    return visiting
+
+
+def _neuron_loop(element):
+    # Former DataFrame parsing of a "thing" element, with the axon found by
+    # searching the edge list:
+    pts_df = pd.DataFrame([e.attrib for e in element[0]])
+    comments = pts_df["comment"].fillna("")
+    soma_idx, ax_start_idx = [
+        (list(np.flatnonzero(comments.str.contains(key, case=False))) + [None])[0]
+        for key in ["soma", "axon"]
+    ]
+
+    edges_df = pd.DataFrame([e.attrib for e in element[1]]).astype(int)
+    id_table = pd.Series(pts_df.index, index=pts_df["id"].astype(int))
+    edges = np.stack([edges_df[k].map(id_table).values for k in edges_df.columns], 1)
+
+    if soma_idx is None:
+        axon_idxs = np.arange(len(pts_df))
+    else:
+        extend_edg = np.concatenate([edges, edges[:, ::-1]])
+        link = _find_link_loop(edges, soma_idx, ax_start_idx)
+        extend_edg[(extend_edg[:, 0] == link) | (extend_edg[:, 1] == link)] = 0
+        tovisit, visited = [ax_start_idx], []
+        while len(tovisit) > 0:
+            visiting = tovisit.pop()
+            if visiting not in visited:
+                tovisit.extend(extend_edg[extend_edg[:, 0] == visiting, 1])
+            visited.append(visiting)
+        axon_idxs = np.unique(visited)
+
+    return dict(
+        soma_idx=soma_idx, ax_start_idx=ax_start_idx, edges=edges, axon_idxs=axon_idxs
+    )
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_load_skeletons_from_xml(annotation_path, n_workers):
+    neurons = load_skeletons_from_xml(annotation_path, n_workers=n_workers)
+    elements = [n for n in et.parse(annotation_path).getroot() if n.tag == "thing"]
+
+    for neuron, element in zip(neurons, elements):
+        expected = _neuron_loop(element)
+        assert neuron.id == element.attrib["comment"][:4]
+        assert neuron.soma_idx == expected["soma_idx"]
+        assert neuron.ax_start_idx == expected["ax_start_idx"]
+        assert np.array_equal(neuron.edges, expected["edges"])
+        assert np.array_equal(neuron.axon_idxs, expected["axon_idxs"])
+
+    assert neurons[0].soma_idx == 0 and neurons[0].ax_start_idx == 30
+    assert neurons[-1].is_axon
+    assert len(neurons[0].axon_idxs) + len(neurons[0].dendr_idxs) == 60
+
+
+def test_neuron_missing_edge_ids():
+    node_ids = np.array([10, 12, 14, 16])
+    coords = np.random.uniform(0, 1000, (4, 3))
+    edges = np.array([[10, 12], [12, 14], [14, 16]])
+    neuron = EmNeuron.from_arrays(node_ids, coords, edges, comment="p999 test")
+    assert np.array_equal(neuron.edges, [[0, 1], [1, 2], [2, 3]])
+
+    # Ids within and above the range of the node ids:
+    for missing_id in [13, 20]:
+        bad_edges = np.concatenate([edges, [[16, missing_id]]])
+        with pytest.raises(ValueError, match="p999"):
+            EmNeuron.from_arrays(node_ids, coords, bad_edges, comment="p999 test")
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_load_skeletons_from_zips(tmp_path, monkeypatch, n_workers):
+    paths = []
+    for i in range(2):
+        paths.append(tmp_path / f"archive_{i}.zip")
+        with ZipFile(paths[-1], "w") as zip_obj:
+            zip_obj.writestr("annotation.xml", _annotation_xml(n_skeletons=2 + i))
+
+    # Nothing is extracted in the working directory:
+    monkeypatch.chdir(tmp_path)
+    neurons = load_skeletons_from_zip(paths[0])
+    assert not (tmp_path / "annotation.xml").exists()
+    assert [n.id for n in neurons] == ["p000", "p001"]
+
+    neurons_dict = load_skeletons_dict_from_zips(paths, n_workers=n_workers)
+    assert sorted(neurons_dict.keys()) == ["p000", "p001", "p002"]
+    # Ids in both archives are taken from the last one:
+    expected = load_skeletons_from_zip(paths[1])[0]
+    assert np.array_equal(neurons_dict["p000"].coords_em, expected.coords_em)
+
+
+def test_skeleton_graph():
+    for _ in range(50):
+        # Random trees with a few extra edges making cycles:
+        n_nodes = np.random.randint(5, 60)
+        edges = np.array(
+            [[i, np.random.randint(max(0, i - 3), i)] for i in range(1, n_nodes)]
+            + [np.random.randint(0, n_nodes, 2) for _ in range(3)]
+        )
+        edges = edges[np.random.permutation(len(edges))]
+        graph = SkeletonGraph(edges, n_nodes)
+
+        source, target = np.random.choice(n_nodes, 2, replace=False)
+        link = graph.find_link(source, target)
+        assert link == _find_link_loop(edges, source, target)
+        assert np.array_equal(np.sort(graph.connected(target)), np.arange(n_nodes))
+        assert link not in graph.connected(target, blocked=link)
+
+        degree = np.array([(edges == i).sum() for i in range(n_nodes)])
+        assert np.array_equal(find_bifurcations(edges), np.flatnonzero(degree > 2))
+
+        idxs = np.random.choice(n_nodes, n_nodes // 3, replace=False)
+        expected = [e for e in edges if e[0] in idxs or e[1] in idxs]
+        assert np.array_equal(
+            _edges_selection(edges, idxs), np.reshape(expected, (-1, 2))
+        )
+
+    # Path and subtree queries on a small tree:
+    graph = SkeletonGraph(np.array([[0, 1], [1, 2], [1, 3], [3, 4]]))
+    assert np.array_equal(graph.path(0, 4), [0, 1, 3, 4])
+    assert np.array_equal(graph.parents(0), [-1, 0, 1, 1, 3])
+    assert np.array_equal(np.sort(graph.subtree(3, 0)), [3, 4])
+    assert np.array_equal(np.sort(graph.subtree(1, 4)), [0, 1, 2])
+    assert np.array_equal(graph.branch_points(), [1])
+
+
+def _triangles_key(mesh):
+    # Triangles centers and normals, sorted, to compare geometries independently
+    # from the order of vertices and faces:
+    key = np.round(np.concatenate([mesh.triangles_center, mesh.face_normals], 1), 6)
+    return key[np.lexsort(key.T[::-1])]
+
+
+def test_make_cylinder_tree():
+    coords = np.random.uniform(0, 1000, (100, 3))
+    coords[1, :] = coords[0, :] + [0, 0, 10]  # Edges along +z and -z
+    coords[2, :] = coords[0, :] - [0, 0, 10]
+    edges = np.array([[np.random.randint(max(0, i - 3), i), i] for i in range(1, 100)])
+    edges[:2, 0] = 0
+
+    mesh = make_cylinder_tree(coords, edges, n_sections=7, radius=4)
+
+    # Same geometry as one trimesh cylinder per edge:
+    cylinders = [
+        trimesh.creation.cylinder(radius=4, sections=7, segment=coords[edge, :])
+        for edge in edges
+    ]
+    expected = trimesh.util.concatenate(cylinders)
+    assert mesh.faces.shape == expected.faces.shape
+    assert np.allclose(_triangles_key(mesh), _triangles_key(expected))
+    assert np.isclose(mesh.volume, expected.volume)
+
+    assert len(make_cylinder_tree(coords, []).faces) == 0
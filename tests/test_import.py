@@ -0,0 +1,78 @@
+import json
+import os
+import subprocess
+import sys
+
+# Generous budget, the import itself normally takes ~1 ms:
+IMPORT_TIME_BUDGET_S = 0.5
+
+# Budget for loading an experiment and computing its network phase, headless:
+HEADLESS_RUN_BUDGET_S = 30
+
+# Modules that should be imported only when plotting or generating meshes:
+PLOTTING_MODULES = [
+    "matplotlib",
+    "seaborn",
+    "colorspacious",
+    "svgpath2mpl",
+    "skimage",
+    "bg_atlasapi",
+    "trimesh",
+    "lotr.plotting",
+]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+t = time.perf_counter()
+import lotr
+elapsed = time.perf_counter() - t
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(sys.modules), ns=dir(lotr))))
+"""
+
+
+_HEADLESS_SCRIPT = """
+import json, sys, time
+t = time.perf_counter()
+from lotr import LotrExperiment
+import lotr.em.loading, lotr.pca, lotr.rpca_calculation, lotr.utils
+if len(sys.argv) > 1:
+    LotrExperiment(sys.argv[1]).network_phase
+elapsed = time.perf_counter() - t
+print(json.dumps(dict(elapsed=elapsed, modules=sorted(sys.modules))))
+"""
+
+
+def _run_in_subprocess(script, *args):
+    # Offline mode ensures that the dataset can never be downloaded here:
+    env = dict(os.environ, LOTR_OFFLINE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", script, *args], env=env, capture_output=True, check=True
+    )
+    return json.loads(out.stdout.decode().splitlines()[-1])
+
+
+def test_import_time():
+    # Best of a few runs, to be robust to noise on the CI machines:
+    elapsed = min([_run_in_subprocess(_IMPORT_SCRIPT)["elapsed"] for _ in range(3)])
+    assert elapsed < IMPORT_TIME_BUDGET_S
+
+
+def test_import_side_effect_free():
+    result = _run_in_subprocess(_IMPORT_SCRIPT)
+
+    # Nothing heavy gets imported, nor the dataset gets resolved:
+    for module in ["numpy", "pooch", "bouter", "lotr.file_utils"]:
+        assert module not in result["modules"]
+    for attribute in ["DATASET_LOCATION", "dataset_folders", "LotrExperiment"]:
+        assert attribute in result["ns"]
+
+
+def test_headless_imports():
+    result = _run_in_subprocess(_HEADLESS_SCRIPT)
+    assert not [m for m in PLOTTING_MODULES if m in result["modules"]]
+
+
+def test_headless_network_phase(sample_path):
+    result = _run_in_subprocess(_HEADLESS_SCRIPT, str(sample_path))
+    assert not [m for m in PLOTTING_MODULES if m in result["modules"]]
+    assert result["elapsed"] < HEADLESS_RUN_BUDGET_S
@@ -0,0 +1,40 @@
+import flammkuchen as fl
+import numpy as np
+import pytest
+
+from lotr.lazy_arrays import LazyH5Array
+
+np.random.seed(34224)
+ARRAY = np.random.rand(120, 60).astype(np.float32)
+INDEXES = np.array([5, 3, 3, 59, -1, 0])
+
+
+@pytest.fixture(scope="module")
+def lazy_arrays(tmp_path_factory):
+    path = tmp_path_factory.mktemp("lazy")
+    fl.save(path / "detr.h5", dict(detr=ARRAY))
+    fl.save(path / "raw.h5", dict(traces=ARRAY.T.copy()), compression=None)
+
+    return (
+        LazyH5Array(path / "detr.h5", "/detr"),
+        LazyH5Array(path / "raw.h5", "/traces").T,
+    )
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        (slice(None), INDEXES),
+        (slice(10, 50, 3), INDEXES),
+        (7, INDEXES),
+        (INDEXES[:4], 4),
+        (slice(None), ARRAY[0, :] > 0.5),
+        (INDEXES, INDEXES),
+        (-3, slice(2, 9)),
+        5,
+    ],
+)
+def test_lazy_array_indexing(lazy_arrays, key):
+    for lazy_array in lazy_arrays:
+        assert lazy_array.shape == ARRAY.shape
+        assert np.array_equal(lazy_array[key], ARRAY[key])
@@ -0,0 +1,37 @@
+import numpy as np
+
+from lotr.online_phase import OnlinePhaseEstimator
+from lotr.rpca_calculation import compute_network_phase, get_zero_mean_weights
+
+np.random.seed(34224)
+
+
+def test_online_phase_estimator():
+    traces = np.random.normal(0, 1, (500, 200))
+    hdn_indexes = np.random.choice(200, 60, replace=False)
+    rpc_scores = np.random.normal(0, 1, (60, 2))
+
+    # Offline phase, as computed before compute_network_phase:
+    norm_activity = get_zero_mean_weights(traces[:, hdn_indexes].T).T
+    avg_vects = norm_activity @ rpc_scores
+    expected = np.arctan2(avg_vects[:, 1], -avg_vects[:, 0])
+    assert np.allclose(
+        compute_network_phase(traces[:, hdn_indexes], rpc_scores), expected
+    )
+
+    estimator = OnlinePhaseEstimator(rpc_scores, roi_indexes=hdn_indexes)
+    phases = estimator.update_many(traces)
+    assert np.abs(np.angle(np.exp(1j * (phases - expected)))).max() < 1e-10
+
+    # Causal smoothing of the population vector:
+    decay = np.exp(-1 / 3)
+    smoothed_estimator = OnlinePhaseEstimator(
+        rpc_scores, roi_indexes=hdn_indexes, smoothing_tau=3
+    )
+    smoothed = avg_vects[0]
+    for i, frame in enumerate(traces):
+        smoothed = decay * smoothed + (1 - decay) * avg_vects[i]
+        phase = smoothed_estimator.update(frame)
+        assert np.isclose(
+            np.angle(np.exp(1j * (phase - np.arctan2(smoothed[1], -smoothed[0])))), 0
+        )
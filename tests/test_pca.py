@@ -1,7 +1,18 @@
 import numpy as np
+import pytest
 
 from lotr import LotrExperiment
-from lotr.pca import pca_and_phase
+from lotr.pca import (
+    fit_phase_neurons,
+    fit_phase_neurons_batched,
+    pca_and_phase,
+)
+from lotr.rpca_calculation import (
+    compute_network_phase,
+    get_zero_mean_weights,
+    reorient_pcs,
+    rpc_scores_and_phase_stacked,
+)
 
 np.random.seed(34224)
 
@@ -27,3 +38,70 @@ def test_pca_circlefit(sample_path):
         (79.07544827739056, 12.745134),
         rtol=1e-03,
     )
+
+
+def test_fit_phase_neurons_batched():
+    n_pts, n_rois = 2000, 100
+    phase = np.angle(np.exp(1j * np.cumsum(np.random.normal(0, 0.1, n_pts))))
+    roi_phases = np.random.uniform(-np.pi, np.pi, n_rois)
+    traces = np.maximum(
+        np.cos(phase[:, np.newaxis] + roi_phases), 0
+    ) + np.random.normal(0, 0.3, (n_pts, n_rois))
+    traces[:, 3] = 0
+
+    cell_phases, covs = fit_phase_neurons(traces, phase, disable_bar=True)
+    batched_phases, batched_covs = fit_phase_neurons_batched(traces, phase)
+
+    # Up to the tolerance of curve_fit:
+    phase_diff = np.angle(np.exp(1j * (cell_phases - batched_phases)))
+    assert np.nanmax(np.abs(phase_diff)) < 1e-3
+    assert np.allclose(covs, batched_covs, rtol=1e-3, equal_nan=True)
+    assert np.isnan(batched_phases[3]) and np.isnan(batched_covs[3])
+
+
+@pytest.mark.parametrize(
+    "pca_kwargs, tolerance",
+    [
+        (dict(solver="randomized", random_state=0), 1e-6),
+        (dict(solver="incremental", batch_size=100), 1e-3),
+        (dict(solver="randomized", dtype=np.float32, random_state=0), 1e-4),
+    ],
+)
+def test_pca_and_phase_solvers(pca_kwargs, tolerance):
+    n_pts, n_rois = 3000, 300
+    roi_angles = np.random.uniform(-np.pi, np.pi, n_rois)
+    phase = np.cumsum(np.random.normal(0, 0.1, n_pts))
+    traces = np.maximum(np.cos(phase[:, np.newaxis] + roi_angles), 0)
+    traces += np.random.normal(0, 0.3, (n_pts, n_rois))
+
+    pcaed, angles, _, circle_params = pca_and_phase(traces.T, solver="full")
+    pcaed_s, angles_s, _, circle_params_s = pca_and_phase(traces.T, **pca_kwargs)
+
+    assert np.abs(np.angle(np.exp(1j * (angles - angles_s)))).max() < tolerance
+    assert np.allclose(circle_params[:3], circle_params_s[:3], atol=tolerance)
+    assert np.allclose(pcaed[:, :2], pcaed_s[:, :2], atol=tolerance * 10)
+
+
+def test_rpc_scores_and_phase_stacked():
+    n_sets, n_pts, n_rois = 3, 2000, 80
+    fit_slice = slice(200, 1800)
+    phase = np.cumsum(np.random.normal(0, 0.1, n_pts))
+    roi_angles = np.random.uniform(-np.pi, np.pi, (n_sets, 1, n_rois))
+    traces = np.maximum(np.cos(phase[:, np.newaxis] + roi_angles), 0)
+    traces += np.random.normal(0, 0.3, (n_sets, n_pts, n_rois))
+    coords = np.random.uniform(0, 100, (n_sets, n_rois, 2))
+    w_coords = np.stack([get_zero_mean_weights(c.copy()) for c in coords])
+
+    rpc_scores, network_phase = rpc_scores_and_phase_stacked(
+        traces, w_coords, fit_slice
+    )
+    assert rpc_scores.shape == (n_sets, n_rois, 2)
+    assert network_phase.shape == (n_sets, n_pts)
+
+    for i in range(n_sets):
+        pcaed, _, _, circle_params = pca_and_phase(traces[i, fit_slice].T)
+        expected = reorient_pcs(pcaed[:, :2] - circle_params[:2], w_coords[i])
+        assert np.allclose(rpc_scores[i], expected, atol=1e-8)
+        assert np.allclose(
+            network_phase[i], compute_network_phase(traces[i], expected), atol=1e-8
+        )
@@ -0,0 +1,159 @@
+import json
+
+import flammkuchen as fl
+import numpy as np
+import pytest
+from scipy.signal import medfilt
+
+from lotr.behavior import create_motor_regressors
+from lotr.data_preprocessing import runner
+from lotr.data_preprocessing.preprocessing import (
+    compute_motor_regressors,
+    filter_traces_streaming,
+)
+from lotr.data_preprocessing.traces import (
+    preprocess_traces,
+    preprocess_traces_vectorized,
+    running_median,
+)
+from lotr.experiment_class import LotrExperiment
+from lotr.utils import pearson_regressors
+
+np.random.seed(34224)
+
+
+@pytest.mark.parametrize("detrend_wnd_s", [100, None])
+def test_preprocess_traces_vectorized(detrend_wnd_s):
+    traces = (np.random.rand(2000, 50) * 100 + 50).astype(np.float32)
+    kwargs = dict(fn=5, smooth_wnd_s=5, detrend_wnd_s=detrend_wnd_s)
+
+    filtered = preprocess_traces(traces, **kwargs)
+    assert np.array_equal(
+        preprocess_traces_vectorized(traces, block_size=16, **kwargs),
+        filtered,
+        equal_nan=True,
+    )
+    assert np.allclose(
+        preprocess_traces_vectorized(traces.astype(np.float64), **kwargs),
+        filtered,
+        atol=1e-4,
+        equal_nan=True,
+    )
+
+
+def test_running_median_non_finite():
+    traces = np.random.rand(400, 6) * 100
+    traces[200, 1] = np.nan
+    traces[[0, 399], 2] = np.nan
+    traces[50, 3] = np.inf
+
+    filtered = running_median(traces, 25)
+    for i in range(traces.shape[1]):
+        assert np.array_equal(filtered[:, i], medfilt(traces[:, i], 25), equal_nan=True)
+
+
+def test_filter_traces_streaming(tmp_path):
+    raw_traces = np.random.rand(300, 3000) * 100 + 50
+    raw_traces = (raw_traces + np.linspace(0, 30, 300)[:, np.newaxis]).astype(
+        np.float32
+    )
+    fl.save(
+        tmp_path / "data_from_suite2p_unfiltered.h5",
+        dict(traces=raw_traces),
+        compression=None,
+    )
+
+    filter_traces_streaming(tmp_path, 5, block_size=64, detrend_wnd_s=100)
+
+    for key, detrend_wnd_s in zip(["detr", "undetr"], [100, None]):
+        filtered = preprocess_traces(raw_traces.T, 5, detrend_wnd_s=detrend_wnd_s)
+        assert np.allclose(
+            fl.load(tmp_path / "filtered_traces.h5", f"/{key}"),
+            filtered,
+            atol=1e-4,
+            equal_nan=True,
+        )
+
+
+def test_compute_motor_regressors(tmp_path, synthetic_fish):
+    path = synthetic_fish(tmp_path / "210101_f1_natmov", n_rois=300)
+    bouts_df = fl.load(path / "bouts_df.h5")
+    bouts_df["med_vig"] = np.random.uniform(0, 1, len(bouts_df))
+    fl.save(path / "bouts_df.h5", bouts_df)
+    compute_motor_regressors(path, LotrExperiment(path), block_size=64)
+    reg_df = fl.load(path / "motor_regressors.h5")
+
+    # Same as correlating the traces loaded in memory:
+    traces = fl.load(path / "filtered_traces.h5", "/detr").astype(np.float64)
+    traces_diff = np.zeros_like(traces)
+    traces_diff[:-1, :] = np.abs(np.diff(traces, axis=0))
+    reg_dict = create_motor_regressors(traces.shape[0], bouts_df, 5, min_bias=0.05)
+    expected = np.concatenate(
+        [pearson_regressors(t, reg_dict.values).T for t in [traces, traces_diff]],
+        axis=1,
+    )
+
+    assert list(reg_df.columns[: reg_dict.shape[1]]) == list(reg_dict.columns)
+    assert reg_df.shape == (300, 2 * reg_dict.shape[1])
+    assert np.allclose(reg_df.values, expected, atol=1e-6)
+
+
+def test_incremental_runner(tmp_path, monkeypatch):
+    calls = []
+
+    def _fake_step(output, input_file=None):
+        def _compute(path, exp, **kwargs):
+            calls.append(output)
+            if output == "bouts_df.h5" and (path / "fail").exists():
+                raise IndexError("no bouts")
+            content = (path / input_file).read_text() if input_file else ""
+            (path / output).write_text(content + output)
+
+        return _compute
+
+    steps = {k: dict(v) for k, v in runner.PREPROCESSING_STEPS.items()}
+    steps["bouts_df"]["function"] = _fake_step("bouts_df.h5")
+    steps["filtered_traces"]["function"] = _fake_step(
+        "filtered_traces.h5", "data_from_suite2p_unfiltered.h5"
+    )
+    steps["motor_regressors"]["function"] = _fake_step(
+        "motor_regressors.h5", "filtered_traces.h5"
+    )
+    monkeypatch.setattr(runner, "PREPROCESSING_STEPS", steps)
+    monkeypatch.setattr(runner, "LotrExperiment", lambda path: None)
+
+    paths = [tmp_path / f"fish{i}" for i in range(2)]
+    for path in paths:
+        path.mkdir()
+        (path / "data_from_suite2p_unfiltered.h5").write_text("raw")
+
+    report = runner.run_preprocessing(paths, report_file=tmp_path / "report.json")
+    assert report["n_failed"] == 0 and len(calls) == 6
+    assert json.loads((tmp_path / "report.json").read_text()) == report
+
+    # Nothing to recompute:
+    calls.clear()
+    runner.run_preprocessing(paths)
+    assert calls == []
+
+    # Changing the raw data of a fish recomputes only the steps depending on it:
+    (paths[0] / "data_from_suite2p_unfiltered.h5").write_text("new raw data")
+    runner.run_preprocessing(paths)
+    assert calls == ["filtered_traces.h5", "motor_regressors.h5"]
+
+    # Failures are reported, and dependent steps are blocked:
+    calls.clear()
+    (paths[1] / "fail").touch()
+    report = runner.run_preprocessing(paths, force=["bouts_df"])
+    assert report["n_failed"] == 1
+    steps_report = report["folders"][1]["steps"]
+    assert steps_report["bouts_df"]["status"] == "failed"
+    assert "IndexError" in steps_report["bouts_df"]["error"]
+    assert steps_report["filtered_traces"]["status"] == "skipped"
+    assert steps_report["motor_regressors"]["status"] == "blocked"
+
+    # The failed step is resumed in the next run:
+    (paths[1] / "fail").unlink()
+    calls.clear()
+    runner.run_preprocessing(paths)
+    assert calls == ["bouts_df.h5", "motor_regressors.h5"]
@@ -0,0 +1,63 @@
+import flammkuchen as fl
+import numpy as np
+import pandas as pd
+import pytest
+
+from lotr.analysis import shift_cropping
+from lotr.analysis.shift_cropping import crop_shifts_all_dataset
+from lotr.caching import DiskCache
+
+
+@pytest.fixture
+def fish_paths(tmp_path, synthetic_fish):
+    return [synthetic_fish(tmp_path / f"21010{i}_f1_natmov", seed=i) for i in range(3)]
+
+
+def _assert_same_crops(crops, other_crops):
+    for result, other_result in zip(crops, other_crops):
+        if isinstance(result, pd.DataFrame):
+            pd.testing.assert_frame_equal(result, other_result)
+        else:
+            np.testing.assert_allclose(result, other_result, rtol=1e-5, atol=1e-6)
+
+
+def test_crop_shifts_all_dataset_workers(fish_paths):
+    crops = crop_shifts_all_dataset(crop_stimulus=True, paths=fish_paths)
+    parallel_crops = crop_shifts_all_dataset(
+        crop_stimulus=True, paths=fish_paths, n_workers=2
+    )
+    _assert_same_crops(crops, parallel_crops)
+
+    phase_cropped, _, stim_cropped, events_df, time_arr = crops
+    assert phase_cropped.shape == (len(time_arr), len(events_df))
+    assert list(events_df["fid"].unique()) == [p.name for p in fish_paths]
+    assert not np.isnan(stim_cropped).all()
+
+
+def test_crop_shifts_all_dataset_cache(tmp_path, fish_paths, monkeypatch):
+    computed = []
+    crop_shifts_fish = shift_cropping._crop_shifts_fish
+
+    def _crop_shifts_fish(exp, *args):
+        computed.append(exp.root.name)
+        return crop_shifts_fish(exp, *args)
+
+    monkeypatch.setattr(shift_cropping, "_crop_shifts_fish", _crop_shifts_fish)
+    cache = DiskCache(tmp_path / "cache")
+
+    crops = crop_shifts_all_dataset(paths=fish_paths, cache=cache)
+    assert computed == [p.name for p in fish_paths]
+
+    # Nothing is recomputed with the same files:
+    cached_crops = crop_shifts_all_dataset(paths=fish_paths, cache=cache)
+    assert len(computed) == len(fish_paths)
+    _assert_same_crops(crops, cached_crops)
+
+    # Changing the files of a fish recomputes only that fish:
+    bouts_df = fl.load(fish_paths[1] / "bouts_df.h5")
+    bouts_df["bias"] = -bouts_df["bias"]
+    fl.save(fish_paths[1] / "bouts_df.h5", bouts_df)
+
+    new_crops = crop_shifts_all_dataset(paths=fish_paths, cache=cache)
+    assert computed[len(fish_paths) :] == [fish_paths[1].name]
+    assert not np.array_equal(new_crops[1], crops[1])
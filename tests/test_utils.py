@@ -0,0 +1,257 @@
+import flammkuchen as fl
+import numpy as np
+
+from lotr.analysis.activity_profile import resample_and_shift_traces
+from lotr.analysis.heading_dir_quant import quantify_corr_with_heading
+from lotr.lazy_arrays import LazyH5Array
+from lotr.utils import (
+    EventStats,
+    circular_corr,
+    circular_shift_null,
+    crop,
+    interp_weights,
+    pearson_regressors,
+    pearson_regressors_blocked,
+    resample_matrix,
+    rolling_circular_corr,
+    rolling_corr,
+)
+
+np.random.seed(34224)
+
+
+def _pairwise_circular_corr(th, ph):
+    # Direct implementation of the Fisher & Lee definition, over all pairs:
+    i, j = np.triu_indices(len(th), k=1)
+    th_sin, ph_sin = np.sin(th[i] - th[j]), np.sin(ph[i] - ph[j])
+    return np.sum(th_sin * ph_sin) / np.sqrt(np.sum(th_sin**2) * np.sum(ph_sin**2))
+
+
+def test_circular_corr():
+    th = np.random.uniform(-np.pi, np.pi, (300, 3))
+    ph = th + np.random.normal(0, [0.1, 1, 10], (300, 3))
+
+    expected = [_pairwise_circular_corr(th[:, i], ph[:, i]) for i in range(3)]
+    assert np.allclose(circular_corr(th[:, 0], ph[:, 0]), expected[0])
+    assert np.allclose(circular_corr(th, ph), expected)
+    assert np.allclose(circular_corr(th.T, ph.T, axis=1), expected)
+
+
+def test_rolling_circular_corr():
+    th = np.random.uniform(-np.pi, np.pi, (500, 2))
+    ph = th + np.random.normal(0, 1, (500, 2))
+    wnd_pts = 50
+
+    rolled = rolling_circular_corr(th, ph, wnd_pts)
+    assert rolled.shape == (500 - wnd_pts + 1, 2)
+    for start in [0, 123, 500 - wnd_pts]:
+        assert np.allclose(
+            rolled[start],
+            circular_corr(th[start : start + wnd_pts], ph[start : start + wnd_pts]),
+        )
+    assert np.allclose(rolling_circular_corr(th[:, 0], ph[:, 0], wnd_pts), rolled[:, 0])
+
+
+def test_rolling_corr():
+    x = np.cumsum(np.random.normal(0, 0.1, (1000, 2)), axis=0)
+    y = 0.5 * x + np.cumsum(np.random.normal(0, 0.1, (1000, 2)), axis=0) + 100
+    x[600, 1] = np.nan
+
+    windows = [20, 101]
+    for wnd_pts, rolled in zip(windows, rolling_corr(x, y, windows)):
+        assert rolled.shape == (1000 - wnd_pts + 1, 2)
+        for i in range(2):
+            expected = [
+                np.corrcoef(x[s : s + wnd_pts, i], y[s : s + wnd_pts, i])[0, 1]
+                for s in range(1000 - wnd_pts + 1)
+            ]
+            assert np.allclose(rolled[:, i], expected, equal_nan=True)
+
+    # Windows of 2 * wnd_pts points, as in the original loop:
+    correlations = quantify_corr_with_heading(x[:, 0], y[:, 0], wnd_pts=10)
+    assert correlations.shape == (1000 - 20,)
+    assert np.allclose(correlations, rolling_corr(x[:, 0], y[:, 0], 20)[:-1])
+
+
+def test_interp_weights():
+    values = np.random.normal(0, 1, (50, 3))
+    fx = np.sort(np.random.uniform(-3, 3, 50))
+    x = np.linspace(-np.pi, np.pi, 100)
+
+    for period, source_x in [(None, fx), (2 * np.pi, np.random.permutation(fx))]:
+        expected = np.stack(
+            [np.interp(x, source_x, v, period=period) for v in values.T], axis=1
+        )
+        assert np.allclose(
+            interp_weights(x, source_x, period=period) @ values, expected
+        )
+
+
+def test_resample_and_shift_traces():
+    traces = np.random.normal(0, 1, (200, 30))
+    angles = np.random.uniform(-np.pi, np.pi, 30)
+    phase = np.random.uniform(-np.pi, np.pi, 200)
+    n_bins = 40
+
+    resampled, shifted = resample_and_shift_traces(traces, angles, phase, n_bins)
+
+    sort_idxs = np.argsort(angles)
+    base = np.linspace(-np.pi, np.pi, n_bins)
+    shifts = np.round(phase / (2 * np.pi) * (n_bins - 1)).astype(int)
+    for i in range(200):
+        expected = np.interp(base, angles[sort_idxs], traces[i, sort_idxs])
+        assert np.allclose(resampled[i], expected)
+        assert np.allclose(shifted[i], np.roll(expected, -shifts[i]))
+
+
+def test_crop():
+    traces = np.random.normal(0, 1, (1000, 7)).astype(np.float32)
+    events = np.array([5, 100, 500, 990, 300])
+
+    cropped = crop(traces, events, pre_int=20, post_int=30)
+    assert cropped.shape == (50, 5, 7) and cropped.dtype == np.float64
+
+    # Events at the borders are nan, the others match the cropping of single traces:
+    assert np.isnan(cropped[:, [0, 3]]).all()
+    for i in range(traces.shape[1]):
+        expected = crop(traces[:, i], events, pre_int=20, post_int=30)
+        assert np.allclose(cropped[:, [1, 2, 4], i], expected[:, [1, 2, 4]])
+
+    preserved = crop(traces, events, pre_int=20, post_int=30, preserve_dtype=True)
+    assert preserved.dtype == np.float32
+    assert np.array_equal(preserved, cropped.astype(np.float32), equal_nan=True)
+
+    windows = crop(traces, events, pre_int=20, post_int=30, dwn=2, copy=False)
+    assert len(windows) == 3 and list(windows.valid) == [0, 1, 1, 0, 1]
+    assert np.shares_memory(windows[0], traces)
+    assert np.array_equal(
+        windows.to_array(dtype=np.float64),
+        crop(traces, events, 20, 30, dwn=2),
+        equal_nan=True,
+    )
+    assert np.allclose(windows.mean(), np.nanmean(windows.to_array(), 1))
+
+
+def test_event_stats():
+    traces = np.random.normal(0, 1, (3000, 4))
+    events = np.random.randint(0, 3000, 300)
+    cropped = crop(traces, events, pre_int=20, post_int=30)
+    baseline_sub = cropped - np.nanmean(cropped[:20], 0)
+
+    kwargs = dict(baseline_pts=20, quantile_bins=np.linspace(-5, 5, 501))
+    stats = EventStats(**kwargs).update(
+        crop(traces, events, pre_int=20, post_int=30, copy=False), chunk_size=32
+    )
+    assert np.allclose(stats.mean, np.nanmean(cropped, 1))
+    assert np.allclose(stats.var, np.nanvar(cropped, 1))
+    assert np.allclose(stats.baseline_subtracted_mean, np.nanmean(baseline_sub, 1))
+    assert np.allclose(stats.quantile(0.5), np.nanmedian(cropped, 1), atol=0.05)
+
+    # Merging statistics from different groups of events:
+    merged = EventStats(**kwargs).update(cropped[:, :100])
+    merged.merge(EventStats(**kwargs).update(cropped[:, 100:]))
+    assert np.allclose(merged.var, stats.var)
+    assert np.allclose(merged.baseline_subtracted_var, np.nanvar(baseline_sub, 1))
+    assert np.array_equal(merged.quantile(0.9), stats.quantile(0.9))
+
+    # Single traces:
+    single = EventStats().update(crop(traces[:, 0], events, 20, 30, copy=False))
+    assert np.allclose(single.mean, stats.mean[:, 0])
+
+
+def test_event_stats_single_trace():
+    trace = np.random.normal(0, 1, 1000)
+    events = np.array([3, 15, 100, 400, 700, 985, 995])  # near both ends
+    kwargs = dict(baseline_pts=20, quantile_bins=np.linspace(-5, 5, 501))
+
+    # Reference crops, nan-filled for the events too close to the borders:
+    valid = (events > 20) & (events < 1000 - 30)
+    expected = np.full((50, len(events)), np.nan)
+    for i in np.flatnonzero(valid):
+        expected[:, i] = trace[events[i] - 20 : events[i] + 30]
+    baseline_sub = expected - np.nanmean(expected[:20], 0)
+
+    # 1D crops are filled with zeros by default:
+    zero_filled = crop(trace, events, pre_int=20, post_int=30)
+    assert (zero_filled[:, ~valid] == 0).all()
+
+    for stats in [
+        EventStats(**kwargs).update(crop(trace, events, 20, 30, fill_value=np.nan)),
+        EventStats(**kwargs).update(zero_filled, valid=valid),
+        EventStats(**kwargs).update(crop(trace, events, 20, 30, copy=False)),
+    ]:
+        assert np.array_equal(stats.count, np.full(50, valid.sum()))
+        assert np.allclose(stats.mean, np.nanmean(expected, 1))
+        assert np.allclose(stats.var, np.nanvar(expected, 1))
+        assert np.allclose(stats.baseline_subtracted_mean, np.nanmean(baseline_sub, 1))
+        assert np.allclose(stats.quantile(0.5), np.nanmedian(expected, 1), atol=0.05)
+
+
+def test_resample_matrix():
+    fx = np.arange(1, 301) / 3 - 20
+    x = np.arange(0, 260) / 5 - 21  # also out of the source range
+    matrix = np.random.normal(0, 1, (300, 10))
+    matrix[50, 3], matrix[:, 7] = np.nan, np.nan
+    matrix[fx == 0, 5] = np.nan  # nans in points matching exactly target coords
+
+    expected = np.stack([np.interp(x, fx, col) for col in matrix.T], axis=1)
+    resampled = resample_matrix(x, fx, matrix)
+    assert np.allclose(resampled, expected, equal_nan=True)
+    assert np.array_equal(np.isnan(resampled), np.isnan(expected))
+
+
+def test_pearson_regressors_blocked(tmp_path):
+    n_pts = 2000
+    traces = np.random.normal(0, 1, (n_pts, 250)) + np.random.normal(0, 1, (n_pts, 1))
+    regressors = np.random.normal(0, 1, (n_pts, 4))
+    kwargs = dict(block_size=64, n_workers=2)
+
+    expected = pearson_regressors(traces, regressors)
+    assert np.allclose(
+        pearson_regressors_blocked(traces, regressors, **kwargs), expected
+    )
+    assert np.allclose(
+        pearson_regressors_blocked(traces, regressors[:, 0], **kwargs), expected[0]
+    )
+
+    traces_derivative = np.zeros(traces.shape)
+    traces_derivative[:-1, :] = np.abs(np.diff(traces, axis=0))
+    assert np.allclose(
+        pearson_regressors_blocked(traces, regressors, derivative=True, **kwargs),
+        pearson_regressors(traces_derivative, regressors),
+    )
+
+    # float32 accumulation within the documented bound:
+    result_32 = pearson_regressors_blocked(
+        traces, regressors, dtype=np.float32, **kwargs
+    )
+    assert result_32.dtype == np.float32
+    assert np.abs(result_32 - expected).max() < (n_pts + 3) * 2**-24
+
+    # Blocks read from file:
+    fl.save(tmp_path / "traces.h5", dict(traces=traces))
+    lazy_traces = LazyH5Array(tmp_path / "traces.h5", "/traces")
+    assert np.allclose(
+        pearson_regressors_blocked(lazy_traces, regressors, **kwargs), expected
+    )
+
+
+def test_circular_shift_null():
+    n_pts = 2000
+    regressors = np.random.normal(0, 1, (n_pts, 3))
+    traces = np.random.normal(0, 1, (n_pts, 100))
+    traces[:, :10] += regressors[:, [0]]
+
+    correlations, p_values, null = circular_shift_null(
+        traces, regressors, n_shifts=200, block_size=30, seed=1, return_null=True
+    )
+    assert np.allclose(correlations, pearson_regressors(traces, regressors))
+    assert null.shape == (3, 200, 100)
+    assert (p_values[0, :10] == 1 / 201).all() and (p_values[0, 10:] > 0.001).all()
+
+    # Null correlations are the ones with the shifted regressors:
+    shifts = np.arange(200, n_pts - 200 + 1)
+    shifts = np.sort(np.random.default_rng(1).choice(shifts, 200, replace=False))
+    assert np.allclose(
+        null[1, 5], pearson_regressors(traces, np.roll(regressors[:, 1], shifts[5]))
+    )